@@ -103,6 +103,32 @@ REST_FRAMEWORK = {
     )
 }
 
+# Redis settings
+REDIS_URL = 'redis://127.0.0.1:6379'
+
+# Redis of the consumer app, which holds the socket presence keys and the 'onChat' channel
+CONSUMER_APP_REDIS_BACKEND = config('CONSUMER_APP_REDIS_BACKEND', default='http')  # 'http' or 'direct'
+CONSUMER_APP_REDIS_URL = config('CONSUMER_APP_REDIS_URL', default='')  # used by the direct backend
+CONSUMER_APP_REDIS_TIMEOUT = 5  # seconds, for the http backend
+
+# Cache of rows read from the homes database (see Homes/cache.py)
+HOMES_CACHE_TTL = 5 * 60  # seconds
+HOMES_CACHE_MAX_SIZE = 1000  # entries kept in process per model
+HOMES_CACHE_USE_REDIS = True
+HOMES_CACHE_LOCAL_TTL = 30  # seconds for which other processes may serve an entry invalidated through redis
+
+# Responsive renditions of uploaded scout pictures and documents (see utility.image_utils.create_image_renditions)
+IMAGE_RENDITION_WIDTHS = (160, 320, 640, 1280)
+IMAGE_RENDITION_FORMATS = {'WEBP': 75, 'JPEG': 80}  # PIL format name -> quality
+
+# Uploads made by the apps straight to the media storage (see utility.upload_utils.create_presigned_upload)
+DIRECT_UPLOAD_EXPIRY = 15 * 60  # seconds for which an upload can be started
+DIRECT_UPLOAD_FINALIZE_EXPIRY = 24 * 60 * 60  # seconds for which an upload can be finalized
+DIRECT_UPLOAD_MAX_SIZE = 20 * 1024 * 1024  # bytes
+
+# Firebase cloud messaging
+FCM_END_POINT = 'https://fcm.googleapis.com/fcm/send'
+
 # Celery settings
 CELERY_BROKER_URL = 'redis://127.0.0.1:6379'
 CELERY_RESULT_BACKEND = 'redis://127.0.0.1:6379'
@@ -112,7 +138,32 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERYBEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 CELERY_TIMEZONE = 'UTC'
 CELERY_ENABLE_UTC = True
-CELERY_BEAT_SCHEDULE = {}
+CELERY_BEAT_SCHEDULE = {
+    'assign-pending-scout-tasks': {
+        'task': 'scouts.tasks.assign_pending_scout_tasks',
+        'schedule': 30.0,  # scouts.utils.BATCH_SCOUT_ASSIGNMENT_INTERVAL
+    },
+    'reject-expired-scout-assignment-requests': {
+        'task': 'scouts.tasks.reject_expired_scout_assignment_requests',
+        'schedule': 5.0,  # scouts.utils.SCOUT_ASSIGNMENT_REQUEST_SWEEP_INTERVAL
+    },
+    'rebuild-scout-availability-index': {
+        'task': 'scouts.tasks.rebuild_scout_availability_index',
+        'schedule': 60 * 60.0,
+    },
+    'reconcile-scout-wallets': {
+        'task': 'scouts.tasks.reconcile_scout_wallets',
+        'schedule': 24 * 60 * 60.0,
+    },
+    'deliver-pending-chat-messages': {
+        'task': 'chat.tasks.deliver_pending_chat_messages',
+        'schedule': 60.0,  # chat.utils.CHAT_DELIVERY_SWEEP_INTERVAL
+    },
+    'dispatch-scout-push-notifications': {
+        'task': 'scouts.tasks.dispatch_scout_push_notifications',
+        'schedule': 2.0,  # scouts.utils.SCOUT_PUSH_DISPATCH_INTERVAL
+    },
+}
 
 # allauth Settings
 ACCOUNT_UNIQUE_EMAIL = False
@@ -2,13 +2,14 @@ from random import randint
 
 from django.db import models
 from django.db.models import Min
-from geopy import units, distance
+from geopy import units
 from multiselectfield import MultiSelectField
 
 from Homes.Houses.utils import (HouseTypeCategories, HouseFurnishTypeCategories, HouseAccomodationAllowedCategories,
                                 HouseAccomodationTypeCategories, get_house_picture_upload_path,
                                 SpaceAvailabilityCategories, AVAILABLE, generate_accomodation_allowed_str)
 from common.models import AddressDetail
+from utility.geo_utils import rank_by_distance
 
 
 class Bed(models.Model):
@@ -91,16 +92,16 @@ class HouseManager(models.Manager):
 
     @staticmethod
     def sorted_nearby(latitude, longitude, distance_range=5, queryset=None):
-        if not queryset:
+        if queryset is None:
             queryset = HouseManager.nearby(latitude, longitude, distance_range)
-        result = []
-        for house in queryset:
-            exact_distance = distance.distance((latitude, longitude), (house.address.latitude,
-                                                                       house.address.longitude)).km
-            result.append((house, exact_distance))
-
-        result.sort(key=lambda x: x[1])
-        return result
+
+        candidates = queryset.values_list('id', 'address__latitude', 'address__longitude').distinct()
+        ranked_houses = rank_by_distance(latitude, longitude, candidates)
+
+        houses = House.objects.using(queryset.db).select_related('address').in_bulk(
+            [house_id for house_id, _ in ranked_houses])
+        return [(houses[house_id], exact_distance) for house_id, exact_distance in ranked_houses
+                if house_id in houses]
 
 
 class House(models.Model):
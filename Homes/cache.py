@@ -0,0 +1,40 @@
+from django.conf import settings
+
+from Homes.Houses.models import House, HouseAddressDetail, HouseVisit
+from UserBase.models import Customer
+from utility.cache_utils import ReadThroughCache
+
+
+def load_houses(house_ids):
+    return House.objects.using(settings.HOMES_DB).select_related('address').in_bulk(house_ids)
+
+
+def load_house_visits(visit_ids):
+    return HouseVisit.objects.using(settings.HOMES_DB).select_related('customer__user').in_bulk(visit_ids)
+
+
+def load_customers(customer_ids):
+    return Customer.objects.using(settings.HOMES_DB).select_related('user').in_bulk(customer_ids)
+
+
+def create_homes_cache(name, loader):
+    return ReadThroughCache(name, loader, ttl=settings.HOMES_CACHE_TTL, max_size=settings.HOMES_CACHE_MAX_SIZE,
+                            use_redis=settings.HOMES_CACHE_USE_REDIS, local_ttl=settings.HOMES_CACHE_LOCAL_TTL)
+
+
+house_cache = create_homes_cache('house', load_houses)
+house_visit_cache = create_homes_cache('house_visit', load_house_visits)
+customer_cache = create_homes_cache('customer', load_customers)
+
+HOMES_CACHES = {cache.name: cache for cache in (house_cache, house_visit_cache, customer_cache)}
+
+
+def invalidate_house_addresses(address_ids):
+    """ addresses are cached within their house, so the houses owning the addresses are invalidated """
+    house_cache.invalidate([house_id for house_id in HouseAddressDetail.objects.using(settings.HOMES_DB).filter(
+        id__in=address_ids).values_list('house_id', flat=True) if house_id is not None])
+
+
+# name of the model changed by the consumer app -> invalidation of the cached objects with the given ids
+HOMES_CACHE_INVALIDATORS = dict({name: cache.invalidate for name, cache in HOMES_CACHES.items()},
+                                house_address=invalidate_house_addresses)
@@ -1,6 +1,6 @@
-from django.conf import settings
 from rest_framework import serializers
 
+from Homes.cache import customer_cache
 from UserBase.models import Customer
 from chat.models import Conversation, Message, Participant
 from chat.utils import TYPE_CUSTOMER, TYPE_SCOUT, ROLE_SENDER, ROLE_RECEIVER
@@ -32,7 +32,7 @@ class ParticipantSerializer(serializers.ModelSerializer):
     @staticmethod
     def get_profile(obj):
         if obj.type == TYPE_CUSTOMER:
-            return CustomerDetailSerializer(Customer.objects.using(settings.HOMES_DB).get(id=obj.customer_id)).data
+            return CustomerDetailSerializer(customer_cache.get(obj.customer_id)).data
         elif obj.type == TYPE_SCOUT:
             return ScoutDetailSerializer(obj.scout).data
 
@@ -60,7 +60,8 @@ class MessageSerializer(serializers.ModelSerializer):
     @staticmethod
     def get_customer_name(obj):
         try:
-            return obj.conversation.participants.filter(type=TYPE_CUSTOMER).first().name
+            return next(participant for participant in obj.conversation.participants.all()
+                        if participant.type == TYPE_CUSTOMER).name
         except:
             return None
 
@@ -80,10 +81,18 @@ class MessageSerializer(serializers.ModelSerializer):
 class ConversationListSerializer(serializers.ModelSerializer):
     other_participant = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Conversation
-        fields = ('id', 'other_participant', 'task', 'last_message')
+        fields = ('id', 'other_participant', 'task', 'last_message', 'unread_count')
+
+    def get_unread_count(self, obj):
+        if hasattr(obj, 'unread_count'):
+            return obj.unread_count or 0
+
+        unread_count = obj.unread_counts.filter(participant=self.context['requesting_participant']).first()
+        return unread_count.count if unread_count else 0
 
     def get_other_participant(self, obj):
         try:
@@ -97,5 +106,7 @@ class ConversationListSerializer(serializers.ModelSerializer):
     def get_last_message(self, obj):
         last_message = obj.last_message
         if last_message:
+            # reuse the conversation with its prefetched participants
+            last_message.conversation = obj
             return MessageSerializer(last_message, context=self.context).data
 
@@ -2,19 +2,25 @@ import json
 from copy import deepcopy
 
 import requests
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from decouple import config
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from rest_framework import status
 from rest_framework.exceptions import ValidationError
-from rest_framework.generics import ListAPIView, ListCreateAPIView
+from rest_framework.generics import ListAPIView, ListCreateAPIView, GenericAPIView, get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from UserBase.models import Customer
 from chat.api.serializers import ConversationListSerializer, MessageSerializer
-from chat.models import Conversation, Message, Participant
-from chat.paginators import ChatPagination
+from chat.models import Conversation, Message, Participant, ConversationUnreadCount, mark_messages_read
+from chat.paginators import ChatPagination, MessageCursorPagination
+from chat.presence import get_participant_group_name, is_participant_online
+from chat.tasks import deliver_chat_messages
 from chat.utils import TYPE_CUSTOMER, TYPE_SCOUT, NODE_SERVER_CHAT_ENDPOINT, \
     SCOUT_CUSTOMER_SOCKET_CHAT_CONVERSATION_PREFIX
 from customers.models import CustomerNotification, CustomerNotificationCategory
@@ -23,7 +29,7 @@ from scouts.models import Scout, ScoutTask, ScoutNotification, ScoutNotification
 from scouts.utils import NEW_MESSAGE_RECEIVED
 from utility.environments import PRODUCTION
 from utility.logging_utils import sentry_debug_logger
-from utility.redis_utils import ConsumerAppRedis
+from utility.redis_utils import get_consumer_app_redis, publish_if_online
 from utility.rest_auth_utils import ChatParticipantAuthentication
 
 
@@ -57,7 +63,11 @@ class ConversationListView(ListAPIView):
         # will be used to pass in serializer context
         # noinspection PyAttributeOutsideInit
         self.requesting_participant = get_participant_from_request(self.request)
-        queryset = Conversation.objects.filter(participants=self.requesting_participant)
+        unread_count = ConversationUnreadCount.objects.filter(conversation=OuterRef('pk'),
+                                                              participant=self.requesting_participant)
+        queryset = Conversation.objects.filter(participants=self.requesting_participant).select_related(
+            'task', 'last_message__sender').prefetch_related('participants__scout__user').annotate(
+            unread_count=Subquery(unread_count.values('count')[:1]))
 
         if self.requesting_participant.type == TYPE_CUSTOMER:
             if 'task_id' in self.request.GET:
@@ -66,9 +76,8 @@ class ConversationListView(ListAPIView):
                 if task and task.conversation:
                     queryset = queryset.filter(participants=task.scout.chat_participant, task=task)
 
-        return sorted(queryset,
-                      key=lambda t: t.last_message_timestamp,
-                      reverse=True)
+        # conversations without messages come last as nulls sort first in ascending order
+        return queryset.order_by('-last_message_at', '-id')
 
     def get_serializer_context(self):
         data = super(ConversationListView, self).get_serializer_context()
@@ -81,6 +90,8 @@ def send_message_to_receiver_participant_via_consumer_app(msg, data, receiver_pa
     # TODO: The chat may fail when scout chats with customer when scout_id = customer_id because that will lead to
     # TODO: same key for redis i.e for e.g  SCOUTCHAT:5 = SCOUTCHAT:5 so the better solution will be to use participant
     # TODO: id
+    Receivers connected to ChatConsumer are looked up in chat.presence, which is keyed by participant id, and only
+    the others are routed through the consumer app.
     """
     data_copy = deepcopy(data)
 
@@ -95,22 +106,24 @@ def send_message_to_receiver_participant_via_consumer_app(msg, data, receiver_pa
         data['sender'] = msg.sender.scout.id
         data['receiver'] = SCOUT_CUSTOMER_SOCKET_CHAT_CONVERSATION_PREFIX + str(customer_id)
 
+    if is_participant_online(receiver_participant.id, msg.conversation_id):
+        # the receiver has the conversation open on a socket of ChatConsumer
+        async_to_sync(get_channel_layer().group_send)(get_participant_group_name(receiver_participant.id), {
+            'type': 'chat_message',
+            'message': msg.content,
+            'sender': msg.sender_id,
+            'conversation': msg.conversation_id,
+        })
+        return
+
     # Send Message if Online
     if settings.ENVIRONMENT == PRODUCTION:
-        r = ConsumerAppRedis()
-
-        if r.get(data['receiver']):  # Receiver is Online
-            # sentry_debug_logger.debug("user is online")
-            data['message_data'] = data_copy
-            # In case of socket the role will always be receiver
-            data['message_data']['role'] = 'receiver'
-            scout_chat_receiver_id = data['receiver']
-
-            if r.get(scout_chat_receiver_id):
-                msg = json.dumps(data)
-                r.publish('onChat', msg)
+        data['message_data'] = data_copy
+        # In case of socket the role will always be receiver
+        data['message_data']['role'] = 'receiver'
 
-        else:
+        # the message is published only if the receiver is online
+        if not publish_if_online(get_consumer_app_redis(), data['receiver'], 'onChat', json.dumps(data)):
             # sentry_debug_logger.debug('user is offline')
 
             if receiver_participant.type == TYPE_SCOUT:
@@ -143,7 +156,7 @@ class MessageListCreateView(ListCreateAPIView):
     serializer_class = MessageSerializer
     authentication_classes = (ChatParticipantAuthentication,)
     permission_classes = [IsAuthenticated, ]
-    pagination_class = ChatPagination
+    pagination_class = MessageCursorPagination
 
     def create(self, request, *args, **kwargs):
         # will be used to pass in serializer context
@@ -158,9 +171,10 @@ class MessageListCreateView(ListCreateAPIView):
             msg = serializer.save(conversation=conversation, sender=self.requesting_participant,
                                   receiver=conversation.other_participant(self.requesting_participant))
 
-            message_data = MessageSerializer(msg, context=self.get_serializer_context()).data
-            send_message_to_receiver_participant_via_consumer_app(msg=msg, data=message_data,
-                                                                  receiver_participant=msg.receiver)
+            if msg.receiver_id:
+                # acknowledged once persisted, delivery to the receiver happens in the background
+                receiver_id = msg.receiver_id
+                transaction.on_commit(lambda: deliver_chat_messages.delay(receiver_id))
 
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
@@ -171,9 +185,29 @@ class MessageListCreateView(ListCreateAPIView):
         # noinspection PyAttributeOutsideInit
         self.requesting_participant = get_participant_from_request(self.request)
         return Message.objects.filter(conversation__id=self.kwargs.get('pk'),
-                                      conversation__participants=self.requesting_participant).order_by("-created_at")
+                                      conversation__participants=self.requesting_participant).select_related(
+            'sender', 'conversation__task').prefetch_related('conversation__participants').order_by("-created_at",
+                                                                                                   "-id")
 
     def get_serializer_context(self):
         data = super(MessageListCreateView, self).get_serializer_context()
         data['requesting_participant'] = self.requesting_participant
         return data
+
+
+class MessageReadView(GenericAPIView):
+    """ Marks the messages received by the requesting participant up to the given message as read """
+    authentication_classes = (ChatParticipantAuthentication,)
+    permission_classes = [IsAuthenticated, ]
+
+    def post(self, request, *args, **kwargs):
+        requesting_participant = get_participant_from_request(self.request)
+        conversation = get_object_or_404(Conversation, id=self.kwargs.get('pk'), participants=requesting_participant)
+
+        try:
+            message_id = int(request.data['message_id'])
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError({'message_id': 'A message id is required'})
+
+        read_count, unread_count = mark_messages_read(conversation.id, requesting_participant.id, message_id)
+        return Response({'read_count': read_count, 'unread_count': unread_count}, status=status.HTTP_200_OK)
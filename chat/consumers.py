@@ -1,97 +1,218 @@
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+import asyncio
 import json
 
-from rest_framework.generics import get_object_or_404
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.db import InterfaceError, OperationalError
+from django.utils import timezone
 
-from chat.models import Conversation, Participant, Message
+from chat.models import Message, Participant, persist_messages
+from chat.presence import PRESENCE_REFRESH_INTERVAL, get_participant_group_name, participant_connected, \
+    participant_disconnected, refresh_participant_presence
+from chat.utils import get_cached_chat_membership, get_cached_chat_participant_id, set_cached_chat_membership, \
+    set_cached_chat_participant_id
+from utility.logging_utils import sentry_debug_logger
 
+MESSAGE_FLUSH_INTERVAL = 0.05  # seconds for which incoming messages are gathered before being written together
+MESSAGE_FLUSH_BATCH_SIZE = 500
+MESSAGE_PERSIST_BATCH_ATTEMPTS = 3  # before the messages of a failing batch are written one at a time
+MESSAGE_PERSIST_RETRY_DELAY = 0.5  # seconds, doubled on every retry
+MESSAGE_PERSIST_MAX_RETRY_DELAY = 30  # seconds
 
-# Authentication https://channels.readthedocs.io/en/latest/topics/authentication.html#
-
-def check_whether_logged_in_participant_belongs_to_this_conversation(conv, participant):
-    try:
-        conv.participants.get(id=participant.id)
-        return True
-    except Participant.DoesNotExist:
-        return False
-
-
-def get_participant_from_user(current_user):
-    """It finds the participation object from the current user"""
+# errors of the database connection rather than of the messages, writes failing with them are retried until they pass
+TRANSIENT_DATABASE_ERRORS = (OperationalError, InterfaceError)
 
-    return current_user.participant
 
+# Authentication https://channels.readthedocs.io/en/latest/topics/authentication.html#
 
-class ChatConsumer(WebsocketConsumer):
-    def connect(self):
-        current_user = self.scope["user"]
+def get_conversation_participants(user, conversation_id):
+    """
+    Authorizes a socket connection. Both the scout participant of the user and the membership of the participant in
+    the conversation are cached, so reconnects are served from redis without touching the database.
+    :return: (participant id of the user in the conversation, id of the other participant of the conversation), both
+             None if the user does not belong to the conversation
+    """
+    if not user.is_authenticated or not conversation_id.isdigit():
+        return None, None
+
+    participant_id = get_cached_chat_participant_id(user.id)
+    if participant_id is None:
+        participant_id = Participant.objects.filter(scout__user=user).values_list('id', flat=True).first()
+        if participant_id is None:
+            return None, None
+        set_cached_chat_participant_id(user.id, participant_id)
+
+    membership = get_cached_chat_membership(participant_id, conversation_id)
+    if membership is None:
+        participant_ids = list(Participant.objects.filter(conversations__id=conversation_id).values_list(
+            'id', flat=True))
+        other_participant_ids = [i for i in participant_ids if i != participant_id]
+        membership = {
+            'member': participant_id in participant_ids,
+            'other_participant_id': other_participant_ids[0] if other_participant_ids else None,
+        }
+        set_cached_chat_membership(participant_id, conversation_id, **membership)
+
+    if not membership['member']:
+        return None, None
+    return participant_id, membership['other_participant_id']
+
+
+class MessageBatchWriter(object):
+    """
+    Persists the messages received by all the sockets of a process in batches. Messages are queued without blocking
+    the event loop and a background task writes everything gathered in MESSAGE_FLUSH_INTERVAL with one bulk insert.
+    """
+
+    def __init__(self, flush_interval=MESSAGE_FLUSH_INTERVAL, batch_size=MESSAGE_FLUSH_BATCH_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.loop = None
+        self.queue = None
+        self.writer = None
+
+    def add(self, message):
+        loop = asyncio.get_event_loop()
+        if self.loop is not loop or self.writer.done():
+            self.loop = loop
+            self.queue = asyncio.Queue()
+            self.writer = loop.create_task(self.run())
+        self.queue.put_nowait(message)
+
+    async def get_batch(self):
+        batch = [await self.queue.get()]
+        deadline = self.loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        while True:
+            await self.write(await self.get_batch())
+
+    @staticmethod
+    def get_retry_delay(attempt):
+        return min(MESSAGE_PERSIST_RETRY_DELAY * 2 ** attempt, MESSAGE_PERSIST_MAX_RETRY_DELAY)
+
+    async def write(self, batch):
+        """
+        The messages have already been sent to the sockets, so a failing batch is retried and then written one
+        message at a time, which drops only the messages that cannot be written at all.
+        """
+        for attempt in range(MESSAGE_PERSIST_BATCH_ATTEMPTS):
+            try:
+                await database_sync_to_async(persist_messages)(batch)
+                return
+            except Exception as E:
+                sentry_debug_logger.error('error while persisting {} chat messages: {}'.format(len(batch), str(E)),
+                                          exc_info=True)
+                if not isinstance(E, TRANSIENT_DATABASE_ERRORS):
+                    break
+            await asyncio.sleep(self.get_retry_delay(attempt))
+
+        for message in batch:
+            await self.write_message(message)
+
+    async def write_message(self, message):
+        attempt = 0
+        while True:
+            # a rolled back bulk insert may have set the id
+            message.id = None
+            try:
+                await database_sync_to_async(message.save)()
+                return
+            except TRANSIENT_DATABASE_ERRORS as E:
+                sentry_debug_logger.error('error while persisting chat message: ' + str(E), exc_info=True)
+            except Exception as E:
+                sentry_debug_logger.error('dropped chat message of conversation {} from participant {} to {} sent at '
+                                          '{}: {}'.format(message.conversation_id, message.sender_id,
+                                                          message.receiver_id, message.delivered_at, str(E)),
+                                          exc_info=True)
+                return
+            await asyncio.sleep(self.get_retry_delay(attempt))
+            attempt += 1
+
+
+message_writer = MessageBatchWriter()
+
+
+class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Socket of a scout in the conversation whose id is given as room name. Conversations have no room names of their
+    own and customers receive their messages through the consumer app, so only scout participants connect here.
+    """
+
+    async def connect(self):
         room_name = self.scope['url_route']['kwargs']['room_name']
-
-        print(room_name)
-
-        # This checks whether we have a Conversation with room name same sa that of
-        #  specified room name in kwargs of web socket url
-        conv = get_object_or_404(Conversation, chat_room_name=room_name)
-
-        participant = get_participant_from_user(current_user)
-        # This checks whether the currently logged in participant belongs to this conversation
-        access_status = check_whether_logged_in_participant_belongs_to_this_conversation(conv, participant)
-
-        self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = 'chat_%s' % self.room_name
-        self.conv = conv
-        self.participant = participant
-
-        print("room-name:", self.room_name)
-        print("group-name:", self.room_group_name)
-
-        print("accesible by this participant=", access_status)
-
-        if access_status:
-            # Join room group
-            async_to_sync(self.channel_layer.group_add)(
-                self.room_group_name,
-                self.channel_name
-            )
-
-            # Accept Connection
-            self.accept()
-
-    def disconnect(self, close_code):
-        print("disconnecting")
-        # Leave room group
-        async_to_sync(self.channel_layer.group_discard)(
-            self.room_group_name,
-            self.channel_name
-        )
+        self.participant_id, self.other_participant_id = await database_sync_to_async(
+            get_conversation_participants)(self.scope['user'], room_name)
+
+        if not self.participant_id:
+            await self.close()
+            return
+
+        self.conversation_id = int(room_name)
+
+        self.room_group_name = 'chat_{}'.format(self.conversation_id)
+        # Join room group
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        # messages sent to the participant over the api are delivered through the participant group
+        self.participant_group_name = get_participant_group_name(self.participant_id)
+        await self.channel_layer.group_add(self.participant_group_name, self.channel_name)
+        await self.accept()
+
+        await sync_to_async(participant_connected)(self.participant_id, self.conversation_id)
+        # kept up while the socket is open, whether the scout is sending or only reading
+        self.presence_heartbeat = asyncio.ensure_future(self.refresh_presence())
+
+    async def refresh_presence(self):
+        while True:
+            await asyncio.sleep(PRESENCE_REFRESH_INTERVAL)
+            await sync_to_async(refresh_participant_presence)(self.participant_id)
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'presence_heartbeat', None):
+            self.presence_heartbeat.cancel()
+        if getattr(self, 'room_group_name', None):
+            # Leave room group
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+            await self.channel_layer.group_discard(self.participant_group_name, self.channel_name)
+            await sync_to_async(participant_disconnected)(self.participant_id, self.conversation_id)
 
     # Receive message from WebSocket
-    def receive(self, text_data):
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data)['message']
+        except (TypeError, ValueError, KeyError):
+            return
 
-        print("received message from web socket is", message)
-
-        # Create Message in Database
-        Message.objects.create(conversation=self.conv,
-                               sender=self.participant,
-                               content=message)
+        # the message is delivered through the room group right away
+        message_writer.add(Message(conversation_id=self.conversation_id, sender_id=self.participant_id,
+                                   receiver_id=self.other_participant_id, content=message,
+                                   delivered_at=timezone.now()))
 
         # Send message to room group
-        async_to_sync(self.channel_layer.group_send)(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message
-            }
-        )
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'chat_message',
+            'message': message,
+            'sender': self.participant_id,
+        })
 
     # Receive message from room group
-    def chat_message(self, event):
-        message = event['message']
-        print("received message from group :", message)
+    async def chat_message(self, event):
+        if event.get('conversation', self.conversation_id) != self.conversation_id:
+            # sent to the participant group for another conversation of the participant
+            return
+
         # Send message to WebSocket
-        self.send(text_data=json.dumps({
-            'message': message
+        await self.send(text_data=json.dumps({
+            'message': event['message'],
+            'sender': event['sender'],
         }))
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.2 on 2026-10-17 14:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import OuterRef, Subquery
+
+
+def populate_conversation_last_message(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    last_messages = Message.objects.filter(conversation=OuterRef('pk')).order_by('-id')
+    Conversation.objects.update(last_message=Subquery(last_messages.values('id')[:1]),
+                                last_message_at=Subquery(last_messages.values('created_at')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_delete_socketclient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.Message'),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(populate_conversation_last_message, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.2 on 2026-10-17 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_conversation_last_message'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'created_at', 'id'], name='chat_message_conv_created_idx'),
+        ),
+    ]
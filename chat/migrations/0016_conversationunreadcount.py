@@ -0,0 +1,39 @@
+# Generated by Django 2.2.2 on 2026-10-17 15:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count
+
+
+def populate_unread_counts(apps, schema_editor):
+    ConversationUnreadCount = apps.get_model('chat', 'ConversationUnreadCount')
+    Message = apps.get_model('chat', 'Message')
+    unread_messages = Message.objects.filter(is_read=False, conversation__isnull=False, receiver__isnull=False) \
+        .values('conversation', 'receiver').annotate(count=Count('id')).order_by()
+    ConversationUnreadCount.objects.bulk_create([
+        ConversationUnreadCount(conversation_id=unread['conversation'], participant_id=unread['receiver'],
+                                count=unread['count'])
+        for unread in unread_messages], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_message_conversation_created_at_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationUnreadCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_counts', to='chat.Conversation')),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='unread_counts', to='chat.Participant')),
+            ],
+            options={
+                'unique_together': {('conversation', 'participant')},
+            },
+        ),
+        migrations.RunPython(populate_unread_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.2 on 2026-10-17 17:20
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_messages_delivered(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    Message.objects.update(delivered_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_conversationunreadcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_messages_delivered, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['receiver', 'delivered_at'], name='chat_message_recv_deliv_idx'),
+        ),
+    ]
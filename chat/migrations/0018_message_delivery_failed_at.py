@@ -0,0 +1,18 @@
+# Generated by Django 2.2.2 on 2026-10-17 21:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_message_delivered_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='delivery_failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,8 +1,13 @@
-from django.conf import settings
-from django.db import models
+from collections import Counter
 
-from UserBase.models import Customer
-from chat.utils import ParticipantTypeCategories, TYPE_SCOUT, TYPE_CUSTOMER
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, F, Case, When, OuterRef, Subquery
+from django.db.models.signals import post_save, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from Homes.cache import customer_cache
+from chat.utils import ParticipantTypeCategories, TYPE_SCOUT, TYPE_CUSTOMER, invalidate_cached_chat_memberships
 
 
 class Participant(models.Model):
@@ -23,10 +28,8 @@ class Participant(models.Model):
                 return str(None)
 
         elif self.type == TYPE_CUSTOMER:
-            try:
-                return Customer.objects.using(settings.HOMES_DB).get(id=self.customer_id).name
-            except Customer.DoesNotExist:
-                return str(None)
+            customer = customer_cache.get(self.customer_id)
+            return customer.name if customer else str(None)
 
 
 class Conversation(models.Model):
@@ -36,18 +39,17 @@ class Conversation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # denormalized from messages so that conversations can be ordered by recent activity in the database
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
     def __str__(self):
         return str(self.id)
 
-    @property
-    def last_message(self):
-        return self.messages.last()
-
     @property
     def last_message_timestamp(self):
-        last_message = self.last_message
-        if last_message:
-            return last_message.created_at.timestamp()
+        if self.last_message_at:
+            return self.last_message_at.timestamp()
         else:
             return 0
 
@@ -56,7 +58,8 @@ class Conversation(models.Model):
         :param obj: requesting participant
         :return: other participant
         """
-        return self.participants.exclude(id=obj.id).first()
+        # iterating over all() makes use of prefetched participants
+        return next((participant for participant in self.participants.all() if participant.id != obj.id), None)
 
 
 class Message(models.Model):
@@ -68,6 +71,120 @@ class Message(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     is_read = models.BooleanField(default=False)
     read_at = models.DateTimeField(null=True, blank=True)
+    # set once the message has been handed over to the consumer app
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    # set when delivery is given up after CHAT_DELIVERY_MAX_RETRIES, the message is then no longer retried
+    delivery_failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the messages of a conversation
+            models.Index(fields=['conversation', 'created_at', 'id'], name='chat_message_conv_created_idx'),
+            # undelivered messages of a receiver
+            models.Index(fields=['receiver', 'delivered_at'], name='chat_message_recv_deliv_idx'),
+        ]
 
     def __str__(self):
-        return str(self.id)
\ No newline at end of file
+        return str(self.id)
+
+
+class ConversationUnreadCount(models.Model):
+    """ number of unread messages received by a participant in a conversation, kept incrementally """
+    conversation = models.ForeignKey('Conversation', on_delete=models.CASCADE, related_name='unread_counts')
+    participant = models.ForeignKey('Participant', on_delete=models.CASCADE, related_name='unread_counts')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('conversation', 'participant')
+
+    def __str__(self):
+        return str(self.id)
+
+
+def increment_unread_count(conversation_id, participant_id, count=1):
+    if not ConversationUnreadCount.objects.filter(conversation_id=conversation_id, participant_id=participant_id) \
+            .update(count=F('count') + count):
+        try:
+            with transaction.atomic():
+                ConversationUnreadCount.objects.create(conversation_id=conversation_id, participant_id=participant_id,
+                                                       count=count)
+        except IntegrityError:
+            # created concurrently
+            ConversationUnreadCount.objects.filter(conversation_id=conversation_id, participant_id=participant_id) \
+                .update(count=F('count') + count)
+
+
+def mark_messages_read(conversation_id, participant_id, up_to_message_id):
+    """
+    Marks all the unread messages received by the participant in the conversation up to the given message as read
+    with a single update.
+
+    :return: (number of messages marked read, number of messages left unread)
+    """
+    with transaction.atomic():
+        read_count = Message.objects.filter(conversation_id=conversation_id, receiver_id=participant_id,
+                                            id__lte=up_to_message_id, is_read=False).update(is_read=True,
+                                                                                            read_at=timezone.now())
+        unread_counts = ConversationUnreadCount.objects.filter(conversation_id=conversation_id,
+                                                               participant_id=participant_id)
+        if read_count:
+            # never let the counter go below zero
+            unread_counts.update(count=Case(When(count__gt=read_count, then=F('count') - read_count), default=0))
+
+        unread_count = unread_counts.values_list('count', flat=True).first() or 0
+
+    return read_count, unread_count
+
+
+def persist_messages(messages):
+    """
+    Writes a batch of messages with a single insert and then updates the last message and the unread counts of
+    their conversations, which the post save hook of Message maintains for messages saved one at a time.
+    """
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+
+        # bulk_create does not set primary keys on mysql, so the last messages are found with a subquery
+        last_messages = Message.objects.filter(conversation=OuterRef('pk')).order_by('-created_at', '-id')
+        Conversation.objects.filter(id__in={message.conversation_id for message in messages}).update(
+            last_message=Subquery(last_messages.values('id')[:1]),
+            last_message_at=Subquery(last_messages.values('created_at')[:1]))
+
+        unread_counts = Counter((message.conversation_id, message.receiver_id) for message in messages
+                                if message.conversation_id and message.receiver_id and not message.is_read)
+        for (conversation_id, participant_id), count in unread_counts.items():
+            increment_unread_count(conversation_id, participant_id, count)
+
+
+def update_conversation_last_message(message):
+    # the condition keeps the latest message when messages of a conversation are created concurrently
+    Conversation.objects.filter(Q(last_message_at__isnull=True) | Q(last_message_at__lte=message.created_at),
+                                id=message.conversation_id).update(last_message=message,
+                                                                   last_message_at=message.created_at)
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=Message)
+def message_post_save_hook(sender, instance, created, **kwargs):
+    if created and instance.conversation_id:
+        update_conversation_last_message(instance)
+        if instance.receiver_id and not instance.is_read:
+            increment_unread_count(instance.conversation_id, instance.receiver_id)
+
+
+# noinspection PyUnusedLocal
+@receiver(m2m_changed, sender=Conversation.participants.through)
+def conversation_participants_changed_hook(sender, instance, action, reverse, pk_set, **kwargs):
+    # participants are swapped by scout_task_pre_save_hook when a task is reassigned, the cached socket memberships
+    # of the affected conversations must not outlive the change
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+
+    if not reverse:
+        conversation_ids = [instance.id]
+    elif action == 'pre_clear':
+        conversation_ids = list(instance.conversations.values_list('id', flat=True))
+    else:
+        conversation_ids = list(pk_set or [])
+
+    transaction.on_commit(lambda: invalidate_cached_chat_memberships(conversation_ids))
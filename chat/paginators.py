@@ -1,4 +1,10 @@
-from rest_framework.pagination import PageNumberPagination
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 
 
 class ChatPagination(PageNumberPagination):
@@ -7,4 +13,76 @@ class ChatPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
 
 
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination of messages on (created_at, id), served by the (conversation, created_at, id) index without
+    OFFSET scans or COUNT queries. Both cursors are message ids:
+
+    ?before=<id> returns the messages older than the given one, newest first (an empty value starts from the latest
+    message), ?since=<id> returns the messages newer than the given one, oldest first, for incremental sync.
+    Requests with neither parameter are paginated by ChatPagination as before.
+    """
+    page_size = 10
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    before_query_param = 'before'
+    since_query_param = 'since'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        if self.before_query_param not in request.query_params and \
+                self.since_query_param not in request.query_params:
+            self.page_number_paginator = ChatPagination()
+            return self.page_number_paginator.paginate_queryset(queryset, request, view)
+
+        self.page_number_paginator = None
+        self.page_size = self.get_page_size(request)
+        self.forward = self.since_query_param in request.query_params
+        cursor = request.query_params.get(self.since_query_param if self.forward else self.before_query_param)
+
+        if cursor:
+            try:
+                created_at, message_id = queryset.values_list('created_at', 'id').get(id=int(cursor))
+            except (ValueError, queryset.model.DoesNotExist):
+                raise ValidationError({'detail': 'Invalid cursor'})
+
+            if self.forward:
+                queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id))
+            else:
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+
+        ordering = ('created_at', 'id') if self.forward else ('-created_at', '-id')
+        # one extra row tells whether there is a next page
+        page = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        self.has_more = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_next_link(self):
+        if not self.has_more:
+            return None
+
+        url = self.request.build_absolute_uri()
+        if self.forward:
+            return replace_query_param(url, self.since_query_param, self.page[-1].id)
+        return replace_query_param(remove_query_param(url, self.since_query_param), self.before_query_param,
+                                   self.page[-1].id)
+
+    def get_paginated_response(self, data):
+        if self.page_number_paginator:
+            return self.page_number_paginator.get_paginated_response(data)
 
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('has_more', self.has_more),
+            ('results', data)
+        ]))
@@ -0,0 +1,89 @@
+import threading
+import time
+
+from utility.logging_utils import sentry_debug_logger
+from utility.redis_utils import get_redis_connection
+
+# hash of conversation id -> number of sockets the participant has open with ChatConsumer in that conversation
+PRESENCE_KEY = 'CHAT_PRESENCE:{}'  # formatted with participant id
+# sockets of a crashed process stop counting after this, open sockets refresh it while they are used
+PRESENCE_TTL = 5 * 60  # seconds
+PRESENCE_REFRESH_INTERVAL = PRESENCE_TTL / 2  # seconds between the refreshes made by every open socket
+PRESENCE_LOCAL_TTL = 5  # seconds for which a process keeps the presence of a participant in memory
+
+PARTICIPANT_GROUP_NAME = 'chat_participant_{}'  # channel layer group of all the sockets of a participant
+
+DISCONNECT_SCRIPT = """
+local count = redis.call('hincrby', KEYS[1], ARGV[1], -1)
+if count <= 0 then
+    redis.call('hdel', KEYS[1], ARGV[1])
+end
+return count
+"""
+
+_local_presence = {}  # participant id -> (expires at, conversation ids)
+_local_presence_lock = threading.Lock()
+
+
+def get_participant_group_name(participant_id):
+    return PARTICIPANT_GROUP_NAME.format(participant_id)
+
+
+def _forget_local_presence(participant_id):
+    with _local_presence_lock:
+        _local_presence.pop(participant_id, None)
+
+
+def participant_connected(participant_id, conversation_id):
+    try:
+        key = PRESENCE_KEY.format(participant_id)
+        pipe = get_redis_connection().pipeline()
+        pipe.hincrby(key, conversation_id, 1)
+        pipe.expire(key, PRESENCE_TTL)
+        pipe.execute()
+    except Exception as E:
+        sentry_debug_logger.error('error while marking participant online: ' + str(E), exc_info=True)
+    _forget_local_presence(participant_id)
+
+
+def participant_disconnected(participant_id, conversation_id):
+    try:
+        get_redis_connection().eval(DISCONNECT_SCRIPT, 1, PRESENCE_KEY.format(participant_id), conversation_id)
+    except Exception as E:
+        sentry_debug_logger.error('error while marking participant offline: ' + str(E), exc_info=True)
+    _forget_local_presence(participant_id)
+
+
+def refresh_participant_presence(participant_id):
+    try:
+        get_redis_connection().expire(PRESENCE_KEY.format(participant_id), PRESENCE_TTL)
+    except Exception as E:
+        sentry_debug_logger.error('error while refreshing participant presence: ' + str(E), exc_info=True)
+
+
+def get_participant_online_conversation_ids(participant_id):
+    """
+    :return: ids of the conversations in which the participant has a socket open, served from memory for
+             PRESENCE_LOCAL_TTL seconds
+    """
+    now = time.monotonic()
+    with _local_presence_lock:
+        entry = _local_presence.get(participant_id)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    try:
+        conversation_ids = frozenset(int(conversation_id) for conversation_id in
+                                     get_redis_connection().hkeys(PRESENCE_KEY.format(participant_id)))
+    except Exception as E:
+        sentry_debug_logger.error('error while reading participant presence: ' + str(E), exc_info=True)
+        # considered offline, the receiver is then notified instead
+        return frozenset()
+
+    with _local_presence_lock:
+        _local_presence[participant_id] = (now + PRESENCE_LOCAL_TTL, conversation_ids)
+    return conversation_ids
+
+
+def is_participant_online(participant_id, conversation_id):
+    return conversation_id in get_participant_online_conversation_ids(participant_id)
@@ -0,0 +1,95 @@
+from datetime import timedelta
+
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
+from chat.utils import CHAT_DELIVERY_MAX_RETRIES
+
+logger = get_task_logger(__name__)
+
+
+@shared_task
+def deliver_chat_messages(receiver_id, failed_attempts=0):
+    """
+    Delivers the undelivered messages of a receiver to the consumer app in the order they were created. Deliveries
+    to a receiver are serialized with a redis lock and a failing message stops the batch until it is retried, so a
+    later message never overtakes an earlier one. A message still failing after CHAT_DELIVERY_MAX_RETRIES retries
+    is marked as failed and left undelivered.
+
+    :param failed_attempts: number of deliveries that failed so far, waiting for the lock does not count
+    """
+    from django.utils import timezone
+    from redis.exceptions import LockError
+
+    from chat.api.serializers import MessageSerializer
+    from chat.api.views import send_message_to_receiver_participant_via_consumer_app
+    from chat.models import Message
+    from chat.utils import CHAT_DELIVERY_LOCK_KEY, CHAT_DELIVERY_LOCK_TIMEOUT, CHAT_DELIVERY_BATCH_SIZE, \
+        CHAT_DELIVERY_LOCK_RETRY_DELAY
+    from utility.logging_utils import sentry_debug_logger
+    from utility.redis_utils import get_redis_connection
+
+    lock = get_redis_connection().lock(CHAT_DELIVERY_LOCK_KEY.format(receiver_id), timeout=CHAT_DELIVERY_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        # the current holder may have fetched the pending messages before ours was committed
+        deliver_chat_messages.apply_async((receiver_id, failed_attempts), countdown=CHAT_DELIVERY_LOCK_RETRY_DELAY)
+        return
+
+    delivered_count = 0
+    try:
+        messages = list(Message.objects.filter(
+            receiver_id=receiver_id, delivered_at__isnull=True, delivery_failed_at__isnull=True).select_related(
+            'sender__scout', 'receiver__scout', 'conversation__task').prefetch_related(
+            'conversation__participants').order_by('created_at', 'id')[:CHAT_DELIVERY_BATCH_SIZE])
+
+        for msg in messages:
+            try:
+                data = MessageSerializer(msg, context={'requesting_participant': msg.sender}).data
+                send_message_to_receiver_participant_via_consumer_app(msg=msg, data=data,
+                                                                      receiver_participant=msg.receiver)
+            except Exception as E:
+                if failed_attempts < CHAT_DELIVERY_MAX_RETRIES:
+                    logger.error('error while delivering chat message {}: {}'.format(msg.id, str(E)))
+                    deliver_chat_messages.apply_async((receiver_id, failed_attempts + 1),
+                                                      countdown=2 ** failed_attempts)
+                    return
+                # given up so that it does not block the later messages of the receiver forever
+                sentry_debug_logger.error('giving up delivery of chat message {}: {}'.format(msg.id, str(E)),
+                                          exc_info=True)
+                Message.objects.filter(id=msg.id).update(delivery_failed_at=timezone.now())
+                # the retries were spent on this message, the next ones get their own
+                failed_attempts = 0
+                continue
+
+            Message.objects.filter(id=msg.id).update(delivered_at=timezone.now())
+            delivered_count += 1
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            # expired while delivering
+            pass
+
+    if len(messages) == CHAT_DELIVERY_BATCH_SIZE:
+        deliver_chat_messages.delay(receiver_id)
+
+    logger.info("Delivered {} chat messages to participant id {}".format(delivered_count, receiver_id))
+
+
+@shared_task
+def deliver_pending_chat_messages():
+    """ Hands the receivers whose messages were left undelivered, e.g. by a lost task, to deliver_chat_messages """
+    from django.utils import timezone
+
+    from chat.models import Message
+    from chat.utils import CHAT_DELIVERY_SWEEP_DELAY
+
+    receiver_ids = set(Message.objects.filter(
+        delivered_at__isnull=True, delivery_failed_at__isnull=True, receiver__isnull=False,
+        created_at__lte=timezone.now() - timedelta(seconds=CHAT_DELIVERY_SWEEP_DELAY)).values_list('receiver_id',
+                                                                                                   flat=True))
+    for receiver_id in receiver_ids:
+        deliver_chat_messages.delay(receiver_id)
+
+    if receiver_ids:
+        logger.info("Queued delivery of pending chat messages to {} participants".format(len(receiver_ids)))
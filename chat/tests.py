@@ -1,3 +1,556 @@
-from django.test import TestCase
+import asyncio
+import codecs
+import json
+import pickle
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User, AnonymousUser
+from django.db import connection, OperationalError, IntegrityError
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from redis import ResponseError
+from rest_framework.test import APIClient
+
+from chat import routing
+from chat.api.views import send_message_to_receiver_participant_via_consumer_app
+from chat.consumers import MessageBatchWriter, get_conversation_participants
+from chat.models import Conversation, Message, ConversationUnreadCount, persist_messages, \
+    update_conversation_last_message, mark_messages_read
+from chat.presence import PRESENCE_KEY, PRESENCE_LOCAL_TTL, participant_connected, participant_disconnected, \
+    is_participant_online
+from chat.tasks import deliver_chat_messages, deliver_pending_chat_messages
+from chat.utils import TYPE_SCOUT, CHAT_MEMBERSHIP_CACHE_KEY, CHAT_DELIVERY_MAX_RETRIES, CHAT_DELIVERY_LOCK_KEY, \
+    CHAT_DELIVERY_LOCK_RETRY_DELAY
+from scouts.models import Scout
+from utility.environments import PRODUCTION
+from utility.redis_test_utils import FakeRedisMixin
+from utility.redis_utils import ConsumerAppRedis, CONSUMER_APP_REDIS_DIRECT, get_consumer_app_redis, publish_if_online
+from utility.render_response_utils import STATUS, SUCCESS, ERROR
+
+
+class ScopeUser(object):
+    """ Stands in for the auth middleware of the socket application """
+
+    def __init__(self, inner, user):
+        self.inner = inner
+        self.user = user
+
+    def __call__(self, scope):
+        return self.inner(dict(scope, user=self.user))
+
+
+def create_scout(username, phone_no):
+    return Scout.objects.create(user=User.objects.create(username=username), phone_no=phone_no)
+
+
+class ChatAPITestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.scout = create_scout('scout', '9999999990')
+        self.participant = self.scout.chat_participant
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.scout.user).key,
+                                HTTP_PARTICIPANT_TYPE=TYPE_SCOUT)
+
+    def create_conversation(self):
+        other_scout = create_scout('scout{}'.format(Scout.objects.count()), '9{:09d}'.format(Scout.objects.count()))
+        conversation = Conversation.objects.create()
+        conversation.participants.add(self.participant, other_scout.chat_participant)
+        return conversation, other_scout.chat_participant
+
+
+class ConversationListTestCase(ChatAPITestCase):
+    def get_conversations(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/chat/conversations/', {'page_size': 100})
+        self.assertEqual(response.status_code, 200)
+        return response.data['results'], len(queries)
+
+    def test_conversations_are_ordered_by_their_last_message(self):
+        conversations = [self.create_conversation() for _ in range(3)]
+        for conversation, other_participant in conversations[1::-1]:
+            Message.objects.create(conversation=conversation, sender=other_participant, receiver=self.participant,
+                                   content='hi from {}'.format(other_participant.id))
+
+        results, _ = self.get_conversations()
+        self.assertEqual([result['id'] for result in results], [conversations[0][0].id, conversations[1][0].id,
+                                                                conversations[2][0].id])
+        self.assertEqual(results[0]['last_message']['content'], 'hi from {}'.format(conversations[0][1].id))
+        self.assertIsNone(results[2]['last_message'])
+
+    def test_last_message_only_moves_forward(self):
+        conversation, other_participant = self.create_conversation()
+        older_message = Message.objects.create(conversation=conversation, sender=other_participant, content='older')
+        newer_message = Message.objects.create(conversation=conversation, sender=other_participant, content='newer')
+
+        update_conversation_last_message(older_message)
+        conversation.refresh_from_db()
+        self.assertEqual((conversation.last_message, conversation.last_message_at),
+                         (newer_message, newer_message.created_at))
+
+    def test_pages_cost_a_constant_number_of_queries(self):
+        for _ in range(2):
+            conversation, other_participant = self.create_conversation()
+            Message.objects.create(conversation=conversation, sender=other_participant, content='hi')
+        _, query_count = self.get_conversations()
+
+        for _ in range(6):
+            conversation, other_participant = self.create_conversation()
+            Message.objects.create(conversation=conversation, sender=other_participant, content='hi')
+        results, next_query_count = self.get_conversations()
+        self.assertEqual((len(results), next_query_count), (8, query_count))
+
+
+class MessageCursorPaginationTestCase(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation, other_participant = self.create_conversation()
+        self.message_ids = [Message.objects.create(conversation=self.conversation, sender=self.participant,
+                                                   receiver=other_participant, content=str(i)).id for i in range(25)]
+        # messages sent within the same instant are ordered by id
+        Message.objects.filter(id__in=self.message_ids[10:15]).update(
+            created_at=Message.objects.get(id=self.message_ids[10]).created_at)
+        self.url = '/chat/conversations/{}/messages/'.format(self.conversation.id)
+
+    def get_messages(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_older_messages_are_paged_back_from_the_latest(self):
+        page = self.get_messages(self.url, {'before': ''})
+        message_ids = [message['id'] for message in page['results']]
+        while page['next']:
+            self.assertTrue(page['has_more'])
+            page = self.get_messages(page['next'])
+            message_ids += [message['id'] for message in page['results']]
+        self.assertEqual(message_ids, self.message_ids[::-1])
+
+    def test_newer_messages_are_synced_oldest_first(self):
+        page = self.get_messages(self.url, {'since': self.message_ids[12], 'page_size': 5})
+        self.assertEqual([message['id'] for message in page['results']], self.message_ids[13:18])
+        page = self.get_messages(page['next'])
+        self.assertEqual([message['id'] for message in page['results']], self.message_ids[18:23])
+
+        page = self.get_messages(self.url, {'since': self.message_ids[-1]})
+        self.assertEqual((page['results'], page['next'], page['has_more']), ([], None, False))
+
+    def test_requests_without_a_cursor_are_paged_by_number(self):
+        page = self.get_messages(self.url, {'page': 2})
+        self.assertEqual(page['count'], 25)
+        self.assertEqual([message['id'] for message in page['results']], self.message_ids[14:4:-1])
+
+    def test_invalid_cursors_are_rejected(self):
+        other_conversation, _ = self.create_conversation()
+        other_message = Message.objects.create(conversation=other_conversation, sender=self.participant)
+        for cursor in ('abc', other_message.id):
+            self.assertEqual(self.client.get(self.url, {'before': cursor}).status_code, 400)
+
+
+class MessageReadTestCase(ChatAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation, self.other_participant = self.create_conversation()
+        self.message_ids = [Message.objects.create(conversation=self.conversation, sender=self.other_participant,
+                                                   receiver=self.participant, content=str(i)).id for i in range(5)]
+        Message.objects.create(conversation=self.conversation, sender=self.participant,
+                               receiver=self.other_participant, content='reply')
+        self.url = '/chat/conversations/{}/messages/read/'.format(self.conversation.id)
+
+    def get_unread_count(self):
+        return self.client.get('/chat/conversations/').data['results'][0]['unread_count']
+
+    def test_received_messages_are_read_up_to_the_given_message(self):
+        self.assertEqual(self.get_unread_count(), 5)
+
+        response = self.client.post(self.url, {'message_id': self.message_ids[2]}, format='json')
+        self.assertEqual(response.data, {'read_count': 3, 'unread_count': 2})
+        self.assertEqual(self.get_unread_count(), 2)
+
+        # the reply of the participant is not theirs to read
+        response = self.client.post(self.url, {'message_id': self.message_ids[-1] + 1}, format='json')
+        self.assertEqual(response.data, {'read_count': 2, 'unread_count': 0})
+        self.assertEqual(list(Message.objects.filter(is_read=False).values_list('content', flat=True)), ['reply'])
+        self.assertEqual(ConversationUnreadCount.objects.get(conversation=self.conversation,
+                                                             participant=self.other_participant).count, 1)
+
+    def test_unread_counts_never_go_below_zero(self):
+        ConversationUnreadCount.objects.filter(participant=self.participant).update(count=1)
+        self.assertEqual(mark_messages_read(self.conversation.id, self.participant.id, self.message_ids[-1]), (5, 0))
+        self.assertEqual(mark_messages_read(self.conversation.id, self.participant.id, self.message_ids[-1]), (0, 0))
+
+    def test_a_message_id_of_a_conversation_of_the_participant_is_required(self):
+        self.assertEqual(self.client.post(self.url, {}, format='json').status_code, 400)
+        other_conversation, _ = self.create_conversation()
+        other_conversation.participants.remove(self.participant)
+        response = self.client.post('/chat/conversations/{}/messages/read/'.format(other_conversation.id),
+                                    {'message_id': self.message_ids[0]}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class ConsumerAppRedisTestCase(FakeRedisMixin, TestCase):
+    def test_messages_are_published_only_to_online_receivers(self):
+        pubsub = self.redis.pubsub()
+        pubsub.subscribe('onChat')
+
+        self.assertFalse(publish_if_online(self.redis, 'SCOUTCHAT:1', 'onChat', 'offline'))
+        self.redis.set('SCOUTCHAT:1', 'socket id')
+        self.assertTrue(publish_if_online(self.redis, 'SCOUTCHAT:1', 'onChat', 'online'))
+        messages = iter(pubsub.get_message, None)
+        self.assertEqual([message['data'] for message in messages if message['type'] == 'message'], [b'online'])
+
+    @override_settings(CONSUMER_APP_REDIS_BACKEND=CONSUMER_APP_REDIS_DIRECT,
+                       CONSUMER_APP_REDIS_URL='redis://consumer-app:6379/1')
+    def test_the_direct_backend_uses_a_pooled_client(self):
+        with mock.patch('utility.redis_utils.get_redis_connection') as get_redis_connection:
+            self.assertEqual(get_consumer_app_redis(), get_redis_connection.return_value)
+        get_redis_connection.assert_called_once_with('redis://consumer-app:6379/1')
+
+        with override_settings(CONSUMER_APP_REDIS_URL=''), self.assertRaises(ImproperlyConfigured):
+            get_consumer_app_redis()
+
+    def test_the_http_backend_forwards_commands_over_one_session(self):
+        self.assertIsInstance(get_consumer_app_redis(), ConsumerAppRedis)
+        session = mock.Mock()
+        session.post.return_value.json.side_effect = [
+            {STATUS: SUCCESS, 'result': 'socket id', 'result_type': 'bytes'},
+            {STATUS: ERROR, 'message': 'no script', 'exception': codecs.encode(pickle.dumps(
+                ResponseError('NOSCRIPT')), 'base64').decode()},
+        ]
+        with mock.patch.object(ConsumerAppRedis, 'get_session', return_value=session), \
+                mock.patch('utility.redis_utils.config', return_value='https://consumer-app/redis/'):
+            self.assertEqual(ConsumerAppRedis().get('SCOUTCHAT:1'), b'socket id')
+            with self.assertRaises(ResponseError):
+                ConsumerAppRedis().evalsha('sha', 0)
+            with self.assertRaises(NotImplementedError):
+                ConsumerAppRedis().no_such_command()
+
+        self.assertEqual(json.loads(session.post.call_args_list[0][1]['data']),
+                         {'attr': 'get', 'args': ['SCOUTCHAT:1'], 'kwargs': {}})
+
+
+class ChatDeliveryTestCase(FakeRedisMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scout = create_scout('scout', '9999999990')
+        self.receiver = create_scout('receiver', '9999999991').chat_participant
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.scout.chat_participant, self.receiver)
+        self.sent = []
+
+    def create_messages(self, *contents):
+        for content in contents:
+            Message.objects.create(conversation=self.conversation, sender=self.scout.chat_participant,
+                                   receiver=self.receiver, content=content)
+
+    def deliver(self, failed_attempts=0, failing_contents=()):
+        def send(msg, data, receiver_participant):
+            if msg.content in failing_contents:
+                raise ConnectionError('consumer app unreachable')
+            self.sent.append(msg.content)
+
+        with mock.patch('chat.api.views.send_message_to_receiver_participant_via_consumer_app', side_effect=send), \
+                mock.patch('chat.tasks.deliver_chat_messages.apply_async') as apply_async:
+            deliver_chat_messages(self.receiver.id, failed_attempts)
+        return apply_async
+
+    def test_messages_sent_over_the_api_are_delivered_once_committed(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.scout.user).key,
+                           HTTP_PARTICIPANT_TYPE=TYPE_SCOUT)
+        with mock.patch('chat.api.views.deliver_chat_messages.delay') as delay:
+            response = client.post('/chat/conversations/{}/messages/'.format(self.conversation.id),
+                                   {'content': 'hi'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        delay.assert_called_once_with(self.receiver.id)
+        self.assertIsNone(Message.objects.get().delivered_at)
+
+    def test_failed_deliveries_are_retried_without_reordering(self):
+        self.create_messages('first', 'second', 'third')
+        apply_async = self.deliver(failing_contents=('second',))
+        self.assertEqual(self.sent, ['first'])
+        apply_async.assert_called_once_with((self.receiver.id, 1), countdown=1)
+
+        apply_async = self.deliver(failed_attempts=1)
+        self.assertEqual(self.sent, ['first', 'second', 'third'])
+        apply_async.assert_not_called()
+        self.assertFalse(Message.objects.filter(delivered_at__isnull=True).exists())
+
+    def test_messages_are_given_up_after_the_last_retry(self):
+        self.create_messages('first', 'second')
+        apply_async = self.deliver(failed_attempts=CHAT_DELIVERY_MAX_RETRIES, failing_contents=('first',))
+        self.assertEqual(self.sent, ['second'])
+        apply_async.assert_not_called()
+        self.assertIsNotNone(Message.objects.get(content='first').delivery_failed_at)
+
+        self.deliver()
+        self.assertEqual(self.sent, ['second'])
+
+    def test_deliveries_to_a_receiver_wait_for_the_lock(self):
+        self.create_messages('first')
+        lock = self.redis.lock(CHAT_DELIVERY_LOCK_KEY.format(self.receiver.id))
+        lock.acquire()
+        apply_async = self.deliver(failed_attempts=2)
+        self.assertEqual(self.sent, [])
+        apply_async.assert_called_once_with((self.receiver.id, 2), countdown=CHAT_DELIVERY_LOCK_RETRY_DELAY)
+
+        lock.release()
+        self.deliver()
+        self.assertEqual(self.sent, ['first'])
+
+    def test_messages_left_undelivered_are_swept(self):
+        self.create_messages('old', 'recent')
+        Message.objects.filter(content='old').update(created_at=timezone.now() - timedelta(minutes=5))
+        other_receiver = create_scout('other_receiver', '9999999992').chat_participant
+        Message.objects.create(conversation=self.conversation, receiver=other_receiver, content='failed',
+                               delivery_failed_at=timezone.now())
+        Message.objects.filter(content='failed').update(created_at=timezone.now() - timedelta(minutes=5))
+
+        with mock.patch('chat.tasks.deliver_chat_messages.delay') as delay:
+            deliver_pending_chat_messages()
+        delay.assert_called_once_with(self.receiver.id)
+
+
+class ChatConsumerTestCase(FakeRedisMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scout = create_scout('scout', '9999999990')
+        self.other_scout = create_scout('other_scout', '9999999991')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.scout.chat_participant, self.other_scout.chat_participant)
+
+    def connect(self, user, room_name):
+        async def run():
+            communicator = WebsocketCommunicator(ScopeUser(URLRouter(routing.websocket_urlpatterns), user),
+                                                 '/ws/chat/{}/'.format(room_name))
+            connected, _ = await communicator.connect()
+            await communicator.disconnect()
+            return connected
+
+        return asyncio.run(run())
+
+    @staticmethod
+    async def run_with_fast_flush(run):
+        with mock.patch('chat.consumers.message_writer', MessageBatchWriter(flush_interval=0.01)):
+            return await run()
+
+    def test_messages_are_sent_to_the_room_and_persisted(self):
+        async def run():
+            communicator = WebsocketCommunicator(
+                ScopeUser(URLRouter(routing.websocket_urlpatterns), self.scout.user),
+                '/ws/chat/{}/'.format(self.conversation.id))
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            for i in range(3):
+                await communicator.send_json_to({'message': 'message {}'.format(i)})
+            received = [await communicator.receive_json_from() for _ in range(3)]
+            # gives the batch writer time to flush
+            await asyncio.sleep(0.3)
+            await communicator.disconnect()
+            return received
+
+        received = asyncio.run(self.run_with_fast_flush(run))
+        self.assertEqual(received, [{'message': 'message {}'.format(i), 'sender': self.scout.chat_participant.id}
+                                    for i in range(3)])
+
+        messages = Message.objects.filter(conversation=self.conversation).order_by('id')
+        self.assertEqual([message.content for message in messages], ['message 0', 'message 1', 'message 2'])
+        self.assertTrue(all(message.receiver_id == self.other_scout.chat_participant.id for message in messages))
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message.content, 'message 2')
+        self.assertEqual(ConversationUnreadCount.objects.get(
+            conversation=self.conversation, participant=self.other_scout.chat_participant).count, 3)
+
+    def test_room_name_is_the_conversation_id_of_a_scout_participant(self):
+        # conversations have no room names and customers chat through the consumer app, so the room name is the id of
+        # a conversation of the scout
+        self.assertTrue(self.connect(self.scout.user, self.conversation.id))
+        self.assertFalse(self.connect(AnonymousUser(), self.conversation.id))
+        self.assertFalse(self.connect(self.scout.user, 'room'))
+        self.assertFalse(self.connect(create_scout('outsider', '9999999992').user, self.conversation.id))
+        self.assertFalse(self.connect(User.objects.create(username='customer'), self.conversation.id))
+
+
+class ChatMembershipCacheTestCase(FakeRedisMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scout = create_scout('scout', '9999999990')
+        self.other_scout = create_scout('other_scout', '9999999991')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.scout.chat_participant, self.other_scout.chat_participant)
+        self.room_name = str(self.conversation.id)
+
+    def test_reconnects_are_authorized_from_the_cache(self):
+        participant_ids = (self.scout.chat_participant.id, self.other_scout.chat_participant.id)
+        self.assertEqual(get_conversation_participants(self.scout.user, self.room_name), participant_ids)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_conversation_participants(self.scout.user, self.room_name), participant_ids)
+
+    def test_participant_changes_invalidate_the_cached_memberships(self):
+        get_conversation_participants(self.scout.user, self.room_name)
+        self.conversation.participants.remove(self.scout.chat_participant)
+        self.assertFalse(self.redis.exists(CHAT_MEMBERSHIP_CACHE_KEY.format(self.conversation.id)))
+        self.assertEqual(get_conversation_participants(self.scout.user, self.room_name), (None, None))
+
+        self.scout.chat_participant.conversations.add(self.conversation)
+        self.assertFalse(self.redis.exists(CHAT_MEMBERSHIP_CACHE_KEY.format(self.conversation.id)))
+        self.assertEqual(get_conversation_participants(self.scout.user, self.room_name)[0],
+                         self.scout.chat_participant.id)
+
+        self.other_scout.chat_participant.conversations.clear()
+        self.assertFalse(self.redis.exists(CHAT_MEMBERSHIP_CACHE_KEY.format(self.conversation.id)))
+        self.assertEqual(get_conversation_participants(self.scout.user, self.room_name),
+                         (self.scout.chat_participant.id, None))
+
+    def test_memberships_are_read_from_the_database_when_redis_is_down(self):
+        with mock.patch('chat.utils.get_redis_connection', side_effect=ConnectionError):
+            self.assertEqual(get_conversation_participants(self.scout.user, self.room_name),
+                             (self.scout.chat_participant.id, self.other_scout.chat_participant.id))
+            self.assertEqual(get_conversation_participants(create_scout('outsider', '9999999992').user,
+                                                           self.room_name), (None, None))
+
+
+class ChatPresenceTestCase(FakeRedisMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict('chat.presence._local_presence', clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scout = create_scout('scout', '9999999990')
+        self.other_scout = create_scout('other_scout', '9999999991')
+        self.participant = self.scout.chat_participant
+        self.conversations = []
+        for _ in range(2):
+            conversation = Conversation.objects.create()
+            conversation.participants.add(self.participant, self.other_scout.chat_participant)
+            self.conversations.append(conversation)
+
+    def test_sockets_are_counted_per_conversation(self):
+        conversation_id, other_conversation_id = [conversation.id for conversation in self.conversations]
+        participant_connected(self.participant.id, conversation_id)
+        participant_connected(self.participant.id, conversation_id)
+        self.assertTrue(is_participant_online(self.participant.id, conversation_id))
+        self.assertFalse(is_participant_online(self.participant.id, other_conversation_id))
+
+        participant_disconnected(self.participant.id, conversation_id)
+        self.assertTrue(is_participant_online(self.participant.id, conversation_id))
+        participant_disconnected(self.participant.id, conversation_id)
+        self.assertFalse(is_participant_online(self.participant.id, conversation_id))
+        self.assertFalse(self.redis.exists(PRESENCE_KEY.format(self.participant.id)))
+
+    def test_presence_is_kept_in_memory_for_a_while(self):
+        participant_connected(self.participant.id, self.conversations[0].id)
+        self.assertTrue(is_participant_online(self.participant.id, self.conversations[0].id))
+
+        # e.g. disconnected in another process
+        self.redis.delete(PRESENCE_KEY.format(self.participant.id))
+        self.assertTrue(is_participant_online(self.participant.id, self.conversations[0].id))
+        with mock.patch('chat.presence.time.monotonic', return_value=time.monotonic() + PRESENCE_LOCAL_TTL):
+            self.assertFalse(is_participant_online(self.participant.id, self.conversations[0].id))
+
+    def test_participants_are_offline_while_redis_is_down(self):
+        participant_connected(self.participant.id, self.conversations[0].id)
+        with mock.patch('chat.presence.get_redis_connection', side_effect=ConnectionError):
+            self.assertFalse(is_participant_online(self.participant.id, self.conversations[0].id))
+
+    def test_messages_are_routed_to_the_open_sockets_of_the_receiver(self):
+        async def run():
+            communicator = WebsocketCommunicator(
+                ScopeUser(URLRouter(routing.websocket_urlpatterns), self.scout.user),
+                '/ws/chat/{}/'.format(self.conversations[0].id))
+            await communicator.connect()
+            # lets the consumer mark the participant online
+            await asyncio.sleep(0.1)
+            self.redis.expire(PRESENCE_KEY.format(self.participant.id), 2)
+            # kept up by the heartbeat of the open socket
+            await asyncio.sleep(0.2)
+            self.assertGreater(self.redis.ttl(PRESENCE_KEY.format(self.participant.id)), 2)
+
+            for conversation in self.conversations:
+                message = await database_sync_to_async(Message.objects.create)(
+                    conversation=conversation, sender=self.other_scout.chat_participant, receiver=self.participant,
+                    content='hi in {}'.format(conversation.id))
+                with mock.patch('chat.api.views.publish_if_online') as publish:
+                    await sync_to_async(send_message_to_receiver_participant_via_consumer_app)(message, {},
+                                                                                               self.participant)
+                # routed through the consumer app only outside the open conversation
+                self.assertEqual(publish.called, conversation != self.conversations[0])
+            received = await communicator.receive_json_from()
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+            return received
+
+        with override_settings(ENVIRONMENT=PRODUCTION), mock.patch('chat.consumers.PRESENCE_REFRESH_INTERVAL', 0.05):
+            received = asyncio.run(run())
+        self.assertEqual(received, {'message': 'hi in {}'.format(self.conversations[0].id),
+                                    'sender': self.other_scout.chat_participant.id})
+        self.assertFalse(is_participant_online(self.participant.id, self.conversations[0].id))
+
+
+class MessageBatchWriterTestCase(TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.conversation = Conversation.objects.create()
+        patcher = mock.patch('chat.consumers.MESSAGE_PERSIST_RETRY_DELAY', 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_contents(self):
+        return sorted(Message.objects.values_list('content', flat=True))
+
+    def test_messages_are_flushed_in_batches(self):
+        writer = MessageBatchWriter(flush_interval=0.05, batch_size=2)
+        batches = []
+
+        def persist(messages):
+            batches.append(len(messages))
+            persist_messages(messages)
+
+        async def run():
+            for content in 'abc':
+                writer.add(Message(conversation=self.conversation, content=content))
+            await asyncio.sleep(0.3)
+
+        with mock.patch('chat.consumers.persist_messages', persist):
+            asyncio.run(run())
+        self.assertEqual(batches, [2, 1])
+        self.assertEqual(self.get_contents(), ['a', 'b', 'c'])
+
+    def test_transient_errors_are_retried(self):
+        attempts = []
+
+        def persist(messages):
+            attempts.append(len(messages))
+            if len(attempts) < 3:
+                raise OperationalError('MySQL server has gone away')
+            persist_messages(messages)
+
+        with mock.patch('chat.consumers.persist_messages', persist):
+            asyncio.run(MessageBatchWriter().write([Message(conversation=self.conversation, content='a'),
+                                                    Message(conversation=self.conversation, content='b')]))
+        self.assertEqual(attempts, [2, 2, 2])
+        self.assertEqual(self.get_contents(), ['a', 'b'])
+
+    def test_failing_batches_drop_only_the_failing_messages(self):
+        save = Message.save
+        error = IntegrityError('a foreign key constraint fails')
+
+        def save_unless_bad(message, *args, **kwargs):
+            if message.content == 'bad':
+                raise error
+            return save(message, *args, **kwargs)
+
+        batch = [Message(conversation=self.conversation, content=content) for content in ('a', 'bad', 'b')]
+        with mock.patch('chat.consumers.persist_messages', side_effect=error), \
+                mock.patch.object(Message, 'save', save_unless_bad):
+            asyncio.run(MessageBatchWriter().write(batch))
+        self.assertEqual(self.get_contents(), ['a', 'b'])
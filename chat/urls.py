@@ -5,4 +5,5 @@ from chat.api import views
 urlpatterns = (
     url(r'conversations/$', views.ConversationListView.as_view()),
     url(r'conversations/(?P<pk>\d+)/messages/$', views.MessageListCreateView.as_view()),
+    url(r'conversations/(?P<pk>\d+)/messages/read/$', views.MessageReadView.as_view()),
 )
@@ -1,6 +1,10 @@
+import json
+
 from django.conf import settings
 
 from utility.environments import DEVELOPMENT, PRODUCTION
+from utility.logging_utils import sentry_debug_logger
+from utility.redis_utils import get_redis_connection
 
 TYPE_SCOUT = 'scout'
 TYPE_CUSTOMER = 'customer'
@@ -19,6 +23,21 @@ SOCKET_STATUS_CONNECTED = 'connected'
 ENDPOINT = '/chat/'
 
 SCOUT_CUSTOMER_SOCKET_CHAT_CONVERSATION_PREFIX = 'SCOUTCHAT:'
+
+# cache used by socket connections to authorize a participant for a conversation without hitting the database
+CHAT_PARTICIPANT_CACHE_KEY = 'CHAT_PARTICIPANT:USER:{}'  # formatted with user id, holds scout participant id
+CHAT_PARTICIPANT_CACHE_TTL = 24 * 60 * 60  # seconds
+CHAT_MEMBERSHIP_CACHE_KEY = 'CHAT_MEMBERSHIP:{}'  # formatted with conversation id, hash of participant id -> json
+CHAT_MEMBERSHIP_CACHE_TTL = 60  # seconds
+
+# delivery of messages sent over the api to the consumer app (see chat.tasks)
+CHAT_DELIVERY_LOCK_KEY = 'CHAT_DELIVERY_LOCK:{}'  # formatted with receiver participant id
+CHAT_DELIVERY_LOCK_TIMEOUT = 60  # seconds
+CHAT_DELIVERY_BATCH_SIZE = 100
+CHAT_DELIVERY_MAX_RETRIES = 5  # failed deliveries retried before a message is given up
+CHAT_DELIVERY_LOCK_RETRY_DELAY = 1  # seconds after which a task finding the lock taken is run again
+CHAT_DELIVERY_SWEEP_INTERVAL = 60  # seconds
+CHAT_DELIVERY_SWEEP_DELAY = 30  # seconds for which a message is left to its own delivery task before being swept
 HALANX_CONSUMERAPP_BASE_URL = 'https://api.halanx.com'
 HALANX_SCOUT_CHAT_API_URL = HALANX_CONSUMERAPP_BASE_URL + '/chat/scouts/send/'
 
@@ -32,3 +51,52 @@ else:  # settings.ENVIRONMENT == PRODUCTION:
     SCHEME = 'https://'
     URL = 'consumerchat.herokuapp.com'
     NODE_SERVER_CHAT_ENDPOINT = "{}{}{}".format(SCHEME, URL, ENDPOINT)
+
+
+def get_cached_chat_participant_id(user_id):
+    try:
+        participant_id = get_redis_connection().get(CHAT_PARTICIPANT_CACHE_KEY.format(user_id))
+        return int(participant_id) if participant_id else None
+    except Exception as E:
+        sentry_debug_logger.error('error while reading chat participant cache: ' + str(E), exc_info=True)
+
+
+def set_cached_chat_participant_id(user_id, participant_id):
+    try:
+        get_redis_connection().setex(CHAT_PARTICIPANT_CACHE_KEY.format(user_id), CHAT_PARTICIPANT_CACHE_TTL,
+                                     participant_id)
+    except Exception as E:
+        sentry_debug_logger.error('error while writing chat participant cache: ' + str(E), exc_info=True)
+
+
+def get_cached_chat_membership(participant_id, conversation_id):
+    """
+    :return: None on a cache miss, else dict with 'member' (whether the participant belongs to the conversation)
+             and 'other_participant_id'
+    """
+    try:
+        membership = get_redis_connection().hget(CHAT_MEMBERSHIP_CACHE_KEY.format(conversation_id), participant_id)
+        return json.loads(membership) if membership else None
+    except Exception as E:
+        sentry_debug_logger.error('error while reading chat membership cache: ' + str(E), exc_info=True)
+
+
+def set_cached_chat_membership(participant_id, conversation_id, member, other_participant_id=None):
+    try:
+        key = CHAT_MEMBERSHIP_CACHE_KEY.format(conversation_id)
+        pipe = get_redis_connection().pipeline()
+        pipe.hset(key, participant_id, json.dumps({'member': member, 'other_participant_id': other_participant_id}))
+        pipe.expire(key, CHAT_MEMBERSHIP_CACHE_TTL)
+        pipe.execute()
+    except Exception as E:
+        sentry_debug_logger.error('error while writing chat membership cache: ' + str(E), exc_info=True)
+
+
+def invalidate_cached_chat_memberships(conversation_ids):
+    if not conversation_ids:
+        return
+    try:
+        get_redis_connection().delete(*[CHAT_MEMBERSHIP_CACHE_KEY.format(conversation_id)
+                                        for conversation_id in conversation_ids])
+    except Exception as E:
+        sentry_debug_logger.error('error while invalidating chat membership cache: ' + str(E), exc_info=True)
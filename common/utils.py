@@ -23,6 +23,17 @@ PaymentTypeCategories = (
     (DEPOSIT, "Deposit")
 )
 
+# uploaded images are compressed and thumbnailed in the background
+IMAGE_PROCESSING_PENDING = "pending"
+IMAGE_PROCESSING_DONE = "done"
+IMAGE_PROCESSING_FAILED = "failed"
+
+ImageProcessingStatusCategories = (
+    (IMAGE_PROCESSING_PENDING, "Pending"),
+    (IMAGE_PROCESSING_DONE, "Done"),
+    (IMAGE_PROCESSING_FAILED, "Failed")
+)
+
 DATETIME_SERIALIZER_FORMAT = '%d %B %Y %I:%M %p'
 
 
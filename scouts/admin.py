@@ -2,7 +2,8 @@ from django.contrib import admin
 
 from scouts.models import ScoutPermanentAddress, ScoutBankDetail, ScoutWallet, ScoutWorkAddress, ScoutPicture, Scout, \
     ScoutPayment, ScoutDocument, ScoutNotificationCategory, ScoutNotification, ScoutTaskCategory, ScoutSubTaskCategory, \
-    ScoutTaskReviewTagCategory, ScoutTask, ScoutTaskAssignmentRequest, Flag, ScheduledAvailability
+    ScoutTaskReviewTagCategory, ScoutTask, ScoutTaskAssignmentRequest, Flag, ScheduledAvailability, \
+    settle_scout_payments
 
 
 class ScoutPermanentAddressInline(admin.StackedInline):
@@ -59,6 +60,13 @@ class ScoutAdmin(admin.ModelAdmin):
 class ScoutPaymentAdmin(admin.ModelAdmin):
     list_display = ('id', 'wallet', 'amount', 'status', 'due_date', 'paid_on', 'type')
     raw_id_fields = ('wallet',)
+    actions = ('settle_payments',)
+
+    def settle_payments(self, request, queryset):
+        settled_payments = settle_scout_payments(list(queryset.values_list('id', flat=True)))
+        self.message_user(request, '{} payments marked as paid'.format(len(settled_payments)))
+
+    settle_payments.short_description = 'Mark selected pending payments as paid'
 
 
 @admin.register(ScoutWallet)
@@ -81,7 +89,7 @@ class ScoutNotificationAdmin(admin.ModelAdmin):
 
 @admin.register(ScoutTaskCategory)
 class ScoutTaskCategoryAdmin(admin.ModelAdmin):
-    list_display = ('name', 'get_scout_task_category_image_html', 'earning')
+    list_display = ('name', 'get_scout_task_category_image_html', 'earning', 'assignment_request_timeout')
     readonly_fields = ('get_scout_task_category_image_html',)
 
 
@@ -3,12 +3,13 @@ import json
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.utils.functional import cached_property
 from rest_framework import serializers
 from rest_framework.generics import get_object_or_404
 
 from Homes.Bookings.models import Booking
-from Homes.Houses.models import House, HouseVisit
 from Homes.Houses.serializers import HouseSerializer, SpaceSerializer
+from Homes.cache import house_cache, house_visit_cache
 from UserBase.serializers import CustomerSerializer
 from chat.api.serializers import ScoutDetailSerializer
 from common.utils import DATETIME_SERIALIZER_FORMAT
@@ -17,7 +18,7 @@ from scouts.models import Scout, ScoutDocument, ScoutPermanentAddress, ScoutWork
     ScoutTaskCategory, ScoutSubTaskCategory, ScoutTaskReviewTagCategory
 from scouts.sub_tasks.api.serializers import PropertyOnboardingDetailSerializer
 from scouts.utils import PROPERTY_ONBOARDING
-from utility.serializers import DateTimeFieldTZ
+from utility.serializers import DateTimeFieldTZ, ImageRenditionsField
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -43,6 +44,7 @@ class ScoutWorkAddressSerializer(serializers.ModelSerializer):
     class Meta:
         model = ScoutWorkAddress
         fields = '__all__'
+        read_only_fields = ('geohash',)
 
 
 class ScoutBankDetailSerializer(serializers.ModelSerializer):
@@ -99,15 +101,21 @@ class ScoutSerializer(serializers.ModelSerializer):
 
 
 class ScoutDocumentSerializer(serializers.ModelSerializer):
+    srcset = ImageRenditionsField()
+
     class Meta:
         model = ScoutDocument
-        exclude = ('is_deleted', 'verified')
+        exclude = ('is_deleted', 'verified', 'renditions')
+        read_only_fields = ('thumbnail', 'processing_status')
 
 
 class ScoutPictureSerializer(serializers.ModelSerializer):
+    srcset = ImageRenditionsField()
+
     class Meta:
         model = ScoutPicture
-        fields = ('image',)
+        fields = ('id', 'image', 'thumbnail', 'processing_status', 'srcset')
+        read_only_fields = ('thumbnail', 'processing_status')
 
 
 class ScheduledAvailabilitySerializer(serializers.ModelSerializer):
@@ -194,6 +202,38 @@ class ScoutSubTaskCategorySerializer(serializers.ModelSerializer):
         fields = ('name',)
 
 
+class HomesObjectsResolver(object):
+    """
+    Fetches the homes database objects referred by a batch of tasks with one id__in query per kind of object (the
+    cached kinds only for the ids missing from the cache), on first access of that kind. Handed to task serializers
+    through the 'homes_objects' context key so that a page of tasks costs a constant number of homes queries.
+    """
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+
+    def _get_ids(self, field):
+        return {getattr(task, field) for task in self.tasks if getattr(task, field)}
+
+    @cached_property
+    def houses(self):
+        return house_cache.get_many(self._get_ids('house_id'))
+
+    @cached_property
+    def visits(self):
+        return house_visit_cache.get_many(self._get_ids('visit_id'))
+
+    @cached_property
+    def bookings(self):
+        return Booking.objects.using(settings.HOMES_DB).select_related('space', 'tenant__customer__user').in_bulk(
+            self._get_ids('booking_id'))
+
+    @cached_property
+    def onboarding_property_details(self):
+        from scouts.sub_tasks.models import PropertyOnBoardingDetail
+        return PropertyOnBoardingDetail.objects.in_bulk(self._get_ids('onboarding_property_details_id'))
+
+
 class ScoutTaskListSerializer(serializers.ModelSerializer):
     scheduled_at = DateTimeFieldTZ(format=DATETIME_SERIALIZER_FORMAT)
     category = ScoutTaskCategorySerializer()
@@ -208,45 +248,46 @@ class ScoutTaskListSerializer(serializers.ModelSerializer):
         fields = ('id', 'scout', 'category', 'earning', 'scheduled_at', 'house', 'space', 'customer', 'conversation',
                   'scout_data', 'custom_data')
 
+    def get_homes_objects(self, obj):
+        homes_objects = self.context.get('homes_objects')
+        if homes_objects is None:
+            homes_objects = HomesObjectsResolver([obj])
+        return homes_objects
+
     @staticmethod
     def get_scout_data(obj):
         return ScoutDetailSerializer(obj.scout).data
 
-    @staticmethod
-    def get_house(obj):
-        house = House.objects.using(settings.HOMES_DB).filter(id=obj.house_id).first()
+    def get_house(self, obj):
+        house = self.get_homes_objects(obj).houses.get(obj.house_id)
         if house:
             return HouseSerializer(house).data
 
-    @staticmethod
-    def get_space(obj):
+    def get_space(self, obj):
         if obj.booking_id:
-            booking = Booking.objects.using(settings.HOMES_DB).filter(id=obj.booking_id).first()
+            booking = self.get_homes_objects(obj).bookings.get(obj.booking_id)
             if booking:
                 space = booking.space
                 return SpaceSerializer(space).data
 
-    @staticmethod
-    def get_customer(obj):
+    def get_customer(self, obj):
         customer = None
         if obj.visit_id:
-            visit = HouseVisit.objects.using(settings.HOMES_DB).filter(id=obj.visit_id).first()
+            visit = self.get_homes_objects(obj).visits.get(obj.visit_id)
             if visit:
                 customer = visit.customer
         elif obj.booking_id:
-            booking = Booking.objects.using(settings.HOMES_DB).filter(id=obj.booking_id).first()
+            booking = self.get_homes_objects(obj).bookings.get(obj.booking_id)
             if booking:
                 customer = booking.tenant.customer
 
         if customer:
             return CustomerSerializer(customer).data
 
-    @staticmethod
-    def get_custom_data(obj):
+    def get_custom_data(self, obj):
         if obj.category.name == PROPERTY_ONBOARDING:
-            from scouts.sub_tasks.models import PropertyOnBoardingDetail
-            prop_on_board_detail = PropertyOnBoardingDetail.objects.filter(
-                id=obj.onboarding_property_details_id).first()
+            prop_on_board_detail = self.get_homes_objects(obj).onboarding_property_details.get(
+                obj.onboarding_property_details_id)
             if prop_on_board_detail:
                 return PropertyOnboardingDetailSerializer(prop_on_board_detail).data
 
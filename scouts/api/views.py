@@ -3,7 +3,7 @@ from datetime import timedelta, datetime
 
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.http import Http404, JsonResponse
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
@@ -14,28 +14,36 @@ from rest_framework.decorators import api_view, authentication_classes, permissi
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404, RetrieveUpdateAPIView, CreateAPIView, ListCreateAPIView, \
     RetrieveUpdateDestroyAPIView, DestroyAPIView, ListAPIView, UpdateAPIView, RetrieveAPIView, GenericAPIView
-from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.response import Response
 
 from Homes.Bookings.models import Booking
 from Homes.Houses.models import HouseVisit, House
 from Homes.Tenants.models import Tenant, TenantMoveOutRequest
 from Homes.Tenants.serializers import TenantSerializer
+from Homes.cache import HOMES_CACHES, HOMES_CACHE_INVALIDATORS
 from UserBase.models import Customer
 from common.utils import DATETIME_SERIALIZER_FORMAT, PAID, PENDING, WITHDRAWAL
 from scouts.api.serializers import ScoutSerializer, ScoutPictureSerializer, ScoutDocumentSerializer, \
     ScheduledAvailabilitySerializer, ScoutNotificationSerializer, ChangePasswordSerializer, ScoutWalletSerializer, \
-    ScoutPaymentSerializer, ScoutTaskListSerializer, ScoutTaskDetailSerializer, ScoutTaskForHouseVisitSerializer
+    ScoutPaymentSerializer, ScoutTaskListSerializer, ScoutTaskDetailSerializer, ScoutTaskForHouseVisitSerializer, \
+    HomesObjectsResolver
 from scouts.models import OTP, Scout, ScoutPicture, ScoutDocument, ScheduledAvailability, ScoutNotification, \
     ScoutWallet, ScoutPayment, ScoutTask, ScoutTaskAssignmentRequest, ScoutTaskCategory, ScoutTaskReviewTagCategory, \
-    ScoutNotificationCategory
-from scouts.sub_tasks.api.serializers import PropertyOnboardingDetailSerializer
+    ScoutNotificationCategory, settle_scout_payments
+from scouts.sub_tasks.api.serializers import PropertyOnboardingDetailSerializer, \
+    PropertyOnBoardHousePhotosUploadSerializer
+from scouts.sub_tasks.models import PropertyOnBoardingHousePhoto, PropertyOnBoardingPhoto
+from scouts.tasks import process_property_on_boarding_photo
 from scouts.utils import ASSIGNED, COMPLETE, UNASSIGNED, REQUEST_REJECTED, REQUEST_AWAITED, REQUEST_ACCEPTED, TASK_TYPE, \
     HOUSE_VISIT, HOUSE_VISIT_CANCELLED, CANCELLED, MOVE_OUT, \
-    get_appropriate_scout_for_the_task, PROPERTY_ONBOARDING
+    get_appropriate_scout_for_the_task, PROPERTY_ONBOARDING, is_batch_scout_assignment_enabled, DIRECT_UPLOAD_KINDS, \
+    DIRECT_UPLOAD_PICTURE, DIRECT_UPLOAD_DOCUMENT, DIRECT_UPLOAD_ONBOARDING_PHOTO, get_direct_upload_prefix
 from utility.logging_utils import sentry_debug_logger
 from utility.render_response_utils import SUCCESS, STATUS, DATA, ERROR
 from utility.sms_utils import send_sms
+from utility.upload_utils import get_direct_upload_name, create_presigned_upload, create_upload_token, \
+    read_upload_token, read_local_upload_policy, is_s3_storage
 
 
 class AuthenticatedRequestMixin(object):
@@ -43,6 +51,17 @@ class AuthenticatedRequestMixin(object):
     authentication_classes = [BasicAuthentication, TokenAuthentication]
 
 
+class HomesObjectsResolverMixin(object):
+    """ resolves the homes objects of all the serialized tasks together instead of one task at a time """
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super(HomesObjectsResolverMixin, self).get_serializer(*args, **kwargs)
+        if args:
+            tasks = args[0] if kwargs.get('many') else [args[0]]
+            serializer.context['homes_objects'] = HomesObjectsResolver(tasks)
+        return serializer
+
+
 class TenantAuthentication(TokenAuthentication):
     def authenticate_credentials(self, key):
         model = self.get_model()
@@ -214,6 +233,14 @@ class ScoutPictureCreateView(AuthenticatedRequestMixin, CreateAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ScoutPictureRetrieveView(AuthenticatedRequestMixin, RetrieveAPIView):
+    """ polled by the app until the processing status of an uploaded picture is done """
+    serializer_class = ScoutPictureSerializer
+
+    def get_object(self):
+        return get_object_or_404(ScoutPicture, pk=self.kwargs.get('pk'), scout__user=self.request.user)
+
+
 class ScoutDocumentListCreateView(AuthenticatedRequestMixin, ListCreateAPIView):
     serializer_class = ScoutDocumentSerializer
     queryset = ScoutDocument.objects.all()
@@ -231,6 +258,124 @@ class ScoutDocumentListCreateView(AuthenticatedRequestMixin, ListCreateAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+DIRECT_UPLOAD_MODELS = {
+    DIRECT_UPLOAD_PICTURE: ScoutPicture,
+    DIRECT_UPLOAD_DOCUMENT: ScoutDocument,
+    DIRECT_UPLOAD_ONBOARDING_PHOTO: PropertyOnBoardingPhoto,
+}
+
+
+def is_local_direct_upload_needed():
+    # S3 checks presigned uploads itself, LocalDirectUploadView stands in for it only when media is stored elsewhere
+    return not all(is_s3_storage(model._meta.get_field('image').storage) for model in DIRECT_UPLOAD_MODELS.values())
+
+
+class DirectUploadCreateView(AuthenticatedRequestMixin, GenericAPIView):
+    """
+    Gives the app a presigned POST with which a picture, document or onboarding photo is uploaded straight to the
+    media storage, and the token with which the upload is then finalized through DirectUploadFinalizeView.
+    """
+
+    def post(self, request, *args, **kwargs):
+        scout = get_object_or_404(Scout, user=request.user)
+        kind = request.data.get('kind')
+        filename = request.data.get('filename')
+        content_type = request.data.get('content_type', '')
+        if kind not in DIRECT_UPLOAD_KINDS:
+            return Response({STATUS: ERROR, 'message': 'Kind must be one of ' + ', '.join(DIRECT_UPLOAD_KINDS)},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not filename or not content_type.startswith('image/'):
+            return Response({STATUS: ERROR, 'message': 'Filename and an image content type are required'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        token_data = {'kind': kind, 'scout': scout.id}
+        if kind == DIRECT_UPLOAD_ONBOARDING_PHOTO:
+            house_photo_sub_task = get_object_or_404(PropertyOnBoardingHousePhoto, task__id=request.data.get('task_id'),
+                                                     task__scout=scout, task__status=ASSIGNED,
+                                                     task__category__name=PROPERTY_ONBOARDING)
+            token_data['sub_task'] = house_photo_sub_task.id
+
+        token_data['name'] = get_direct_upload_name(get_direct_upload_prefix(scout.id, kind), filename)
+        storage = DIRECT_UPLOAD_MODELS[kind]._meta.get_field('image').storage
+        upload = create_presigned_upload(storage, token_data['name'], content_type, policy_data={'kind': kind})
+        # urls of the local upload view are relative, absolute urls are kept as they are
+        return Response({'url': request.build_absolute_uri(upload['url']), 'fields': upload['fields'],
+                         'token': create_upload_token(token_data)}, status=status.HTTP_201_CREATED)
+
+
+class DirectUploadFinalizeView(AuthenticatedRequestMixin, GenericAPIView):
+    """
+    Creates the picture, document or onboarding photo of an upload made with DirectUploadCreateView and enqueues the
+    processing of its image. Takes the upload 'token' along with the other fields of the picture or document.
+    """
+
+    def post(self, request, *args, **kwargs):
+        scout = get_object_or_404(Scout, user=request.user)
+        data = read_upload_token(request.data.get('token', ''))
+        if not data or data['scout'] != scout.id:
+            return Response({STATUS: ERROR, 'message': 'Invalid or expired upload token'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        kind, name = data['kind'], data['name']
+        model = DIRECT_UPLOAD_MODELS[kind]
+        if model.objects.filter(image=name).exists():
+            return Response({STATUS: ERROR, 'message': 'This upload is already finalized'},
+                            status=status.HTTP_409_CONFLICT)
+        if not model._meta.get_field('image').storage.exists(name):
+            return Response({STATUS: ERROR, 'message': 'The file has not been uploaded'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if kind == DIRECT_UPLOAD_ONBOARDING_PHOTO:
+            photo = PropertyOnBoardingPhoto.objects.create(
+                property_on_boarding_house_photo_sub_task_id=data['sub_task'], image=name)
+            transaction.on_commit(lambda: process_property_on_boarding_photo.delay(photo.id))
+            return Response(PropertyOnBoardHousePhotosUploadSerializer(photo).data, status=status.HTTP_201_CREATED)
+
+        if kind == DIRECT_UPLOAD_PICTURE:
+            serializer = ScoutPictureSerializer(data=request.data)
+            save_kwargs = {'is_profile_pic': True}
+        else:
+            serializer = ScoutDocumentSerializer(data=request.data)
+            save_kwargs = {}
+        if serializer.is_valid():
+            # the image of the instance refers to the uploaded file, the model enqueues its processing
+            serializer.save(scout=scout, image=name, **save_kwargs)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class LocalDirectUploadView(GenericAPIView):
+    """
+    Stands in for the presigned POST of S3 when media is not stored on S3, as in development and tests. Like S3, it
+    authenticates the upload by the policy signed when the upload was created, and saves the file to the storage of
+    the image field of the kind of media in the policy. Only routed when that storage is not S3.
+    """
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+
+    def post(self, request, *args, **kwargs):
+        key = request.data.get('key', '')
+        policy = read_local_upload_policy(key, request.data.get('policy', ''))
+        upload = request.FILES.get('file')
+        if not policy or not upload:
+            return Response({STATUS: ERROR, 'message': 'Invalid or expired upload policy'},
+                            status=status.HTTP_403_FORBIDDEN)
+        # the kind is missing from the policies issued before files were saved to the storage of their kind
+        if policy.get('kind') not in DIRECT_UPLOAD_MODELS:
+            return Response({STATUS: ERROR, 'message': 'The upload policy has no valid kind, start the upload again'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if upload.size > policy['max_size'] or upload.content_type != policy['content_type']:
+            return Response({STATUS: ERROR, 'message': 'The file does not match the upload policy'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        storage = DIRECT_UPLOAD_MODELS[policy['kind']]._meta.get_field('image').storage
+        if storage.exists(key):
+            return Response({STATUS: ERROR, 'message': 'This file is already uploaded'},
+                            status=status.HTTP_409_CONFLICT)
+
+        storage.save(key, upload)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class ScoutDocumentDestroyView(AuthenticatedRequestMixin, DestroyAPIView):
     queryset = ScoutDocument.objects.all()
 
@@ -315,16 +460,65 @@ class ScoutPaymentListView(AuthenticatedRequestMixin, ListAPIView):
         return payments
 
 
-class ScoutTaskListView(AuthenticatedRequestMixin, ListAPIView):
+class ScoutPaymentSettleView(GenericAPIView):
+    """ Marks the given pending payments as paid in bulk """
+    authentication_classes = [BasicAuthentication, TokenAuthentication]
+    permission_classes = [IsAdminUser, ]
+    queryset = ScoutPayment.objects.all()
+
+    def post(self, request):
+        payment_ids = request.data.get('payment_ids')
+        # bool is a subclass of int, so true and false have to be rejected explicitly
+        if not isinstance(payment_ids, list) or not all(
+                isinstance(payment_id, int) and not isinstance(payment_id, bool) for payment_id in payment_ids):
+            raise ValidationError({'payment_ids': 'A list of payment ids is required'})
+
+        settled_payments = settle_scout_payments(payment_ids)
+        return Response({'detail': 'settled', 'settled': [payment.id for payment in settled_payments]},
+                        status=status.HTTP_200_OK)
+
+
+class HomesCacheInvalidateView(GenericAPIView):
+    """ Called by the consumer app whenever it changes a homes record cached by us """
+    authentication_classes = [BasicAuthentication, TokenAuthentication]
+    permission_classes = [IsAdminUser, ]
+
+    def post(self, request):
+        model = request.data.get('model')
+        invalidate = HOMES_CACHE_INVALIDATORS.get(model)
+        if not invalidate:
+            raise ValidationError({'model': 'Must be one of {}'.format(', '.join(sorted(HOMES_CACHE_INVALIDATORS)))})
+
+        try:
+            ids = [int(object_id) for object_id in request.data.get('ids', [])]
+        except (TypeError, ValueError):
+            raise ValidationError({'ids': 'A list of ids is required'})
+
+        invalidate(ids)
+        return Response({'detail': 'invalidated', 'model': model, 'ids': ids}, status=status.HTTP_200_OK)
+
+
+class HomesCacheStatsView(GenericAPIView):
+    """ stats of the homes caches of the process serving the request only """
+    authentication_classes = [BasicAuthentication, TokenAuthentication]
+    permission_classes = [IsAdminUser, ]
+
+    def get(self, request):
+        return Response([cache.get_stats() for cache in HOMES_CACHES.values()], status=status.HTTP_200_OK)
+
+
+class ScoutTaskListView(AuthenticatedRequestMixin, HomesObjectsResolverMixin, ListAPIView):
     serializer_class = ScoutTaskListSerializer
     queryset = ScoutTask.objects.all()
 
     def get_queryset(self):
         scout = get_object_or_404(Scout, user=self.request.user)
-        return scout.tasks.filter(status=ASSIGNED).order_by('scheduled_at')
+        return scout.tasks.select_related('category', 'scout__user', 'conversation').filter(
+            status=ASSIGNED).order_by('scheduled_at')
 
 
-class ScoutTaskRetrieveUpdateDestroyAPIView(AuthenticatedRequestMixin, RetrieveUpdateDestroyAPIView):
+class ScoutTaskRetrieveUpdateDestroyAPIView(AuthenticatedRequestMixin, HomesObjectsResolverMixin,
+                                            RetrieveUpdateDestroyAPIView):
     serializer_class = ScoutTaskDetailSerializer
     queryset = ScoutTask.objects.all()
 
@@ -407,6 +601,10 @@ class ScoutConsumerLinkAndScoutTaskCreateView(GenericAPIView):
 
             scout_task.sub_tasks.add(*list(task_category.sub_task_categories.all()))
 
+            if is_batch_scout_assignment_enabled():
+                # scout will be assigned along with other pending tasks by assign_pending_scout_tasks
+                return JsonResponse({'detail': 'queued'})
+
             # Select a scout for a particular task and create a Scout Task Assignment Request
             try:
                 scout = get_appropriate_scout_for_the_task(task=scout_task,
@@ -440,6 +638,10 @@ class ScoutConsumerLinkAndScoutTaskCreateView(GenericAPIView):
 
             scout_task.sub_tasks.add(*list(move_out_task_category.sub_task_categories.all()))
 
+            if is_batch_scout_assignment_enabled():
+                # scout will be assigned along with other pending tasks by assign_pending_scout_tasks
+                return JsonResponse({'detail': 'queued'})
+
             # Select a scout for a particular task and create a Scout Task Assignment Request
 
             try:
@@ -505,6 +707,9 @@ class ScoutConsumerLinkAndScoutTaskCreateView(GenericAPIView):
                     scout = Scout.objects.filter(id=manually_chosen_scout_id).first()
                     # don't divert call if rejected because this task is created by scout itself
                     pass_to_another_scout = False
+                elif is_batch_scout_assignment_enabled():
+                    # scout will be assigned along with other pending tasks by assign_pending_scout_tasks
+                    return JsonResponse({'detail': 'queued'})
                 else:
                     scout = get_appropriate_scout_for_the_task(task=scout_task,
                                                                scouts=Scout.objects.filter(active=True))
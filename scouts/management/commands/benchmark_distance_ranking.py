@@ -0,0 +1,42 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from geopy import distance
+
+from utility.geo_utils import rank_by_distance
+
+
+class Command(BaseCommand):
+    help = 'Compares throughput of the per-candidate geodesic loop with the vectorized haversine ranking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--candidates', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--limit', type=int, default=10)
+
+    def handle(self, *args, **options):
+        latitude, longitude = 28.4973, 77.2088  # somewhere in Delhi
+        candidates = [(i, random.uniform(28.0, 29.0), random.uniform(76.7, 77.7))
+                      for i in range(options['candidates'])]
+
+        def geodesic_loop():
+            result = []
+            for candidate_id, candidate_latitude, candidate_longitude in candidates:
+                exact_distance = distance.distance((latitude, longitude), (candidate_latitude, candidate_longitude)).km
+                if exact_distance <= 50:
+                    result.append((candidate_id, exact_distance))
+            result.sort(key=lambda x: x[1])
+            return result[:options['limit']]
+
+        def vectorized_ranking():
+            return rank_by_distance(latitude, longitude, candidates, distance_range=50, limit=options['limit'],
+                                    geodesic_refinement=5)
+
+        for name, func in (('geodesic loop', geodesic_loop), ('vectorized haversine', vectorized_ranking)):
+            start = time.perf_counter()
+            for _ in range(options['repeat']):
+                func()
+            elapsed = (time.perf_counter() - start) / options['repeat']
+            self.stdout.write('{:<22} {:>10.2f} ms/query {:>14.0f} candidates/s'.format(
+                name, elapsed * 1000, options['candidates'] / elapsed))
@@ -0,0 +1,71 @@
+import multiprocessing
+import resource
+import time
+from io import BytesIO
+
+from PIL import Image as Img, ImageDraw
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+
+from utility.image_utils import compress_image
+
+
+def full_decode_compression(image):
+    """ compression as it was done before the draft mode decode, kept as the baseline """
+    img = Img.open(BytesIO(image.read()))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    output = BytesIO()
+    h, w = img.size
+    new_width = min(400, w)
+    img = img.resize((int((h / w) * new_width), new_width), Img.LANCZOS)
+    img.save(output, format='JPEG', quality=90, optimize=True)
+    thumbnail = BytesIO()
+    img = img.resize((int((h / w) * 100), 100), Img.LANCZOS)
+    img.save(thumbnail, format='JPEG', quality=100, optimize=True)
+    return image.name, output, thumbnail
+
+
+def draft_decode_compression(image):
+    return compress_image(image, quality=90, _create_thumbnail=True, delete_original=False)
+
+
+def measure(func, data, repeat, queue):
+    # runs in a forked process whose peak resident memory starts at the current resident memory
+    peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(ContentFile(data, name='photo.jpg'))
+    elapsed = (time.perf_counter() - start) / repeat
+    queue.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak_before))
+
+
+class Command(BaseCommand):
+    help = 'Compares time and peak memory of full resolution and draft mode decoding of uploaded photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=4032)
+        parser.add_argument('--height', type=int, default=3024)  # 12 MP, as taken by phone cameras
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        img = Img.new('RGB', (options['width'], options['height']), (120, 160, 200))
+        draw = ImageDraw.Draw(img)
+        for x in range(0, options['width'], 64):
+            draw.line((x, 0, options['width'] - x, options['height']), fill=(x % 256, 90, 255 - x % 256), width=9)
+        photo = BytesIO()
+        img.save(photo, format='JPEG', quality=92)
+        data = photo.getvalue()
+        del img, draw, photo
+        self.stdout.write('{}x{} jpeg of {:.1f} MB'.format(options['width'], options['height'], len(data) / 2 ** 20))
+
+        context = multiprocessing.get_context('fork')
+        for name, func in (('full decode', full_decode_compression), ('draft decode', draft_decode_compression)):
+            queue = context.Queue()
+            process = context.Process(target=measure, args=(func, data, options['repeat'], queue))
+            process.start()
+            elapsed, peak_memory = queue.get()
+            process.join()
+            # ru_maxrss is in kilobytes on linux
+            self.stdout.write('{:<14} {:>10.1f} ms/image {:>10.1f} MB peak memory'.format(
+                name, elapsed * 1000, peak_memory / 1024))
@@ -0,0 +1,50 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+# what a web worker imports before serving its first request
+STARTUP_CODE = 'import django; django.setup(); from importlib import import_module; import_module({!r})'
+
+
+class Command(BaseCommand):
+    help = 'Reports the slowest modules imported at startup, as measured by python -X importtime'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', action='append', default=[],
+                            help='additional module to import after setup, may be repeated')
+        parser.add_argument('--limit', type=int, default=25)
+        parser.add_argument('--sort', choices=('cumulative', 'self'), default='cumulative')
+
+    def handle(self, *args, **options):
+        code = STARTUP_CODE.format(settings.ROOT_URLCONF)
+        for module in options['module']:
+            code += '; import_module({!r})'.format(module)
+
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, cwd=settings.BASE_DIR,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if process.returncode:
+            raise CommandError('startup failed:\n' + process.stderr[-2000:])
+
+        imports = []  # (self us, cumulative us, depth, module)
+        for line in process.stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                imports.append((int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2,
+                                match.group(4)))
+
+        # top level imports do not overlap, their cumulative times add up to the total
+        total = sum(cumulative for _, cumulative, depth, _ in imports if depth == 0)
+        self.stdout.write('{} modules imported in {:.1f} ms'.format(len(imports), total / 1000))
+
+        key = 1 if options['sort'] == 'cumulative' else 0
+        self.stdout.write('{:>12} {:>15}  {}'.format('self [ms]', 'cumulative [ms]', 'module'))
+        for self_time, cumulative, _, module in sorted(imports, key=lambda x: x[key], reverse=True)[
+                                                :options['limit']]:
+            self.stdout.write('{:>12.1f} {:>15.1f}  {}'.format(self_time / 1000, cumulative / 1000, module))
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.2 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+from utility.geo_utils import encode_geohash
+
+
+def populate_work_address_geohash(apps, schema_editor):
+    ScoutWorkAddress = apps.get_model('scouts', 'ScoutWorkAddress')
+    for work_address in ScoutWorkAddress.objects.filter(latitude__isnull=False, longitude__isnull=False):
+        work_address.geohash = encode_geohash(work_address.latitude, work_address.longitude)
+        work_address.save(update_fields=['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scouts', '0029_scouttaskassignmentrequest_pass_to_another_scout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scoutworkaddress',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, max_length=12, null=True),
+        ),
+        migrations.RunPython(populate_work_address_geohash, migrations.RunPython.noop),
+    ]
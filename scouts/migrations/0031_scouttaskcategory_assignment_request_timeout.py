@@ -0,0 +1,18 @@
+# Generated by Django 2.2.2 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scouts', '0030_scoutworkaddress_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scouttaskcategory',
+            name='assignment_request_timeout',
+            field=models.PositiveIntegerField(default=20),
+        ),
+    ]
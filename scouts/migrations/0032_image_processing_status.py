@@ -0,0 +1,23 @@
+# Generated by Django 2.2.2 on 2026-10-17 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scouts', '0031_scouttaskcategory_assignment_request_timeout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scoutdocument',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='done', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='scoutpicture',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='done', max_length=20),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.2 on 2026-10-17 18:45
+
+from django.db import migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scouts', '0032_image_processing_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scoutdocument',
+            name='renditions',
+            field=jsonfield.fields.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scoutpicture',
+            name='renditions',
+            field=jsonfield.fields.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.2 on 2026-10-18 10:05
+
+from django.db import migrations
+
+from utility.geo_utils import encode_geohash
+
+
+def backfill_work_address_geohash(apps, schema_editor):
+    # nearby scouts are only found through their geohash, which is missing or stale for the work addresses written
+    # without ScoutWorkAddress.save() since it was added (e.g. by queryset updates or fixtures)
+    ScoutWorkAddress = apps.get_model('scouts', 'ScoutWorkAddress')
+    work_addresses = []
+    for work_address in ScoutWorkAddress.objects.filter(latitude__isnull=False, longitude__isnull=False).only(
+            'id', 'latitude', 'longitude', 'geohash').iterator():
+        geohash = encode_geohash(work_address.latitude, work_address.longitude)
+        if work_address.geohash != geohash:
+            work_address.geohash = geohash
+            work_addresses.append(work_address)
+    ScoutWorkAddress.objects.bulk_update(work_addresses, ['geohash'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scouts', '0033_image_renditions'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_work_address_geohash, migrations.RunPython.noop),
+    ]
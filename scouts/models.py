@@ -1,27 +1,32 @@
+import posixpath
 import random
+from collections import defaultdict
 from datetime import datetime, timedelta
 
 from django.conf import settings
 from django.contrib.auth.signals import user_logged_out
 from django.core.files.base import ContentFile
 from django.core.validators import RegexValidator
-from django.db import models
-from django.db.models import Sum
-from django.db.models.signals import post_save, pre_save
+from django.db import models, transaction
+from django.db.models import Sum, F, Q, Func, Value
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
+from jsonfield import JSONField
 
 from Homes.Bookings.models import Booking
 from Homes.Houses.models import HouseVisit, House
 from Homes.Tenants.models import TenantMoveOutRequest
+from Homes.cache import house_visit_cache
 from chat.models import Conversation, Participant
 from chat.utils import TYPE_SCOUT, TYPE_CUSTOMER
 from common.models import AddressDetail, BankDetail, Wallet, Document, NotificationCategory, Notification
 from common.utils import PaymentStatusCategories, PENDING, PAID, DocumentTypeCategories, WITHDRAWAL, \
-    PaymentTypeCategories, DEPOSIT
-from scouts.tasks import send_scout_notification, scout_assignment_request_set_rejected
+    PaymentTypeCategories, DEPOSIT, ImageProcessingStatusCategories, IMAGE_PROCESSING_PENDING, IMAGE_PROCESSING_DONE, \
+    IMAGE_PROCESSING_FAILED
+from scouts.tasks import scout_assignment_request_set_rejected, process_scout_picture, process_scout_document
 from scouts.utils import default_profile_pic_url, default_profile_pic_thumbnail_url, get_picture_upload_path, \
     get_thumbnail_upload_path, get_scout_document_upload_path, get_scout_document_thumbnail_upload_path, \
     get_scout_task_category_image_upload_path, ScoutTaskStatusCategories, \
@@ -31,8 +36,11 @@ from scouts.utils import default_profile_pic_url, default_profile_pic_thumbnail_
     get_description_for_completion_of_current_task_and_receiving_payment_in_bank_account, MOVE_OUT, \
     MOVE_OUT_AMENITY_CHECKUP, MOVE_OUT_REMARK, get_appropriate_scout_for_the_task, PROPERTY_ONBOARDING, \
     PROPERTY_ONBOARDING_HOUSE_PHOTOS_SUBTASK, PROPERTY_ONBOARDING_HOUSE_AMENITIY_SUBTASK, \
-    get_amenities_json_from_move_out_request_id, HOUSE_VISIT
-from utility.image_utils import compress_image
+    get_amenities_json_from_move_out_request_id, HOUSE_VISIT, update_availability_index, \
+    DEFAULT_ASSIGNMENT_REQUEST_TIMEOUT, schedule_assignment_request_expiry, SCOUT_NOTIFICATION_BATCH_SIZE, \
+    queue_scout_notifications
+from utility.geo_utils import encode_geohash
+from utility.image_utils import create_image_renditions, RENDITION_FORMAT_EXTENSIONS
 from utility.logging_utils import sentry_debug_logger
 
 
@@ -100,6 +108,15 @@ class ScoutPermanentAddress(AddressDetail):
 class ScoutWorkAddress(AddressDetail):
     scout = models.OneToOneField('Scout', on_delete=models.CASCADE, related_name='work_address')
     same_as_permanent_address = models.BooleanField(default=False)
+    geohash = models.CharField(max_length=12, blank=True, null=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        # keep the spatial index key in sync with the coordinates
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = None
+        super(ScoutWorkAddress, self).save(*args, **kwargs)
 
 
 class ScoutBankDetail(BankDetail):
@@ -132,15 +149,19 @@ class ScoutPicture(models.Model):
     is_profile_pic = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True, auto_now=False)
     is_deleted = models.BooleanField(default=False)
+    processing_status = models.CharField(max_length=20, choices=ImageProcessingStatusCategories,
+                                         default=IMAGE_PROCESSING_DONE)
+    # storage names of the responsive renditions, by format extension and width
+    renditions = JSONField(blank=True, null=True)
 
     def __str__(self):
         return str(self.id)
 
     def save(self, *args, **kwargs):
-        if not self.pk:
-            temp_name, output, thumbnail = compress_image(self.image, quality=90, _create_thumbnail=True)
-            self.image.save(temp_name, content=ContentFile(output.getvalue()), save=False)
-            self.thumbnail.save(temp_name, content=ContentFile(thumbnail.getvalue()), save=False)
+        process_image = bool(not self.pk and self.image)
+        if process_image:
+            # the original is stored as uploaded, renditions are generated in the background
+            self.processing_status = IMAGE_PROCESSING_PENDING
 
         if self.is_deleted and self.is_profile_pic:
             self.is_profile_pic = False
@@ -149,25 +170,98 @@ class ScoutPicture(models.Model):
             self.scout.save()
         super(ScoutPicture, self).save(*args, **kwargs)
 
+        if process_image:
+            transaction.on_commit(lambda: process_scout_picture.delay(self.id))
+
 
 class ScoutDocument(Document):
     scout = models.ForeignKey('Scout', null=True, on_delete=models.SET_NULL, related_name='documents')
     image = models.ImageField(upload_to=get_scout_document_upload_path, blank=True, null=True)
     thumbnail = models.ImageField(upload_to=get_scout_document_thumbnail_upload_path, null=True, blank=True)
+    processing_status = models.CharField(max_length=20, choices=ImageProcessingStatusCategories,
+                                         default=IMAGE_PROCESSING_DONE)
+    # storage names of the responsive renditions, by format extension and width
+    renditions = JSONField(blank=True, null=True)
 
     def save(self, *args, **kwargs):
-        if self.id is None:
-            temp_name, output, thumbnail = compress_image(self.image, quality=90, _create_thumbnail=True)
-            self.image = None
-            self.thumbnail = None
-            super(ScoutDocument, self).save(*args, **kwargs)
-            self.image.save(temp_name, content=ContentFile(output.getvalue()), save=False)
-            self.thumbnail.save(temp_name, content=ContentFile(thumbnail.getvalue()), save=False)
-            if 'force_insert' in kwargs:
-                kwargs.pop('force_insert')
+        process_image = bool(self.id is None and self.image)
+        if process_image:
+            self.processing_status = IMAGE_PROCESSING_PENDING
+            # an original uploaded straight to the storage is already committed and stays where it was uploaded
+            if not self.image._committed:
+                # the upload path contains the id, so the original is stored once the document has been inserted
+                upload = self.image
+                self.image = None
+                super(ScoutDocument, self).save(*args, **kwargs)
+                self.image.save(upload.name, content=upload.file, save=False)
+                if 'force_insert' in kwargs:
+                    kwargs.pop('force_insert')
 
         super(ScoutDocument, self).save(*args, **kwargs)
 
+        if process_image:
+            transaction.on_commit(lambda: process_scout_document.delay(self.id))
+
+
+def get_rendition_name(image_name, width, extension):
+    directory, file_name = posixpath.split(image_name)
+    return posixpath.join(directory, 'renditions', '{}-{}w.{}'.format(posixpath.splitext(file_name)[0], width,
+                                                                    extension))
+
+
+def generate_image_renditions(model, instance_id):
+    """
+    Replaces the original image of a ScoutPicture or ScoutDocument with its compressed rendition and creates the
+    thumbnail and the responsive renditions configured by IMAGE_RENDITION_WIDTHS and IMAGE_RENDITION_FORMATS. The
+    original is deleted only once the instance points to the renditions.
+
+    :return: (instance, url of the original image), None if the instance is not pending
+    """
+    instance = model.objects.filter(id=instance_id, processing_status=IMAGE_PROCESSING_PENDING).select_related(
+        'scout').first()
+    if not instance:
+        return None
+
+    original_name, original_url = instance.image.name, instance.image.url
+    try:
+        compressed, thumbnail, renditions = create_image_renditions(
+            instance.image, settings.IMAGE_RENDITION_WIDTHS, settings.IMAGE_RENDITION_FORMATS, quality=90)
+        instance.image.save(original_name, content=ContentFile(compressed.getvalue()), save=False)
+        instance.thumbnail.save(original_name, content=ContentFile(thumbnail.getvalue()), save=False)
+        storage = instance.image.storage
+        instance.renditions = {
+            RENDITION_FORMAT_EXTENSIONS[image_format]: {
+                str(width): storage.save(get_rendition_name(instance.image.name, width,
+                                                            RENDITION_FORMAT_EXTENSIONS[image_format]),
+                                         ContentFile(rendition.getvalue()))
+                for width, rendition in format_renditions.items()}
+            for image_format, format_renditions in renditions.items()}
+    except Exception as E:
+        sentry_debug_logger.error('error while processing image of {} {}: {}'.format(model.__name__, instance_id,
+                                                                                    str(E)), exc_info=True)
+        model.objects.filter(id=instance_id).update(processing_status=IMAGE_PROCESSING_FAILED)
+        return None
+
+    instance.processing_status = IMAGE_PROCESSING_DONE
+    model.objects.filter(id=instance_id).update(image=instance.image.name, thumbnail=instance.thumbnail.name,
+                                                renditions=instance.renditions,
+                                                processing_status=IMAGE_PROCESSING_DONE)
+    instance.image.storage.delete(original_name)
+    return instance, original_url
+
+
+def process_scout_picture_image(picture_id):
+    result = generate_image_renditions(ScoutPicture, picture_id)
+    if result:
+        picture, original_url = result
+        # unless another picture has been made the profile pic meanwhile
+        Scout.objects.filter(id=picture.scout_id, profile_pic_url=original_url).update(
+            profile_pic_url=picture.image.url, profile_pic_thumbnail_url=picture.thumbnail.url)
+
+
+def process_scout_document_image(document_id):
+    generate_image_renditions(ScoutDocument, document_id)
+
 
 class OTP(models.Model):
     phone_no = models.CharField(max_length=30)
@@ -189,12 +283,14 @@ class ScoutNotification(Notification):
                                  related_name='notifications')
 
     def save(self, *args, **kwargs):
-        if not self.pk:
-            from scouts.api.serializers import ScoutTaskCategorySerializer
-            send_scout_notification.delay(self.scout.id, title=self.category.name, content=self.content,
-                                          category=ScoutTaskCategorySerializer(self.category).data,
-                                          payload=self.payload)
+        created = not self.pk
         super(ScoutNotification, self).save(*args, **kwargs)
+        if created:
+            from scouts.api.serializers import ScoutTaskCategorySerializer
+            notification = {'scout_id': self.scout_id, 'title': self.category.name, 'content': self.content,
+                            'category': ScoutTaskCategorySerializer(self.category).data, 'payload': self.payload}
+            # pushed only once the notification is committed
+            transaction.on_commit(lambda: queue_scout_notifications([notification]))
 
     def get_notification_image_html(self):
         if self.category and self.category.image:
@@ -222,6 +318,8 @@ class ScoutTaskCategory(models.Model):
     name = models.CharField(max_length=255, unique=True)
     image = models.ImageField(upload_to=get_scout_task_category_image_upload_path, null=True, blank=True)
     earning = models.FloatField(default=0)
+    # seconds after which an unanswered assignment request is auto rejected
+    assignment_request_timeout = models.PositiveIntegerField(default=DEFAULT_ASSIGNMENT_REQUEST_TIMEOUT)
 
     class Meta:
         verbose_name_plural = 'Scout task categories'
@@ -446,7 +544,8 @@ def scout_post_save_hook(sender, instance, created, **kwargs):
 def scout_picture_post_save_task(sender, instance, *args, **kwargs):
     if instance.is_profile_pic:
         instance.scout.profile_pic_url = instance.image.url
-        instance.scout.profile_pic_thumbnail_url = instance.thumbnail.url
+        # the original is shown until the thumbnail has been generated
+        instance.scout.profile_pic_thumbnail_url = (instance.thumbnail or instance.image).url
         instance.scout.save()
         last_profile_pic = instance.scout.pictures.filter(is_profile_pic=True).exclude(id=instance.id).first()
         if last_profile_pic:
@@ -454,10 +553,158 @@ def scout_picture_post_save_task(sender, instance, *args, **kwargs):
             super(ScoutPicture, last_profile_pic).save()
 
 
+def sync_scheduled_availability_index(availability_id, window=()):
+    # the periodic rebuild of the index fixes any update missed while redis was unreachable
+    try:
+        update_availability_index(availability_id, *window)
+    except Exception as E:
+        sentry_debug_logger.error('error while updating availability index of scheduled availability {}: {}'.format(
+            availability_id, str(E)), exc_info=True)
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=ScheduledAvailability)
+def scheduled_availability_post_save_hook(sender, instance, **kwargs):
+    availability_id = instance.id
+    window = () if instance.cancelled else (instance.scout_id, instance.start_time, instance.end_time)
+    # indexed once committed, so that rolled back changes are never looked up
+    transaction.on_commit(lambda: sync_scheduled_availability_index(availability_id, window))
+
+
+# noinspection PyUnusedLocal
+@receiver(post_delete, sender=ScheduledAvailability)
+def scheduled_availability_post_delete_hook(sender, instance, **kwargs):
+    availability_id = instance.id
+    transaction.on_commit(lambda: sync_scheduled_availability_index(availability_id))
+
+
+# wallet field to which the amount of a payment of given (type, status) is added
+WALLET_FIELD_FOR_PAYMENT = {
+    (DEPOSIT, PAID): 'credit',
+    (WITHDRAWAL, PAID): 'debit',
+    (DEPOSIT, PENDING): 'pending_deposit',
+    (WITHDRAWAL, PENDING): 'pending_withdrawal',
+}
+
+
+def apply_scout_wallet_deltas(deltas):
+    """
+    Applies the given changes to wallet totals with F() expressions, so concurrent payments never overwrite each
+    other's updates and no payment history has to be read.
+
+    :param deltas: dict of wallet id -> dict of wallet field -> amount to be added
+    """
+    with transaction.atomic():
+        for wallet_id, field_deltas in deltas.items():
+            updates = {field: F(field) + delta for field, delta in field_deltas.items() if delta}
+            if not updates:
+                continue
+
+            ScoutWallet.objects.filter(id=wallet_id).update(**updates)
+            if 'credit' in updates or 'debit' in updates:
+                # separate update as mysql evaluates assignments left to right while other databases do not
+                ScoutWallet.objects.filter(id=wallet_id).update(balance=Func(F('credit') - F('debit'), Value(2),
+                                                                             function='ROUND'))
+
+
+def recompute_scout_wallets(wallet_ids=None):
+    """
+    Recomputes the wallet totals from the payments with a single grouped aggregate
+
+    :return: dict of wallet id -> dict of wallet field -> recomputed total
+    """
+    wallets = ScoutWallet.objects.all()
+    if wallet_ids is not None:
+        wallets = wallets.filter(id__in=wallet_ids)
+
+    totals = {wallet_id: {field: 0 for field in WALLET_FIELD_FOR_PAYMENT.values()}
+              for wallet_id in wallets.values_list('id', flat=True)}
+
+    payments = ScoutPayment.objects.filter(wallet__in=wallets).values('wallet').annotate(**{
+        field: Sum('amount', filter=Q(type=payment_type, status=status))
+        for (payment_type, status), field in WALLET_FIELD_FOR_PAYMENT.items()})
+
+    for payment_totals in payments:
+        wallet_id = payment_totals.pop('wallet')
+        totals[wallet_id].update({field: total or 0 for field, total in payment_totals.items()})
+
+    return totals
+
+
+def reconcile_scout_wallets(wallet_ids=None, tolerance=0.01):
+    """
+    Compares the incrementally maintained wallet totals with the totals recomputed from the payments and fixes
+    the wallets that drifted.
+
+    :return: dict of wallet id -> dict of drifted field -> (stored value, recomputed value)
+    """
+    totals = recompute_scout_wallets(wallet_ids)
+    fields = list(WALLET_FIELD_FOR_PAYMENT.values())
+
+    drifts = {}
+    for wallet in ScoutWallet.objects.filter(id__in=list(totals)).only('id', *fields):
+        drift = {field: (getattr(wallet, field), totals[wallet.id][field]) for field in fields
+                 if abs(getattr(wallet, field) - totals[wallet.id][field]) > tolerance}
+        if drift:
+            drifts[wallet.id] = drift
+            ScoutWallet.objects.filter(id=wallet.id).update(
+                balance=round(totals[wallet.id]['credit'] - totals[wallet.id]['debit'], 2), **totals[wallet.id])
+
+    return drifts
+
+
+def settle_scout_payments(payment_ids):
+    """
+    Marks the pending payments among the given ones as paid in a single transaction. Every affected wallet is
+    updated once and the withdrawal notifications are created with one insert and pushed in batches.
+
+    :return: list of settled payments
+    """
+    from scouts.api.serializers import ScoutPaymentSerializer, ScoutTaskCategorySerializer
+
+    with transaction.atomic():
+        payments = list(ScoutPayment.objects.select_for_update().select_related('wallet').filter(
+            id__in=payment_ids, status=PENDING))
+        if not payments:
+            return []
+
+        paid_on = timezone.now()
+        ScoutPayment.objects.filter(id__in=[payment.id for payment in payments]).update(status=PAID, paid_on=paid_on)
+
+        deltas = defaultdict(lambda: defaultdict(float))
+        for payment in payments:
+            payment.status, payment.paid_on = PAID, paid_on
+            if payment.wallet_id:
+                deltas[payment.wallet_id][WALLET_FIELD_FOR_PAYMENT[(payment.type, PENDING)]] -= payment.amount
+                deltas[payment.wallet_id][WALLET_FIELD_FOR_PAYMENT[(payment.type, PAID)]] += payment.amount
+        apply_scout_wallet_deltas(deltas)
+
+        new_payment_received_notification_category, _ = ScoutNotificationCategory.objects. \
+            get_or_create(name=NEW_PAYMENT_RECEIVED)
+        # bulk_create skips ScoutNotification.save so the pushes are sent below in batches instead of one by one
+        notifications = ScoutNotification.objects.bulk_create([
+            ScoutNotification(category=new_payment_received_notification_category, scout_id=payment.wallet.scout_id,
+                              payload=ScoutPaymentSerializer(payment).data, display=True)
+            for payment in payments if payment.type == WITHDRAWAL and payment.wallet_id],
+            batch_size=SCOUT_NOTIFICATION_BATCH_SIZE)
+
+        category = ScoutTaskCategorySerializer(new_payment_received_notification_category).data
+        messages = [{'scout_id': notification.scout_id, 'title': new_payment_received_notification_category.name,
+                     'content': notification.content, 'category': category, 'payload': notification.payload}
+                    for notification in notifications]
+
+        transaction.on_commit(lambda: queue_scout_notifications(messages))
+
+    return payments
+
+
 # noinspection PyUnusedLocal
 @receiver(pre_save, sender=ScoutPayment)
 def scout_payment_pre_save_hook(sender, instance, **kwargs):
     old_payment = ScoutPayment.objects.filter(id=instance.id).first()
+    # remembered to update the wallet by the difference of old and new payment in post save
+    instance._old_payment_state = (old_payment.wallet_id, old_payment.type, old_payment.status,
+                                   old_payment.amount) if old_payment else None
     if not old_payment:
         return
 
@@ -476,13 +723,24 @@ def scout_payment_pre_save_hook(sender, instance, **kwargs):
 
 @receiver(post_save, sender=ScoutPayment)
 def scout_payment_post_save_hook(sender, instance, created, **kwargs):
-    wallet = instance.wallet
-    wallet.debit = sum(payment.amount for payment in wallet.payments.filter(type=WITHDRAWAL, status=PAID))
-    wallet.credit = sum(payment.amount for payment in wallet.payments.filter(type=DEPOSIT, status=PAID))
-    wallet.pending_deposit = sum(payment.amount for payment in wallet.payments.filter(type=DEPOSIT, status=PENDING))
-    wallet.pending_withdrawal = sum(payment.amount for payment in wallet.payments.filter(type=WITHDRAWAL,
-                                                                                         status=PENDING))
-    wallet.save()
+    deltas = defaultdict(lambda: defaultdict(float))
+
+    old_payment_state = getattr(instance, '_old_payment_state', None)
+    if old_payment_state:
+        old_wallet_id, old_type, old_status, old_amount = old_payment_state
+        old_field = WALLET_FIELD_FOR_PAYMENT.get((old_type, old_status))
+        if old_wallet_id and old_field:
+            deltas[old_wallet_id][old_field] -= old_amount
+
+    field = WALLET_FIELD_FOR_PAYMENT.get((instance.type, instance.status))
+    if instance.wallet_id and field:
+        deltas[instance.wallet_id][field] += instance.amount
+
+    apply_scout_wallet_deltas(deltas)
+
+    if ScoutPayment.wallet.is_cached(instance) and instance.wallet:
+        instance.wallet.refresh_from_db(fields=['credit', 'debit', 'balance', 'pending_deposit',
+                                                'pending_withdrawal'])
 
 
 @receiver(pre_save, sender=ScoutTask)
@@ -531,6 +789,7 @@ def scout_task_pre_save_hook(sender, instance, **kwargs):
             house_visit = HouseVisit.objects.using(settings.HOMES_DB).get(id=instance.visit_id)
             house_visit.visited = True
             house_visit.save()
+            house_visit_cache.invalidate([house_visit.id])
 
 
     # Manage rating given to Scout
@@ -592,25 +851,89 @@ def scout_task_post_save_hook(sender, instance, created, **kwargs):
         manage_scout_sub_tasks_for_new_task(instance)
 
 
-# noinspection PyUnusedLocal
-@receiver(post_save, sender=ScoutTaskAssignmentRequest)
-def scout_task_assignment_request_post_save_hook(sender, instance, created, **kwargs):
-    # just sending the notification
+def notify_scout_about_task_assignment_request(instance):
     task = instance.task
-    if created and task:
-        new_task_notification_category, _ = ScoutNotificationCategory.objects.get_or_create(name=NEW_TASK_NOTIFICATION)
-        from scouts.api.serializers import NewScoutTaskNotificationSerializer
-        ScoutNotification.objects.create(category=new_task_notification_category, scout=instance.scout,
-                                         payload=NewScoutTaskNotificationSerializer(task).data, display=False)
+    new_task_notification_category, _ = ScoutNotificationCategory.objects.get_or_create(name=NEW_TASK_NOTIFICATION)
+    from scouts.api.serializers import NewScoutTaskNotificationSerializer
+    ScoutNotification.objects.create(category=new_task_notification_category, scout=instance.scout,
+                                     payload=NewScoutTaskNotificationSerializer(task).data, display=False)
 
+    timeout = task.category.assignment_request_timeout if task.category else DEFAULT_ASSIGNMENT_REQUEST_TIMEOUT
+    send_date = timezone.now() + timedelta(seconds=timeout)
+    try:
+        schedule_assignment_request_expiry(instance.id, send_date)
+    except Exception as E:
+        sentry_debug_logger.error('error while scheduling assignment request expiry is ' + str(E), exc_info=True)
         try:
-            send_date = timezone.now() + timedelta(seconds=20)
             scout_assignment_request_set_rejected.apply_async([instance.id], eta=send_date)
-            # sentry_debug_logger.debug('auto rejecting after 2 minutes', exc_info=True)
         except Exception as E:
             sentry_debug_logger.error('error while auto rejecting task is ' + str(E), exc_info=True)
 
 
+def pass_task_to_another_scout(assignment_request):
+    """ find another scout for the task excluding the one who rejected it and send them a new request """
+    task = assignment_request.task
+    scout = get_appropriate_scout_for_the_task(task=task,
+                                               scouts=Scout.objects.filter(active=True).exclude(
+                                                   id=assignment_request.scout_id)
+                                               )
+
+    if scout:
+        ScoutTaskAssignmentRequest.objects.create(task=task, scout=scout)
+
+    else:
+        sentry_debug_logger.debug("no more scout exists")
+
+
+def auto_reject_scout_task_assignment_requests(assignment_request_ids):
+    """
+    Rejects the still awaited requests among the given ones with a single update and passes their tasks on to
+    other scouts.
+    """
+    with transaction.atomic():
+        expired_requests = list(ScoutTaskAssignmentRequest.objects.select_for_update().select_related(
+            'task__category').filter(id__in=assignment_request_ids, status=REQUEST_AWAITED))
+        ScoutTaskAssignmentRequest.objects.filter(id__in=[request.id for request in expired_requests]).update(
+            status=REQUEST_REJECTED, auto_rejected=True, responded_at=timezone.now())
+
+    for expired_request in expired_requests:
+        if expired_request.task and expired_request.pass_to_another_scout:
+            try:
+                pass_task_to_another_scout(expired_request)
+            except Exception as E:
+                sentry_debug_logger.error('error while passing task {} to another scout: {}'.format(
+                    expired_request.task_id, str(E)), exc_info=True)
+
+    return expired_requests
+
+
+def create_scout_task_assignment_requests(assignments):
+    """
+    Creates assignment requests for a batch of (task, scout) pairs with a single insert and notifies the scouts
+    """
+    if not assignments:
+        return []
+
+    ScoutTaskAssignmentRequest.objects.bulk_create([ScoutTaskAssignmentRequest(task=task, scout=scout)
+                                                    for task, scout in assignments])
+
+    # bulk_create neither sends post_save signals nor sets primary keys on mysql, so fetch the created requests
+    assignment_requests = list(ScoutTaskAssignmentRequest.objects.select_related('task__category', 'scout').filter(
+        task__in=[task for task, _ in assignments], status=REQUEST_AWAITED))
+    for assignment_request in assignment_requests:
+        notify_scout_about_task_assignment_request(assignment_request)
+
+    return assignment_requests
+
+
+# noinspection PyUnusedLocal
+@receiver(post_save, sender=ScoutTaskAssignmentRequest)
+def scout_task_assignment_request_post_save_hook(sender, instance, created, **kwargs):
+    # just sending the notification
+    if created and instance.task:
+        notify_scout_about_task_assignment_request(instance)
+
+
 # noinspection PyUnusedLocal
 @receiver(pre_save, sender=ScoutTaskAssignmentRequest)
 def scout_task_assignment_request_pre_save_hook(sender, instance, update_fields={'responded_at'}, **kwargs):
@@ -635,18 +958,7 @@ def scout_task_assignment_request_pre_save_hook(sender, instance, update_fields=
             # find some other scout to send notification to
             # create another scout task assignment request
             # sentry_debug_logger.debug('scout rejected the request')
-
-            # find another scout for the visit task excluding this scout
-            scout = get_appropriate_scout_for_the_task(task=task,
-                                                       scouts=Scout.objects.filter(active=True).exclude(
-                                                           id=instance.scout.id)
-                                                       )
-
-            if scout:
-                ScoutTaskAssignmentRequest.objects.create(task=task, scout=scout)
-
-            else:
-                sentry_debug_logger.debug("no more scout exists")
+            pass_task_to_another_scout(instance)
 
 
 # noinspection PyUnusedLocal
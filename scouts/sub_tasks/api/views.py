@@ -7,7 +7,8 @@ from rest_framework import status
 from rest_framework.authentication import BasicAuthentication, TokenAuthentication
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.exceptions import ValidationError
-from rest_framework.generics import UpdateAPIView, get_object_or_404, RetrieveUpdateAPIView, CreateAPIView
+from rest_framework.generics import UpdateAPIView, get_object_or_404, RetrieveUpdateAPIView, CreateAPIView, \
+    GenericAPIView
 from rest_framework.response import Response
 
 from Homes.Houses.utils import SCOUT_TASK_URL
@@ -18,7 +19,8 @@ from scouts.sub_tasks.api.serializers import MoveOutRemarkUpdateSerializer, Move
     PropertyOnBoardHouseBasicDetailsCreateSerializer, \
     PropertyOnBoardHousePhotosUploadSerializer, PropertyOnBoardHouseAmenitiesUpdateSerializer
 from scouts.sub_tasks.models import MoveOutRemark, MoveOutAmenitiesCheckup, PropertyOnBoardingHousePhoto, \
-    PropertyOnBoardingHouseAmenity
+    PropertyOnBoardingHouseAmenity, upload_property_on_boarding_photos
+from scouts.sub_tasks.utils import PROPERTY_ON_BOARDING_PHOTOS_UPLOAD_LIMIT
 from scouts.utils import ASSIGNED, MOVE_OUT, PROPERTY_ONBOARDING, PROPERTY_ONBOARDING_HOUSE_ADDRESS_SUBTASK, \
     PROPERTY_ONBOARDING_HOUSE_BASIC_DETAILS_SUBTASK, TASK_TYPE
 from utility.logging_utils import sentry_debug_logger
@@ -130,6 +132,36 @@ class PropertyOnBoardHousePhotosUploadView(CreateAPIView):
         return PropertyOnBoardingHousePhoto.objects.filter(task=self.scout_task)
 
 
+class PropertyOnBoardHousePhotosBulkUploadView(GenericAPIView):
+    """
+    Uploads a batch of house photos sent as 'images' in one request, compressing and uploading them concurrently.
+    Responds with the result of each photo, in the order in which they were sent.
+    """
+    authentication_classes = (BasicAuthentication, TokenAuthentication)
+    permission_classes = (IsScout,)
+
+    def post(self, request, *args, **kwargs):
+        scout = get_object_or_404(Scout, user=self.request.user)
+        scout_task = get_object_or_404(ScoutTask, id=self.kwargs.get('task_id'), scout=scout, status=ASSIGNED,
+                                       category__name=PROPERTY_ONBOARDING)
+        house_photo_sub_task = PropertyOnBoardingHousePhoto.objects.select_related('task').filter(
+            task=scout_task).first()
+        if not house_photo_sub_task:
+            raise ValidationError({STATUS: ERROR, 'message': 'No Property On Boarding House Photo Sub Task found'})
+
+        images = request.FILES.getlist('images')
+        if not images:
+            raise ValidationError({STATUS: ERROR, 'message': 'No images were uploaded'})
+        if len(images) > PROPERTY_ON_BOARDING_PHOTOS_UPLOAD_LIMIT:
+            raise ValidationError({STATUS: ERROR, 'message': 'At most {} images can be uploaded at once'.format(
+                PROPERTY_ON_BOARDING_PHOTOS_UPLOAD_LIMIT)})
+
+        results = upload_property_on_boarding_photos(house_photo_sub_task, images)
+        if any(result[STATUS] == SUCCESS for result in results):
+            return Response({STATUS: SUCCESS, DATA: results}, status=status.HTTP_201_CREATED)
+        return Response({STATUS: ERROR, DATA: results}, status=status.HTTP_400_BAD_REQUEST)
+
+
 class PropertyOnBoardHouseAmenitiesUpdateView(UpdateAPIView):
     serializer_class = PropertyOnBoardHouseAmenitiesUpdateSerializer
     authentication_classes = (BasicAuthentication, TokenAuthentication)
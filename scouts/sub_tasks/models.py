@@ -1,3 +1,7 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
 from django.db import models
 from jsonfield import JSONField
 from multiselectfield import MultiSelectField
@@ -5,8 +9,13 @@ from multiselectfield import MultiSelectField
 from Homes.Houses.utils import HouseFurnishTypeCategories, HouseAccomodationTypeCategories
 from scouts.models import ScoutTask, ScoutTaskCategory, ScoutSubTaskCategory
 from scouts.sub_tasks.utils import MOVE_OUT_AMENITIES_CHECKUP_DEFAULT_JSON, \
-    get_property_on_boarding_house_picture_upload_path, PROPERTY_ON_BOARD_AMENITIES_DEFAULT_JSON
+    get_property_on_boarding_house_picture_upload_path, PROPERTY_ON_BOARD_AMENITIES_DEFAULT_JSON, \
+    PROPERTY_ON_BOARDING_PHOTOS_UPLOAD_WORKERS, PROPERTY_ON_BOARDING_PHOTO_MAX_SIDE, \
+    PROPERTY_ON_BOARDING_PHOTO_QUALITY
 from scouts.utils import MOVE_OUT, PROPERTY_ONBOARDING
+from utility.image_utils import downscale_image, run_in_native_thread
+from utility.logging_utils import sentry_debug_logger
+from utility.render_response_utils import STATUS, SUCCESS, ERROR
 
 
 #  MOVE OUT SUB TASKS
@@ -70,6 +79,45 @@ class PropertyOnBoardingPhoto(models.Model):
                                                                   on_delete=models.SET_NULL, related_name='photos')
 
 
+def upload_property_on_boarding_photos(house_photo_sub_task, images):
+    """
+    Compresses the images and uploads them to the storage in a pool of threads, then inserts the photos of the
+    successful uploads with a single query. The sub task must have its task selected along, so that the threads
+    make no database queries. Under eventlet the pool runs green threads, so the compression itself is handed to
+    native threads. If the insert fails the uploaded files are deleted from the storage.
+
+    :return: result of each image in the order given, with the url of the photo or the error message
+    """
+    def upload(image):
+        photo = PropertyOnBoardingPhoto(property_on_boarding_house_photo_sub_task=house_photo_sub_task)
+        output = run_in_native_thread(downscale_image, image, PROPERTY_ON_BOARDING_PHOTO_MAX_SIDE,
+                                      PROPERTY_ON_BOARDING_PHOTO_QUALITY)
+        photo.image.save(os.path.splitext(image.name)[0] + '.jpg', ContentFile(output.getvalue()), save=False)
+        return photo
+
+    with ThreadPoolExecutor(max_workers=min(PROPERTY_ON_BOARDING_PHOTOS_UPLOAD_WORKERS, len(images))) as executor:
+        futures = [executor.submit(upload, image) for image in images]
+
+    results, photos = [], []
+    for image, future in zip(images, futures):
+        try:
+            photo = future.result()
+        except Exception as E:
+            sentry_debug_logger.error('error while uploading property on boarding photo: ' + str(E), exc_info=True)
+            results.append({'name': image.name, STATUS: ERROR, 'message': 'Could not process this image'})
+        else:
+            photos.append(photo)
+            results.append({'name': image.name, STATUS: SUCCESS, 'image': photo.image.url})
+
+    try:
+        PropertyOnBoardingPhoto.objects.bulk_create(photos)
+    except Exception:
+        for photo in photos:
+            photo.image.storage.delete(photo.image.name)
+        raise
+    return results
+
+
 class PropertyOnBoardingHouseAmenity(PropertyOnBoardingSubTask):  # SubTask 3
     task = models.OneToOneField(ScoutTask, on_delete=models.SET_NULL, null=True, blank=True,
                                 related_name='property_on_board_house_amenity')
@@ -84,3 +132,25 @@ class PropertyOnBoardingHouseBasicDetail(PropertyOnBoardingSubTask):  # SubTask
     space_type = MultiSelectField(max_length=25, max_choices=3, choices=HouseAccomodationTypeCategories)
     rent = models.FloatField(null=True, blank=True)
     bhk_count = models.IntegerField(default=0)
+
+
+def process_property_on_boarding_photo_image(photo_id):
+    """
+    Downscales a photo uploaded straight to the storage the way the bulk upload does, storing it under the upload
+    path of the sub task. The original is deleted only once the photo points to the downscaled image.
+    """
+    photo = PropertyOnBoardingPhoto.objects.filter(id=photo_id).select_related(
+        'property_on_boarding_house_photo_sub_task__task').first()
+    if not photo:
+        return
+
+    original_name = photo.image.name
+    try:
+        output = downscale_image(photo.image, PROPERTY_ON_BOARDING_PHOTO_MAX_SIDE, PROPERTY_ON_BOARDING_PHOTO_QUALITY)
+        photo.image.save(os.path.splitext(original_name.split('/')[-1])[0] + '.jpg', ContentFile(output.getvalue()),
+                         save=True)
+    except Exception as E:
+        sentry_debug_logger.error('error while processing property on boarding photo: ' + str(E), exc_info=True)
+        return
+
+    photo.image.storage.delete(original_name)
@@ -1,3 +1,102 @@
+import os
+import shutil
+import sys
+import tempfile
+from io import BytesIO
+from unittest import mock
+
+from PIL import Image as Img
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from scouts.models import Scout, ScoutTask, ScoutTaskCategory
+from scouts.sub_tasks.models import PropertyOnBoardingHousePhoto, PropertyOnBoardingPhoto, \
+    upload_property_on_boarding_photos
+from scouts.sub_tasks.utils import PROPERTY_ON_BOARDING_PHOTO_MAX_SIDE
+from scouts.utils import PROPERTY_ONBOARDING, ASSIGNED
+from utility.image_utils import downscale_image, run_in_native_thread
+from utility.render_response_utils import STATUS, SUCCESS, ERROR
+
+
+class PropertyOnBoardingPhotosBulkUploadTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.storage = FileSystemStorage(location=self.media_root, base_url='/media/')
+        patcher = mock.patch.object(PropertyOnBoardingPhoto._meta.get_field('image'), 'storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        user = User.objects.create(username='scout')
+        scout = Scout.objects.create(user=user, phone_no='9000000000')
+        category = ScoutTaskCategory.objects.create(name=PROPERTY_ONBOARDING)
+        self.task = ScoutTask.objects.create(category=category, scout=scout, status=ASSIGNED)
+        PropertyOnBoardingHousePhoto.objects.get_or_create(task=self.task)
+        # the upload threads must not query the database, so the task is selected along as the view does
+        self.sub_task = PropertyOnBoardingHousePhoto.objects.select_related('task').get(task=self.task)
+        self.url = '/scouts/tasks/{}/subtask/property_onboard/house_photos/bulk/'.format(self.task.id)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+
+    @staticmethod
+    def create_photo(name, size=(2400, 1800)):
+        photo = BytesIO()
+        Img.new('RGB', size, (200, 120, 40)).save(photo, format='JPEG')
+        return SimpleUploadedFile(name, photo.getvalue(), content_type='image/jpeg')
+
+    def test_photos_are_uploaded_together_and_reported_in_order(self):
+        images = [self.create_photo('front.png'), SimpleUploadedFile('broken.jpg', b'not an image'),
+                  self.create_photo('kitchen.jpg', size=(800, 600))]
+        response = self.client.post(self.url, {'images': images}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+
+        results = response.json()['data']
+        self.assertEqual([(result['name'], result[STATUS]) for result in results],
+                         [('front.png', SUCCESS), ('broken.jpg', ERROR), ('kitchen.jpg', SUCCESS)])
+        photos = PropertyOnBoardingPhoto.objects.filter(property_on_boarding_house_photo_sub_task=self.sub_task)
+        self.assertEqual(sorted(photo.image.url for photo in photos), sorted([results[0]['image'],
+                                                                              results[2]['image']]))
+        sizes = {}
+        for photo in photos:
+            with self.storage.open(photo.image.name) as image:
+                sizes[photo.image.name.rsplit('-', 1)[-1]] = Img.open(image).size
+        self.assertEqual(sizes, {'front.jpg': (PROPERTY_ON_BOARDING_PHOTO_MAX_SIDE, 1440), 'kitchen.jpg': (800, 600)})
+
+    def test_requests_without_images_or_with_too_many_are_rejected(self):
+        self.assertEqual(self.client.post(self.url, {}, format='multipart').status_code, 400)
+        with mock.patch('scouts.sub_tasks.api.views.PROPERTY_ON_BOARDING_PHOTOS_UPLOAD_LIMIT', 1):
+            response = self.client.post(self.url, {'images': [self.create_photo('1.jpg'), self.create_photo('2.jpg')]},
+                                        format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PropertyOnBoardingPhoto.objects.exists())
+
+    def test_uploaded_files_are_deleted_when_the_insert_fails(self):
+        images = [self.create_photo('front.jpg', size=(100, 100)), self.create_photo('back.jpg', size=(100, 100))]
+        with mock.patch.object(self.storage, 'save', wraps=self.storage.save) as save, \
+                mock.patch.object(PropertyOnBoardingPhoto.objects, 'bulk_create', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                upload_property_on_boarding_photos(self.sub_task, images)
+
+        self.assertEqual(save.call_count, 2)
+
+        self.assertFalse(PropertyOnBoardingPhoto.objects.exists())
+        self.assertFalse([files for _, _, files in os.walk(self.media_root) if files])
+
+    def test_images_are_compressed_in_native_threads_under_eventlet(self):
+        eventlet = mock.Mock()
+        eventlet.tpool.execute.side_effect = lambda func, *args, **kwargs: func(*args, **kwargs)
+
+        eventlet.patcher.is_monkey_patched.return_value = False
+        with mock.patch.dict(sys.modules, {'eventlet': eventlet}):
+            self.assertEqual(run_in_native_thread(max, 1, 2), 2)
+        eventlet.tpool.execute.assert_not_called()
 
-# Create your tests here.
+        eventlet.patcher.is_monkey_patched.return_value = True
+        with mock.patch.dict(sys.modules, {'eventlet': eventlet}):
+            results = upload_property_on_boarding_photos(self.sub_task, [self.create_photo('front.jpg', (100, 100))])
+        self.assertEqual(results[0][STATUS], SUCCESS)
+        self.assertEqual(eventlet.tpool.execute.call_args[0][0], downscale_image)
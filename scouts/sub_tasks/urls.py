@@ -11,6 +11,7 @@ urlpatterns = (
     # PropertyOnBoarding Sub Tasks
     url(r'^property_onboard/house_address/$', views.PropertyOnBoardHouseAddressCreateView.as_view()),
     url(r'^property_onboard/house_photos/$', views.PropertyOnBoardHousePhotosUploadView.as_view()),
+    url(r'^property_onboard/house_photos/bulk/$', views.PropertyOnBoardHousePhotosBulkUploadView.as_view()),
     url(r'^property_onboard/house_amenities/$', views.PropertyOnBoardHouseAmenitiesUpdateView.as_view()),
     url(r'^property_onboard/house_basic_details/$', views.PropertyOnBoardHouseBasicDetailsCreateView.as_view()),
     url(r'^property_onboard/self_task/$', views.create_property_on_boarding_scout_task_by_scout_himself),
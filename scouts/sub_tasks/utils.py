@@ -14,6 +14,12 @@ MOVE_OUT_AMENITIES_CHECKUP_DEFAULT_JSON = AMENITY_DEFAULT_JSON
 
 PROPERTY_ON_BOARD_AMENITIES_DEFAULT_JSON = AMENITY_DEFAULT_JSON
 
+# bulk upload of property on boarding house photos
+PROPERTY_ON_BOARDING_PHOTOS_UPLOAD_LIMIT = 50  # photos per request
+PROPERTY_ON_BOARDING_PHOTOS_UPLOAD_WORKERS = 8  # threads compressing and uploading the photos of a request
+PROPERTY_ON_BOARDING_PHOTO_MAX_SIDE = 1920
+PROPERTY_ON_BOARDING_PHOTO_QUALITY = 85
+
 # Sample Data for AMENITIES_CHECKUP_JSON
 """
 {
@@ -1,5 +1,3 @@
-import json
-
 from celery import shared_task
 from celery.utils.log import get_task_logger
 
@@ -10,20 +8,44 @@ logger = get_task_logger(__name__)
 def send_scout_notification(scout_id, title, content, category, payload):
     logger.info("Sending notification to scout id {}".format(scout_id))
 
-    from scouts.models import Scout
-    scout = Scout.objects.get(id=scout_id)
-
-    try:
-        from scouts.utils import notify_scout
-        notify_scout(registration_id=scout.gcm_id,
-                     data_message={'data': json.dumps({'title': title, 'content': content,
-                                                       'category': category, 'payload': payload})})
-    except Exception as e:
-        logger.error(e)
+    from scouts.utils import push_scout_notifications
+    push_scout_notifications([{'scout_id': scout_id, 'title': title, 'content': content, 'category': category,
+                               'payload': payload}])
 
     logger.info("Sent notification to scout id {}".format(scout_id))
 
 
+@shared_task
+def send_scout_notifications(notifications):
+    """
+    :param notifications: list of dicts with scout_id, title, content, category and payload of each notification
+    """
+    from scouts.utils import push_scout_notifications
+    sent_count, invalid_count = push_scout_notifications(notifications)
+
+    logger.info("Sent {} of {} notifications to scouts, cleared {} invalid gcm ids".format(
+        sent_count, len(notifications), invalid_count))
+
+
+@shared_task
+def dispatch_scout_push_notifications():
+    """ Sends the pushes queued since the last run, see scouts.utils.queue_scout_notifications """
+    from scouts.utils import get_queued_scout_notifications_count, pop_queued_scout_notifications, \
+        push_scout_notifications, SCOUT_PUSH_BATCH_SIZE
+
+    # pushes queued again after failing, or queued meanwhile, are left for the next run
+    remaining_count = get_queued_scout_notifications_count()
+    while remaining_count > 0:
+        notifications = pop_queued_scout_notifications(min(remaining_count, SCOUT_PUSH_BATCH_SIZE))
+        if not notifications:
+            break
+        remaining_count -= len(notifications)
+
+        sent_count, invalid_count = push_scout_notifications(notifications)
+        logger.info("Sent {} of {} queued notifications to scouts, cleared {} invalid gcm ids".format(
+            sent_count, len(notifications), invalid_count))
+
+
 @shared_task
 def scout_assignment_request_set_rejected(instance_id):
     try:
@@ -41,4 +63,99 @@ def scout_assignment_request_set_rejected(instance_id):
                 # sentry_debug_logger.debug("rejected after two minutes" + str(instance_id), exc_info=True)
 
     except Exception as E:
-        sentry_debug_logger.error("execption occured is " + str(E), exc_info=True)
\ No newline at end of file
+        sentry_debug_logger.error("execption occured is " + str(E), exc_info=True)
+
+
+@shared_task
+def assign_pending_scout_tasks():
+    from django.db.models import Q
+    from django.utils import timezone
+    from scouts.models import ScoutTask, create_scout_task_assignment_requests
+    from redis.exceptions import LockError
+    from scouts.utils import UNASSIGNED, BATCH_SCOUT_ASSIGNMENT_LOCK_KEY, BATCH_SCOUT_ASSIGNMENT_LOCK_TIMEOUT, \
+        get_batch_scout_assignments, is_batch_scout_assignment_enabled
+    from utility.redis_utils import get_redis_connection
+
+    if not is_batch_scout_assignment_enabled():
+        return
+
+    lock = get_redis_connection().lock(BATCH_SCOUT_ASSIGNMENT_LOCK_KEY, timeout=BATCH_SCOUT_ASSIGNMENT_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        # the tasks left by the run holding the lock are picked up by the next run
+        logger.info("Skipped batch scout assignment as another run is in progress")
+        return
+
+    try:
+        pending_tasks = ScoutTask.objects.select_related('category').filter(
+            Q(scheduled_at__isnull=True) | Q(scheduled_at__gte=timezone.now()),
+            status=UNASSIGNED, assignment_requests__isnull=True)
+
+        assignment_requests = create_scout_task_assignment_requests(get_batch_scout_assignments(pending_tasks))
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            # expired while assigning
+            pass
+    logger.info("Created {} scout task assignment requests in batch".format(len(assignment_requests)))
+
+
+@shared_task
+def rebuild_scout_availability_index():
+    from scouts.utils import rebuild_scout_availability_index as rebuild_index
+    rebuild_index()
+    logger.info("Rebuilt scout availability index")
+
+
+@shared_task
+def reject_expired_scout_assignment_requests():
+    from scouts.models import auto_reject_scout_task_assignment_requests
+    from scouts.utils import pop_expired_assignment_requests, schedule_assignment_request_expiry
+
+    expired_request_ids = pop_expired_assignment_requests()
+    if not expired_request_ids:
+        return
+
+    try:
+        rejected_requests = auto_reject_scout_task_assignment_requests(expired_request_ids)
+    except Exception:
+        # put the requests back so that the next sweep retries them
+        from django.utils import timezone
+        for request_id in expired_request_ids:
+            schedule_assignment_request_expiry(request_id, timezone.now())
+        raise
+
+    logger.info("Auto rejected {} scout task assignment requests".format(len(rejected_requests)))
+
+
+@shared_task
+def reconcile_scout_wallets():
+    from utility.logging_utils import sentry_debug_logger
+    from scouts.models import reconcile_scout_wallets as reconcile_wallets
+
+    drifts = reconcile_wallets()
+    for wallet_id, drift in drifts.items():
+        sentry_debug_logger.error("scout wallet {} drifted from its payments: {}".format(wallet_id, drift))
+
+    logger.info("Reconciled scout wallets, {} wallets had drifted".format(len(drifts)))
+
+
+@shared_task
+def process_scout_picture(picture_id):
+    from scouts.models import process_scout_picture_image
+    process_scout_picture_image(picture_id)
+    logger.info("Processed image of scout picture id {}".format(picture_id))
+
+
+@shared_task
+def process_scout_document(document_id):
+    from scouts.models import process_scout_document_image
+    process_scout_document_image(document_id)
+    logger.info("Processed image of scout document id {}".format(document_id))
+
+
+@shared_task
+def process_property_on_boarding_photo(photo_id):
+    from scouts.sub_tasks.models import process_property_on_boarding_photo_image
+    process_property_on_boarding_photo_image(photo_id)
+    logger.info("Processed property on boarding photo id {}".format(photo_id))
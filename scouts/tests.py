@@ -1,3 +1,806 @@
-from django.test import TestCase
+import json
+import posixpath
+import shutil
+from importlib import import_module
+from itertools import permutations
+import tempfile
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from PIL import Image as Img, features
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections, transaction, OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from Homes.Houses.models import House, HouseAddressDetail, HouseVisit
+from Homes.cache import HOMES_CACHES
+from UserBase.models import Customer
+from common.utils import IMAGE_PROCESSING_DONE, IMAGE_PROCESSING_PENDING, IMAGE_PROCESSING_FAILED, PAID, PENDING, \
+    DEPOSIT, WITHDRAWAL
+from scouts.api.serializers import ScoutPictureSerializer
+from scouts.api.views import is_local_direct_upload_needed
+from scouts.models import Scout, ScoutTask, ScoutTaskCategory, ScoutPicture, ScoutDocument, ScheduledAvailability, \
+    ScoutWorkAddress, ScoutTaskAssignmentRequest, Flag, ScoutNotification, ScoutNotificationCategory, ScoutPayment, \
+    ScoutWallet, reconcile_scout_wallets
+from scouts.sub_tasks.models import PropertyOnBoardingDetail
+from scouts.tasks import process_scout_picture, process_scout_document, assign_pending_scout_tasks, \
+    dispatch_scout_push_notifications, reject_expired_scout_assignment_requests
+from scouts.utils import get_appropriate_scout_for_the_task, get_push_service, push_scout_notifications, \
+    get_scout_ids_available_at, get_batch_scout_assignments, rebuild_scout_availability_index, \
+    get_sorted_scouts_nearby, AvailabilityIndexNotBuilt, PROPERTY_ONBOARDING, HOUSE_VISIT, UNASSIGNED, ASSIGNED, \
+    BATCH_SCOUT_ASSIGNMENT_FLAG, BATCH_SCOUT_ASSIGNMENT_LOCK_KEY, NEW_PAYMENT_RECEIVED, SCOUT_PUSH_QUEUE_KEY, \
+    SCOUT_PUSH_MAX_ATTEMPTS, SCOUT_ASSIGNMENT_REQUEST_EXPIRY_KEY, REQUEST_AWAITED, REQUEST_ACCEPTED, REQUEST_REJECTED, \
+    pop_queued_scout_notifications
+from utility.assignment_utils import solve_min_cost_assignment
+from utility.image_utils import open_image, compress_image, get_compressed_image_size
+from utility.redis_test_utils import FakeRedisMixin
+from utility.upload_utils import create_presigned_upload, is_s3_storage
+
+
+class NearbyScoutsTestCase(TestCase):
+    latitude, longitude = 28.50, 77.20
+
+    def setUp(self):
+        # scouts due north of the point at these distances (in km), and one without a work address location
+        self.distances = (0.5, 1, 3, 7, 20, 45, 60)
+        self.scouts = []
+        for i, distance in enumerate(self.distances + (None,)):
+            scout = Scout.objects.create(user=User.objects.create(username='scout{}'.format(i)),
+                                         phone_no='9{:09d}'.format(i))
+            # new work addresses are given a random location otherwise
+            scout.work_address.latitude = None if distance is None else self.latitude + distance / 111.195
+            scout.work_address.longitude = None if distance is None else self.longitude
+            scout.work_address.save()
+            self.scouts.append(scout)
+
+    def nearby(self, limit=None):
+        return [scout for scout, _ in get_sorted_scouts_nearby(self.latitude, self.longitude, limit=limit)]
+
+    def test_nearest_scouts_are_found_in_the_cells_around_the_point(self):
+        with self.assertNumQueries(2):
+            self.assertEqual(self.nearby(limit=2), self.scouts[:2])
+        # the search radius is doubled until the fourth nearest scout lies within it
+        with self.assertNumQueries(4):
+            self.assertEqual(self.nearby(limit=4), self.scouts[:4])
+        self.assertEqual(self.nearby(limit=10), self.scouts[:6])
+        self.assertEqual(self.nearby(), self.scouts[:6])
+
+    def test_migration_backfills_geohashes_written_without_save(self):
+        ScoutWorkAddress.objects.update(geohash=None)
+        self.assertEqual(self.nearby(limit=2), [])
+
+        migration = import_module('scouts.migrations.0034_backfill_scoutworkaddress_geohash')
+        migration.backfill_work_address_geohash(apps, None)
+        self.assertEqual(self.nearby(limit=2), self.scouts[:2])
+        self.assertEqual(ScoutWorkAddress.objects.filter(geohash__isnull=True).get().scout, self.scouts[-1])
+
+
+class AppropriateScoutForTaskTestCase(TestCase):
+    def setUp(self):
+        self.category = ScoutTaskCategory.objects.create(name=PROPERTY_ONBOARDING)
+        property_details = PropertyOnBoardingDetail.objects.create(latitude=28.50, longitude=77.20)
+        with mock.patch('scouts.models.manage_scout_sub_tasks_for_new_task'):
+            self.task = ScoutTask.objects.create(category=self.category, status=UNASSIGNED,
+                                                 onboarding_property_details_id=property_details.id)
+
+    def create_scouts(self, count):
+        for i in range(Scout.objects.count(), Scout.objects.count() + count):
+            user = User.objects.create(username='scout{}'.format(i))
+            scout = Scout.objects.create(user=user, phone_no='9{:09d}'.format(i), active=True)
+            scout.work_address.latitude = 28.50 + i * 0.001
+            scout.work_address.longitude = 77.20
+            scout.work_address.save()
+
+    def test_query_count_does_not_depend_on_number_of_scouts(self):
+        for count in (3, 30):
+            self.create_scouts(count)
+            task = ScoutTask.objects.select_related('category').get(id=self.task.id)
+            with self.assertNumQueries(3):
+                scout = get_appropriate_scout_for_the_task(task, scouts=Scout.objects.filter(active=True))
+            self.assertEqual(scout, Scout.objects.order_by('id').first())
+            self.assertEqual(scout.work_address.latitude, 28.50)
+
+
+class MinCostAssignmentTestCase(TestCase):
+    @staticmethod
+    def get_min_cost(cost):
+        rows, columns = cost.shape
+        if rows > columns:
+            return MinCostAssignmentTestCase.get_min_cost(cost.T)
+        return min(sum(cost[row, column] for row, column in enumerate(matched_columns))
+                   for matched_columns in permutations(range(columns), rows))
+
+    def test_greedy_choice_is_not_kept(self):
+        self.assertEqual(solve_min_cost_assignment([[1, 2], [1, 100]]), [(0, 1), (1, 0)])
+
+    def test_assignment_has_the_minimum_cost(self):
+        random_state = np.random.RandomState(0)
+        for shape in ((3, 3), (4, 3), (3, 5), (5, 5)):
+            for _ in range(10):
+                cost = random_state.randint(0, 20, size=shape).astype(float)
+                pairs = solve_min_cost_assignment(cost)
+                self.assertEqual(len(pairs), min(shape))
+                self.assertEqual(len({row for row, _ in pairs}), len({column for _, column in pairs}))
+                self.assertEqual(sum(cost[row, column] for row, column in pairs), self.get_min_cost(cost))
+
+
+class BatchScoutAssignmentTestCase(FakeRedisMixin, TestCase):
+    latitude, longitude = 28.50, 77.20
+
+    def setUp(self):
+        super(BatchScoutAssignmentTestCase, self).setUp()
+        self.category = ScoutTaskCategory.objects.create(name=PROPERTY_ONBOARDING)
+
+    def create_scout(self, distance):
+        """ creates an active scout due north of the point at the distance (in km) """
+        count = Scout.objects.count()
+        scout = Scout.objects.create(user=User.objects.create(username='scout{}'.format(count)),
+                                     phone_no='9{:09d}'.format(count), active=True)
+        scout.work_address.latitude = self.latitude + distance / 111.195
+        scout.work_address.longitude = self.longitude
+        scout.work_address.save()
+        return scout
+
+    def create_task(self, distance, **kwargs):
+        kwargs.setdefault('status', UNASSIGNED)
+        property_details = PropertyOnBoardingDetail.objects.create(latitude=self.latitude + distance / 111.195,
+                                                                   longitude=self.longitude)
+        with mock.patch('scouts.models.manage_scout_sub_tasks_for_new_task'):
+            return ScoutTask.objects.create(category=self.category, onboarding_property_details_id=property_details.id,
+                                            **kwargs)
+
+    def get_assignments(self, tasks):
+        return get_batch_scout_assignments(ScoutTask.objects.select_related('category').filter(
+            id__in=[task.id for task in tasks]))
+
+    def test_total_distance_is_minimum_when_there_are_more_tasks_than_scouts(self):
+        scouts = [self.create_scout(0), self.create_scout(10)]
+        tasks = [self.create_task(9), self.create_task(1), self.create_task(30)]
+        # the farthest task is left unassigned for the next batch
+        self.assertEqual(self.get_assignments(tasks), [(tasks[0], scouts[1]), (tasks[1], scouts[0])])
+
+    def test_tasks_already_handled_by_a_scout_add_to_their_cost(self):
+        near_scout, far_scout = self.create_scout(1), self.create_scout(4)
+        task = self.create_task(0)
+        self.assertEqual(self.get_assignments([task]), [(task, near_scout)])
+
+        # 1 km plus the penalty of one task is more than 4 km
+        self.create_task(0, scout=near_scout, status=ASSIGNED)
+        self.assertEqual(self.get_assignments([task]), [(task, far_scout)])
+
+    def test_runs_are_skipped_while_another_run_holds_the_lock(self):
+        Flag.objects.create(name=BATCH_SCOUT_ASSIGNMENT_FLAG, enabled=True)
+        scout = self.create_scout(1)
+        task = self.create_task(0)
+
+        lock = self.redis.lock(BATCH_SCOUT_ASSIGNMENT_LOCK_KEY)
+        lock.acquire()
+        assign_pending_scout_tasks()
+        self.assertFalse(ScoutTaskAssignmentRequest.objects.exists())
+
+        lock.release()
+        assign_pending_scout_tasks()
+        self.assertEqual(list(ScoutTaskAssignmentRequest.objects.values_list('task', 'scout')), [(task.id, scout.id)])
+        self.assertFalse(self.redis.exists(BATCH_SCOUT_ASSIGNMENT_LOCK_KEY))
+
+
+class AssignmentRequestExpiryTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super(AssignmentRequestExpiryTestCase, self).setUp()
+        category = ScoutTaskCategory.objects.create(name=PROPERTY_ONBOARDING, assignment_request_timeout=30)
+        # get_appropriate_scout_for_the_task turns auto rejected requests back into awaited when one scout is left
+        self.scouts = []
+        for i in range(3):
+            scout = Scout.objects.create(user=User.objects.create(username='scout{}'.format(i)),
+                                         phone_no='9{:09d}'.format(i), active=True)
+            scout.work_address.latitude, scout.work_address.longitude = 28.50 + i * 0.01, 77.20
+            scout.work_address.save()
+            self.scouts.append(scout)
+        property_details = PropertyOnBoardingDetail.objects.create(latitude=28.50, longitude=77.20)
+        with mock.patch('scouts.models.manage_scout_sub_tasks_for_new_task'):
+            self.task = ScoutTask.objects.create(category=category, status=UNASSIGNED,
+                                                 onboarding_property_details_id=property_details.id)
+
+    def sweep_at(self, seconds_from_now):
+        now = timezone.now() + timedelta(seconds=seconds_from_now)
+        with mock.patch('scouts.utils.timezone.now', return_value=now):
+            reject_expired_scout_assignment_requests()
+
+    def test_requests_are_rejected_and_passed_on_after_the_category_timeout(self):
+        assignment_request = ScoutTaskAssignmentRequest.objects.create(task=self.task, scout=self.scouts[0])
+        deadline = self.redis.zscore(SCOUT_ASSIGNMENT_REQUEST_EXPIRY_KEY, assignment_request.id)
+        self.assertAlmostEqual(deadline, timezone.now().timestamp() + 30, delta=5)
+
+        self.sweep_at(20)
+        assignment_request.refresh_from_db()
+        self.assertEqual(assignment_request.status, REQUEST_AWAITED)
+
+        self.sweep_at(40)
+        assignment_request.refresh_from_db()
+        self.assertEqual((assignment_request.status, assignment_request.auto_rejected), (REQUEST_REJECTED, True))
+        self.assertIsNotNone(assignment_request.responded_at)
+        next_request = ScoutTaskAssignmentRequest.objects.get(status=REQUEST_AWAITED)
+        self.assertEqual((next_request.task, next_request.scout), (self.task, self.scouts[1]))
+        self.assertEqual(self.redis.zrange(SCOUT_ASSIGNMENT_REQUEST_EXPIRY_KEY, 0, -1),
+                         [str(next_request.id).encode()])
+
+    def test_answered_requests_are_not_rejected(self):
+        assignment_request = ScoutTaskAssignmentRequest.objects.create(task=self.task, scout=self.scouts[0])
+        ScoutTaskAssignmentRequest.objects.filter(id=assignment_request.id).update(status=REQUEST_ACCEPTED)
+
+        self.sweep_at(40)
+        assignment_request.refresh_from_db()
+        self.assertEqual((assignment_request.status, assignment_request.auto_rejected), (REQUEST_ACCEPTED, False))
+        self.assertEqual(ScoutTaskAssignmentRequest.objects.count(), 1)
+        self.assertEqual(self.redis.zcard(SCOUT_ASSIGNMENT_REQUEST_EXPIRY_KEY), 0)
+
+    def test_requests_are_put_back_when_rejecting_fails(self):
+        assignment_request = ScoutTaskAssignmentRequest.objects.create(task=self.task, scout=self.scouts[0])
+        with mock.patch('scouts.models.auto_reject_scout_task_assignment_requests', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                self.sweep_at(40)
+        self.assertEqual(self.redis.zrange(SCOUT_ASSIGNMENT_REQUEST_EXPIRY_KEY, 0, -1),
+                         [str(assignment_request.id).encode()])
+
+    def test_an_eta_task_rejects_requests_when_redis_is_unreachable(self):
+        with mock.patch('scouts.models.schedule_assignment_request_expiry', side_effect=ConnectionError), \
+                mock.patch('scouts.models.scout_assignment_request_set_rejected.apply_async') as apply_async:
+            assignment_request = ScoutTaskAssignmentRequest.objects.create(task=self.task, scout=self.scouts[0])
+        self.assertEqual(apply_async.call_args[0][0], [assignment_request.id])
+        self.assertAlmostEqual(apply_async.call_args[1]['eta'], timezone.now() + timedelta(seconds=30),
+                               delta=timedelta(seconds=5))
+
+
+class HomesObjectsResolverTestCase(FakeRedisMixin, TestCase):
+    databases = {'default', 'homes'}
+
+    def setUp(self):
+        super(HomesObjectsResolverTestCase, self).setUp()
+        for cache in HOMES_CACHES.values():
+            cache.clear()
+        self.scout = Scout.objects.create(user=User.objects.create(username='scout'), phone_no='9999999990')
+        self.category = ScoutTaskCategory.objects.create(name=HOUSE_VISIT)
+        self.client = APIClient()
+        self.client.force_authenticate(self.scout.user)
+
+    def create_house_visit_tasks(self, count):
+        for i in range(ScoutTask.objects.count(), ScoutTask.objects.count() + count):
+            customer = Customer.objects.using('homes').create(
+                user=User.objects.using('homes').create(username='customer{}'.format(i)), phone_no='8{:09d}'.format(i))
+            house = House.objects.using('homes').create(name='house {}'.format(i))
+            HouseAddressDetail.objects.using('homes').create(house=house)
+            visit = HouseVisit.objects.using('homes').create(house=house, customer=customer)
+            with mock.patch('scouts.models.manage_scout_sub_tasks_for_new_task'), \
+                    mock.patch('scouts.models.manage_scout_task_conversation'):
+                ScoutTask.objects.create(category=self.category, scout=self.scout, status=ASSIGNED, house_id=house.id,
+                                         visit_id=visit.id)
+
+    def get_task_list_queries(self):
+        with CaptureQueriesContext(connections['default']) as queries, \
+                CaptureQueriesContext(connections['homes']) as homes_queries:
+            response = self.client.get('/scouts/tasks/')
+        self.assertEqual(response.status_code, 200)
+        return response.data, len(queries), len(homes_queries)
+
+    def test_task_pages_cost_a_constant_number_of_queries(self):
+        self.create_house_visit_tasks(2)
+        _, query_count, homes_query_count = self.get_task_list_queries()
+
+        self.create_house_visit_tasks(10)
+        tasks, *query_counts = self.get_task_list_queries()
+        self.assertEqual(query_counts, [query_count, homes_query_count])
+
+        visits = HouseVisit.objects.using('homes').select_related('house', 'customer').in_bulk(
+            ScoutTask.objects.values_list('visit_id', flat=True))
+        self.assertEqual(len(tasks), 12)
+        for task in tasks:
+            visit = visits[ScoutTask.objects.get(id=task['id']).visit_id]
+            self.assertEqual((task['house']['name'], task['customer']['id']), (visit.house.name, visit.customer.id))
+
+        # cached houses, visits and customers are not fetched again
+        _, _, homes_query_count = self.get_task_list_queries()
+        self.assertEqual(homes_query_count, 0)
+
+
+class ScoutWalletTestCase(TestCase):
+    def setUp(self):
+        super(ScoutWalletTestCase, self).setUp()
+        self.scout = Scout.objects.create(user=User.objects.create(username='scout'), phone_no='9999999990')
+
+    def get_wallet_totals(self, wallet=None):
+        wallet = ScoutWallet.objects.get(id=(wallet or self.scout.wallet).id)
+        return wallet.credit, wallet.debit, wallet.balance, wallet.pending_deposit, wallet.pending_withdrawal
+
+    def test_payments_update_the_wallet_by_their_difference(self):
+        deposit = ScoutPayment.objects.create(wallet=self.scout.wallet, amount=100, type=DEPOSIT, status=PENDING)
+        withdrawal = ScoutPayment.objects.create(wallet=self.scout.wallet, amount=40.5, type=WITHDRAWAL,
+                                                 status=PENDING)
+        self.assertEqual(self.get_wallet_totals(), (0, 0, 0, 100, 40.5))
+
+        deposit.status = PAID
+        deposit.save()
+        self.assertEqual(deposit.wallet.credit, 100)
+
+        withdrawal.status, withdrawal.amount = PAID, 40.25
+        withdrawal.save()
+        self.assertEqual(self.get_wallet_totals(), (100, 40.25, 59.75, 0, 0))
+
+        other_scout = Scout.objects.create(user=User.objects.create(username='other_scout'), phone_no='9999999991')
+        deposit.wallet = other_scout.wallet
+        deposit.save()
+        self.assertEqual(self.get_wallet_totals(), (0, 40.25, -40.25, 0, 0))
+        self.assertEqual(self.get_wallet_totals(other_scout.wallet), (100, 0, 100, 0, 0))
+        self.assertEqual(reconcile_scout_wallets(), {})
+
+    def test_drifted_wallets_are_reconciled_from_the_payments(self):
+        ScoutPayment.objects.create(wallet=self.scout.wallet, amount=100, type=DEPOSIT, status=PAID)
+        ScoutPayment.objects.create(wallet=self.scout.wallet, amount=30, type=WITHDRAWAL, status=PENDING)
+        ScoutWallet.objects.filter(id=self.scout.wallet.id).update(credit=5, pending_withdrawal=30.001)
+
+        self.assertEqual(reconcile_scout_wallets(), {self.scout.wallet.id: {'credit': (5, 100)}})
+        self.assertEqual(self.get_wallet_totals(), (100, 0, 100, 0, 30))
+        self.assertEqual(reconcile_scout_wallets(), {})
+
+
+class ScoutPaymentSettleTestCase(FakeRedisMixin, TransactionTestCase):
+    def setUp(self):
+        super(ScoutPaymentSettleTestCase, self).setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.scouts = [Scout.objects.create(user=User.objects.create(username='scout{}'.format(i)),
+                                            phone_no='9{:09d}'.format(i)) for i in range(2)]
+
+    def settle(self, payment_ids):
+        return self.client.post('/scouts/payments/settle/', {'payment_ids': payment_ids}, format='json')
+
+    def test_pending_payments_are_settled_together(self):
+        payments = [ScoutPayment.objects.create(wallet=scout.wallet, amount=10, type=payment_type)
+                    for scout in self.scouts for payment_type in (DEPOSIT, WITHDRAWAL)]
+        paid_payment = ScoutPayment.objects.create(wallet=self.scouts[0].wallet, amount=5, type=WITHDRAWAL, status=PAID)
+        ScoutNotification.objects.all().delete()
+        self.redis.delete(SCOUT_PUSH_QUEUE_KEY)
+
+        response = self.settle([payment.id for payment in payments[1:]] + [paid_payment.id])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.data['settled']), [payment.id for payment in payments[1:]])
+
+        self.assertEqual(ScoutPayment.objects.get(id=payments[0].id).status, PENDING)
+        self.assertEqual(ScoutWallet.objects.filter(scout=self.scouts[0]).values_list(
+            'credit', 'debit', 'pending_deposit', 'pending_withdrawal').get(), (0, 15, 10, 0))
+        self.assertEqual(ScoutWallet.objects.filter(scout=self.scouts[1]).values_list(
+            'credit', 'debit', 'pending_deposit', 'pending_withdrawal').get(), (10, 10, 0, 0))
+        self.assertEqual(reconcile_scout_wallets(), {})
+
+        # only withdrawals are notified, once committed
+        self.assertEqual(sorted(ScoutNotification.objects.values_list('scout', flat=True)),
+                         [scout.id for scout in self.scouts])
+        self.assertEqual(self.redis.llen(SCOUT_PUSH_QUEUE_KEY), 2)
+
+    def test_payment_ids_are_validated(self):
+        for payment_ids in (None, 'all', [1, '2'], [True]):
+            self.assertEqual(self.settle(payment_ids).status_code, 400)
+
+        self.client.force_authenticate(self.scouts[0].user)
+        self.assertEqual(self.settle([]).status_code, 403)
+
+
+class ScoutAvailabilityIndexTestCase(FakeRedisMixin, TransactionTestCase):
+    def setUp(self):
+        super(ScoutAvailabilityIndexTestCase, self).setUp()
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+        self.scouts = [Scout.objects.create(user=User.objects.create(username='scout{}'.format(i)),
+                                            phone_no='9{:09d}'.format(i), active=True) for i in range(2)]
+
+    def at(self, minutes):
+        return self.start + timedelta(minutes=minutes)
+
+    def test_windows_are_checked_exactly_without_queries(self):
+        ScheduledAvailability.objects.create(scout=self.scouts[0], start_time=self.at(0), end_time=self.at(65))
+        ScheduledAvailability.objects.create(scout=self.scouts[1], start_time=self.at(20), end_time=self.at(40))
+        with self.assertRaises(AvailabilityIndexNotBuilt):
+            get_scout_ids_available_at(self.at(0))
+
+        rebuild_scout_availability_index()
+        first, second = self.scouts[0].id, self.scouts[1].id
+        with self.assertNumQueries(0):
+            self.assertEqual(get_scout_ids_available_at(self.at(25)), {first, second})
+            # same slots as the windows, outside of them
+            self.assertEqual(get_scout_ids_available_at(self.at(19)), {first})
+            self.assertEqual(get_scout_ids_available_at(self.at(41)), {first})
+            self.assertEqual(get_scout_ids_available_at(self.at(65)), {first})
+            self.assertEqual(get_scout_ids_available_at(self.at(66)), set())
+
+    def test_saves_and_deletes_update_the_index(self):
+        rebuild_scout_availability_index()
+        availability = ScheduledAvailability.objects.create(scout=self.scouts[0], start_time=self.at(0),
+                                                            end_time=self.at(60))
+        self.assertEqual(get_scout_ids_available_at(self.at(30)), {self.scouts[0].id})
+
+        availability.start_time, availability.end_time = self.at(120), self.at(180)
+        with self.assertNumQueries(1):
+            availability.save()
+        self.assertEqual(get_scout_ids_available_at(self.at(30)), set())
+        self.assertEqual(get_scout_ids_available_at(self.at(150)), {self.scouts[0].id})
+
+        availability.scout = self.scouts[1]
+        availability.save()
+        self.assertEqual(get_scout_ids_available_at(self.at(150)), {self.scouts[1].id})
+
+        availability.cancelled = True
+        availability.save()
+        self.assertEqual(get_scout_ids_available_at(self.at(150)), set())
+
+        availability.cancelled = False
+        availability.save()
+        availability.delete()
+        self.assertEqual(get_scout_ids_available_at(self.at(150)), set())
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            ScheduledAvailability.objects.create(scout=self.scouts[0], start_time=self.at(0), end_time=self.at(60))
+            raise ValueError
+        self.assertEqual(get_scout_ids_available_at(self.at(30)), set())
+
+    def test_batch_assignment_uses_the_index(self):
+        category = ScoutTaskCategory.objects.create(name=PROPERTY_ONBOARDING)
+        property_details = PropertyOnBoardingDetail.objects.create(latitude=28.50, longitude=77.20,
+                                                                   scheduled_at=self.at(30))
+        with mock.patch('scouts.models.manage_scout_sub_tasks_for_new_task'):
+            task = ScoutTask.objects.create(category=category, status=UNASSIGNED, scheduled_at=self.at(30),
+                                            onboarding_property_details_id=property_details.id)
+        for scout in self.scouts:
+            scout.work_address.latitude, scout.work_address.longitude = 28.50, 77.20
+            scout.work_address.save()
+        ScheduledAvailability.objects.create(scout=self.scouts[1], start_time=self.at(0), end_time=self.at(60))
+
+        rebuild_scout_availability_index()
+        with mock.patch('scouts.utils.get_available_scout_ids_from_database') as get_from_database:
+            assignments = get_batch_scout_assignments(ScoutTask.objects.select_related('category'))
+        self.assertFalse(get_from_database.called)
+        self.assertEqual(assignments, [(task, self.scouts[1])])
+
+        self.redis.flushall()
+        assignments = get_batch_scout_assignments(ScoutTask.objects.select_related('category'))
+        self.assertEqual(assignments, [(task, self.scouts[1])])
+
+
+class StubFCMRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers like fcm, registration ids starting with 'invalid' are reported as not registered and those starting
+    with 'unavailable' as temporarily failed. Messages with the content 'Down' fail altogether.
+    """
+    requests = []
+    errors = {'invalid': 'NotRegistered', 'unavailable': 'Unavailable'}
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        self.requests.append(payload)
+        if json.loads(payload['data']['data'])['content'] == 'Down':
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        registration_ids = payload.get('registration_ids') or [payload['to']]
+        results = [{'error': self.errors[registration_id.rstrip('0123456789')]}
+                   if registration_id.rstrip('0123456789') in self.errors else {'message_id': '1'}
+                   for registration_id in registration_ids]
+        body = json.dumps({'multicast_id': 1, 'success': sum('message_id' in result for result in results),
+                           'failure': sum('error' in result for result in results), 'canonical_ids': 0,
+                           'results': results}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class PushScoutNotificationsTestCase(FakeRedisMixin, TestCase):
+    def setUp(self):
+        super(PushScoutNotificationsTestCase, self).setUp()
+        self.server = HTTPServer(('127.0.0.1', 0), StubFCMRequestHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        StubFCMRequestHandler.requests = []
+        self.scouts = [Scout.objects.create(user=User.objects.create(username='scout{}'.format(i)),
+                                            phone_no='9{:09d}'.format(i), gcm_id=gcm_id)
+                       for i, gcm_id in enumerate(('device0', 'device1', 'invalid2'))]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_identical_pushes_are_multicast_and_invalid_gcm_ids_are_cleared(self):
+        notification = {'title': 'NewPaymentReceived', 'content': 'Paid', 'category': None, 'payload': {}}
+        notifications = [dict(notification, scout_id=scout.id) for scout in self.scouts]
+        notifications.append(dict(notification, scout_id=self.scouts[0].id, content='Paid again'))
+
+        with mock.patch.object(get_push_service(), 'FCM_END_POINT', 'http://127.0.0.1:{}/fcm/send'.format(
+                self.server.server_port)):
+            sent_count, invalid_count = push_scout_notifications(notifications)
+
+        self.assertEqual((sent_count, invalid_count), (3, 1))
+        self.assertEqual([payload.get('registration_ids') or [payload['to']]
+                          for payload in StubFCMRequestHandler.requests],
+                         [['device0', 'device1', 'invalid2'], ['device0']])
+        self.assertEqual(list(Scout.objects.order_by('id').values_list('gcm_id', flat=True)),
+                         ['device0', 'device1', None])
+        self.assertFalse(pop_queued_scout_notifications())
+
+    def test_failed_pushes_are_queued_again_until_the_attempts_run_out(self):
+        unavailable_scout = Scout.objects.create(user=User.objects.create(username='scout3'), phone_no='9000000003',
+                                                 gcm_id='unavailable3')
+        notification = {'title': 'NewPaymentReceived', 'category': None, 'payload': {}}
+        notifications = [dict(notification, scout_id=self.scouts[0].id, content='Down'),
+                         dict(notification, scout_id=self.scouts[1].id, content='Paid'),
+                         dict(notification, scout_id=unavailable_scout.id, content='Paid')]
+
+        with mock.patch.object(get_push_service(), 'FCM_END_POINT', 'http://127.0.0.1:{}/fcm/send'.format(
+                self.server.server_port)):
+            self.assertEqual(push_scout_notifications(notifications), (1, 0))
+            self.assertEqual(self.redis.llen(SCOUT_PUSH_QUEUE_KEY), 2)
+
+            # every run retries the failed pushes once
+            for attempts in range(1, SCOUT_PUSH_MAX_ATTEMPTS):
+                requests_count = len(StubFCMRequestHandler.requests)
+                dispatch_scout_push_notifications()
+                self.assertEqual(len(StubFCMRequestHandler.requests), requests_count + 2)
+            self.assertEqual(len(StubFCMRequestHandler.requests), 2 * SCOUT_PUSH_MAX_ATTEMPTS)
+        self.assertEqual(self.redis.llen(SCOUT_PUSH_QUEUE_KEY), 0)
+
+
+class ScoutNotificationTestCase(FakeRedisMixin, TransactionTestCase):
+    def setUp(self):
+        super(ScoutNotificationTestCase, self).setUp()
+        self.scout = Scout.objects.create(user=User.objects.create(username='scout'), phone_no='9000000000')
+        self.category = ScoutNotificationCategory.objects.create(name=NEW_PAYMENT_RECEIVED)
+
+    def test_push_is_queued_once_the_notification_is_committed(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            ScoutNotification.objects.create(scout=self.scout, category=self.category, content='Rolled back')
+            raise ValueError
+        self.assertEqual(pop_queued_scout_notifications(), [])
+
+        with transaction.atomic():
+            ScoutNotification.objects.create(scout=self.scout, category=self.category, content='Paid')
+            self.assertEqual(pop_queued_scout_notifications(), [])
+        self.assertEqual([(notification['scout_id'], notification['content'])
+                          for notification in pop_queued_scout_notifications()], [(self.scout.id, 'Paid')])
+
+
+class MediaStorageMixin:
+    """ stores the images of scout pictures and documents in a temporary directory standing in for the S3 bucket """
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.storage = FileSystemStorage(location=self.media_root, base_url='/media/')
+        for patcher in [mock.patch.object(model._meta.get_field(field), 'storage', self.storage)
+                        for model in (ScoutPicture, ScoutDocument) for field in ('image', 'thumbnail')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        user = User.objects.create(username='scout')
+        self.scout = Scout.objects.create(user=user, phone_no='9000000000')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+
+    @staticmethod
+    def create_photo(size=(1200, 900)):
+        photo = BytesIO()
+        Img.new('RGB', size, (200, 120, 40)).save(photo, format='JPEG')
+        return SimpleUploadedFile('photo.jpg', photo.getvalue(), content_type='image/jpeg')
+
+
+class ImageDecodingTestCase(TestCase):
+    @staticmethod
+    def encode(size, mode='RGB', image_format='JPEG'):
+        image = BytesIO()
+        Img.new(mode, size).save(image, format=image_format)
+        # left at the end as after an upload has been read
+        return File(image, name='photo')
+
+    def test_large_jpegs_are_decoded_at_a_reduced_scale(self):
+        img, original_size = open_image(self.encode((4000, 3000)), get_compressed_image_size)
+        self.assertEqual(original_size, (4000, 3000))
+        # 1/4 is the smallest scale covering 533x400
+        self.assertEqual(img.size, (1000, 750))
+
+    def test_compressed_sizes_do_not_depend_on_the_decoding(self):
+        for mode, image_format in (('RGB', 'JPEG'), ('L', 'JPEG'), ('RGBA', 'PNG'), ('P', 'PNG')):
+            image = self.encode((2000, 1500), mode, image_format)
+            _, compressed, thumbnail = compress_image(image, _create_thumbnail=True, delete_original=False)
+            self.assertEqual((Img.open(compressed).size, Img.open(thumbnail).size), ((533, 400), (133, 100)))
+
+        _, compressed = compress_image(self.encode((300, 200)), delete_original=False)
+        self.assertEqual(Img.open(compressed).size, (300, 200))
+
+
+class ScoutImageProcessingTestCase(MediaStorageMixin, TransactionTestCase):
+    def upload(self, url, **data):
+        with mock.patch('scouts.models.process_scout_picture.delay') as process_picture, \
+                mock.patch('scouts.models.process_scout_document.delay') as process_document:
+            response = self.client.post(url, dict(data, image=self.create_photo()), format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['processing_status'], IMAGE_PROCESSING_PENDING)
+        # queued once committed
+        (process_picture if 'pictures' in url else process_document).assert_called_once_with(response.data['id'])
+        return response.data['id']
+
+    def get_scout_pic_urls(self):
+        return Scout.objects.filter(id=self.scout.id).values_list('profile_pic_url', 'profile_pic_thumbnail_url').get()
+
+    def test_pictures_are_stored_as_uploaded_and_processed_in_the_background(self):
+        picture = ScoutPicture.objects.get(id=self.upload('/scouts/pictures/'))
+        original_name = picture.image.name
+        # the original stands in for the thumbnail until it has been made
+        self.assertEqual(self.get_scout_pic_urls(), (picture.image.url, picture.image.url))
+
+        process_scout_picture(picture.id)
+        picture.refresh_from_db()
+        self.assertEqual(picture.processing_status, IMAGE_PROCESSING_DONE)
+        self.assertEqual(self.get_scout_pic_urls(), (picture.image.url, picture.thumbnail.url))
+        self.assertFalse(self.storage.exists(original_name))
+        with self.storage.open(picture.thumbnail.name) as thumbnail:
+            self.assertEqual(Img.open(thumbnail).size[1], 100)
+
+        response = self.client.get('/scouts/pictures/{}/'.format(picture.id))
+        self.assertEqual(response.data['processing_status'], IMAGE_PROCESSING_DONE)
+
+    def test_a_newer_profile_pic_is_not_replaced_by_a_processed_one(self):
+        picture_id = self.upload('/scouts/pictures/')
+        newer_picture = ScoutPicture.objects.get(id=self.upload('/scouts/pictures/'))
+
+        process_scout_picture(picture_id)
+        self.assertEqual(self.get_scout_pic_urls(), (newer_picture.image.url, newer_picture.image.url))
+        self.assertEqual(list(self.scout.pictures.filter(is_profile_pic=True)), [newer_picture])
+
+    def test_saving_a_picture_again_does_not_process_it_again(self):
+        picture = ScoutPicture.objects.get(id=self.upload('/scouts/pictures/'))
+        process_scout_picture(picture.id)
+        picture.refresh_from_db()
+
+        with mock.patch('scouts.models.process_scout_picture.delay') as process_picture:
+            picture.is_deleted = True
+            picture.save()
+        process_picture.assert_not_called()
+        picture.refresh_from_db()
+        self.assertEqual(picture.processing_status, IMAGE_PROCESSING_DONE)
+
+    def test_documents_are_stored_under_their_id_and_processed(self):
+        document = ScoutDocument.objects.get(id=self.upload('/scouts/documents/', type='PAN'))
+        self.assertIn('/PAN-{}/'.format(document.id), document.image.name)
+        self.assertTrue(self.storage.exists(document.image.name))
+
+        process_scout_document(document.id)
+        document.refresh_from_db()
+        self.assertEqual(document.processing_status, IMAGE_PROCESSING_DONE)
+        self.assertTrue(self.storage.exists(document.thumbnail.name))
+
+    def test_images_that_cannot_be_processed_are_marked_failed(self):
+        picture = ScoutPicture.objects.get(id=self.upload('/scouts/pictures/'))
+        with self.storage.open(picture.image.name, 'wb') as image:
+            image.write(b'not an image')
+
+        process_scout_picture(picture.id)
+        picture.refresh_from_db()
+        self.assertEqual(picture.processing_status, IMAGE_PROCESSING_FAILED)
+        self.assertTrue(self.storage.exists(picture.image.name))
+
+
+class ImageRenditionsTestCase(MediaStorageMixin, TestCase):
+    def create_processed_picture(self, size):
+        with mock.patch('scouts.models.process_scout_picture.delay'):
+            picture = ScoutPicture.objects.create(scout=self.scout, image=self.create_photo(size))
+        process_scout_picture(picture.id)
+        picture.refresh_from_db()
+        return picture
+
+    @override_settings(IMAGE_RENDITION_WIDTHS=(160, 640, 1280), IMAGE_RENDITION_FORMATS={'WEBP': 75, 'JPEG': 80})
+    def test_renditions_are_made_in_every_format_up_to_the_original_width(self):
+        picture = self.create_processed_picture((1000, 750))
+        extensions = ['jpg', 'webp'] if features.check('webp') else ['jpg']
+        self.assertEqual(sorted(picture.renditions), extensions)
+        for extension in extensions:
+            self.assertEqual(sorted(picture.renditions[extension], key=int), ['160', '640', '1000'])
+            for width, name in picture.renditions[extension].items():
+                self.assertTrue(name.startswith(posixpath.dirname(picture.image.name) + '/renditions/'))
+                with self.storage.open(name) as rendition:
+                    rendition = Img.open(rendition)
+                    self.assertEqual((rendition.format, rendition.size), (
+                        'JPEG' if extension == 'jpg' else 'WEBP', (int(width), int(width) * 3 // 4)))
+
+    def test_srcset_urls_come_from_the_storage_of_the_image(self):
+        picture = self.create_processed_picture((400, 300))
+        with mock.patch.object(self.storage, 'url', side_effect=lambda name: 'https://bucket.example/' + name):
+            srcset = self.client.get('/scouts/pictures/{}/'.format(picture.id)).data['srcset']
+        self.assertEqual(srcset, {
+            extension: {width: 'https://bucket.example/' + name for width, name in renditions.items()}
+            for extension, renditions in picture.renditions.items()})
+        self.assertEqual(ScoutPictureSerializer(ScoutPicture(scout=self.scout)).data['srcset'], {})
+
+
+class DirectUploadTestCase(MediaStorageMixin, TestCase):
+    """ runs the presigned upload flow against a filesystem storage standing in for the S3 bucket """
+
+    def upload(self, kind, **data):
+        response = self.client.post('/scouts/uploads/', dict(data, kind=kind, filename='photo.jpg',
+                                                             content_type='image/jpeg'))
+        self.assertEqual(response.status_code, 201)
+        upload = response.json()
+        response = self.client.post(upload['url'], dict(upload['fields'], file=self.create_photo()),
+                                    format='multipart')
+        self.assertEqual(response.status_code, 204)
+        return upload
+
+    def test_picture_is_created_from_the_uploaded_file_and_processed(self):
+        upload = self.upload('picture')
+        self.assertTrue(self.storage.exists(upload['fields']['key']))
+
+        with mock.patch('scouts.models.process_scout_picture.delay'):
+            response = self.client.post('/scouts/uploads/finalize/', {'token': upload['token']})
+        self.assertEqual(response.status_code, 201)
+        picture = ScoutPicture.objects.get(id=response.json()['id'])
+        self.assertEqual((picture.scout, picture.image.name, picture.processing_status),
+                         (self.scout, upload['fields']['key'], IMAGE_PROCESSING_PENDING))
+
+        response = self.client.post('/scouts/uploads/finalize/', {'token': upload['token']})
+        self.assertEqual(response.status_code, 409)
+
+        process_scout_picture(picture.id)
+        picture.refresh_from_db()
+        self.assertEqual(picture.processing_status, IMAGE_PROCESSING_DONE)
+        self.assertFalse(self.storage.exists(upload['fields']['key']))
+        self.assertTrue(self.storage.exists(picture.thumbnail.name))
+
+    def test_document_keeps_the_uploaded_file(self):
+        upload = self.upload('document')
+        with mock.patch('scouts.models.process_scout_document.delay'):
+            response = self.client.post('/scouts/uploads/finalize/', {'token': upload['token'], 'type': 'PAN'})
+        self.assertEqual(response.status_code, 201)
+        document = ScoutDocument.objects.get(id=response.json()['id'])
+        self.assertEqual((document.image.name, document.processing_status),
+                         (upload['fields']['key'], IMAGE_PROCESSING_PENDING))
+
+    def test_policies_without_a_valid_kind_are_rejected(self):
+        for policy_data in (None, {'kind': 'video'}):
+            upload = create_presigned_upload(self.storage, 'scouts/uploads/photo.jpg', 'image/jpeg',
+                                             policy_data=policy_data)
+            response = self.client.post(upload['url'], dict(upload['fields'], file=self.create_photo()),
+                                        format='multipart')
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.storage.exists('scouts/uploads/photo.jpg'))
+
+    def test_local_uploads_are_only_needed_off_s3(self):
+        self.assertFalse(is_s3_storage(self.storage))
+        self.assertTrue(is_local_direct_upload_needed())
+        with mock.patch('scouts.api.views.is_s3_storage', return_value=True):
+            self.assertFalse(is_local_direct_upload_needed())
+
+    def test_uploads_are_checked_against_policy_and_token(self):
+        response = self.client.post('/scouts/uploads/', {'kind': 'picture', 'filename': 'photo.jpg',
+                                                         'content_type': 'image/jpeg'})
+        upload = response.json()
+        fields = dict(upload['fields'], key=upload['fields']['key'] + '.exe')
+        response = self.client.post(upload['url'], dict(fields, file=self.create_photo()), format='multipart')
+        self.assertEqual(response.status_code, 403)
+
+        response = self.client.post('/scouts/uploads/finalize/', {'token': upload['token']})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/scouts/uploads/finalize/', {'token': upload['token'] + 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ScoutPicture.objects.exists())
@@ -2,6 +2,7 @@ from django.conf.urls import url
 from django.urls import include
 
 from scouts.api import views
+from utility.upload_utils import LOCAL_UPLOAD_URL_NAME
 
 urlpatterns = (
     url(r'^register/$', views.register),
@@ -10,9 +11,14 @@ urlpatterns = (
 
     url(r'^$', views.ScoutRetrieveUpdateView.as_view()),
     url(r'^pictures/$', views.ScoutPictureCreateView.as_view()),
+    url(r'^pictures/(?P<pk>\d+)/$', views.ScoutPictureRetrieveView.as_view()),
     url(r'^documents/$', views.ScoutDocumentListCreateView.as_view()),
     url(r'^documents/(?P<pk>\d+)/$', views.ScoutDocumentDestroyView.as_view()),
 
+    # Media uploaded by the app straight to the storage
+    url(r'^uploads/$', views.DirectUploadCreateView.as_view()),
+    url(r'^uploads/finalize/$', views.DirectUploadFinalizeView.as_view()),
+
     url(r'^scheduled_availability/$', views.ScheduledAvailabilityListCreateView.as_view()),
     url(r'^scheduled_availability/(?P<pk>\d+)/$', views.ScheduledAvailabilityRetrieveUpdateDestroyView.as_view()),
 
@@ -20,6 +26,7 @@ urlpatterns = (
 
     url(r'^wallet/$', views.ScoutWalletRetrieveView.as_view()),
     url(r'^payments/$', views.ScoutPaymentListView.as_view()),
+    url(r'^payments/settle/$', views.ScoutPaymentSettleView.as_view()),
 
     url(r'^tasks/$', views.ScoutTaskListView.as_view()),
 
@@ -39,4 +46,13 @@ urlpatterns = (
     # Url to make connection between halanx-scout and consumer app and also to create tasks
     url('^task/create/', views.ScoutConsumerLinkAndScoutTaskCreateView.as_view()),
 
+    # Cache of homes records, invalidated by the consumer app when a record changes
+    url(r'^homes_cache/invalidate/$', views.HomesCacheInvalidateView.as_view()),
+    url(r'^homes_cache/stats/$', views.HomesCacheStatsView.as_view()),
+
 )
+
+if views.is_local_direct_upload_needed():
+    urlpatterns += (
+        url(r'^uploads/local/$', views.LocalDirectUploadView.as_view(), name=LOCAL_UPLOAD_URL_NAME),
+    )
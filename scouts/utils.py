@@ -1,16 +1,27 @@
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import reduce
+from operator import or_
+
+import numpy as np
 from decouple import config
 from django.conf import settings
-from django.db.models import Q
-from geopy import units, distance
-from pyfcm import FCMNotification
+from django.db.models import Q, Count
+from django.utils import timezone
+from django.utils.timezone import utc
+from geopy import units
 
-from Homes.Houses.models import House, HouseVisit
 from Homes.Tenants.models import TenantMoveOutRequest
+from Homes.cache import house_cache, house_visit_cache
 
+from utility.assignment_utils import solve_min_cost_assignment
+from utility.geo_utils import get_geohash_prefixes_for_bounding_box, rank_by_distance, haversine_distances, \
+    HAVERSINE_RELATIVE_ERROR
 from utility.logging_utils import sentry_debug_logger
 from utility.random_utils import generate_random_code
-
-notify_scout = FCMNotification(api_key=config('FCM_SERVER_KEY')).notify_single_device
+from utility.redis_utils import get_redis_connection
 
 UNASSIGNED = 'unassigned'
 ASSIGNED = 'assigned'
@@ -37,6 +48,17 @@ NEW_TASK_NOTIFICATION = 'NewTask'
 NEW_PAYMENT_RECEIVED = 'NewPaymentReceived'
 NEW_MESSAGE_RECEIVED = 'NewMessageReceived'
 
+SCOUT_NOTIFICATION_BATCH_SIZE = 100  # notifications inserted by a single query when sending in bulk
+
+# pushes are queued in a redis list and sent together by a periodic dispatcher, identical pushes to different
+# scouts go out as a single multicast request
+SCOUT_PUSH_QUEUE_KEY = 'SCOUT_PUSH_QUEUE'
+SCOUT_PUSH_DISPATCH_INTERVAL = 2  # seconds for which pushes are gathered before being sent together
+SCOUT_PUSH_BATCH_SIZE = 1000  # registration ids accepted by fcm in a single request
+FCM_INVALID_REGISTRATION_ERRORS = ('NotRegistered', 'InvalidRegistration')
+FCM_RETRYABLE_ERRORS = ('Unavailable', 'InternalServerError')
+SCOUT_PUSH_MAX_ATTEMPTS = 3  # pushes failing this many times are dropped
+
 TASK_TYPE = 'task_type'
 HOUSE_VISIT = 'House Visit'
 HOUSE_VISIT_CANCELLED = 'House Visit Cancelled'
@@ -51,6 +73,60 @@ PROPERTY_ONBOARDING_HOUSE_PHOTOS_SUBTASK = 'Property Onboarding House Photos Sub
 PROPERTY_ONBOARDING_HOUSE_AMENITIY_SUBTASK = 'Property Onboarding House Amenity Subtask'
 PROPERTY_ONBOARDING_HOUSE_BASIC_DETAILS_SUBTASK = 'Property Onboarding House Basic Details Subtask'
 
+# batch assignment of tasks to scouts
+BATCH_SCOUT_ASSIGNMENT_FLAG = 'BATCH_SCOUT_ASSIGNMENT'  # enable this flag to assign new tasks in batches
+BATCH_SCOUT_ASSIGNMENT_INTERVAL = 30  # seconds for which new tasks are gathered before being assigned together
+BATCH_ASSIGNMENT_LOAD_PENALTY = 5  # km added to the cost of a scout for every task they are already handling
+# held while a batch is assigned, so that overlapping runs never request the same task twice
+BATCH_SCOUT_ASSIGNMENT_LOCK_KEY = 'BATCH_SCOUT_ASSIGNMENT_LOCK'
+BATCH_SCOUT_ASSIGNMENT_LOCK_TIMEOUT = 5 * 60  # seconds
+BATCH_ASSIGNMENT_INFEASIBLE_COST = 10 ** 9
+
+# precomputed index of scheduled availabilities, every time slot has a redis set of the exact windows overlapping it
+# as '{availability id}:{scout id}:{start timestamp}:{end timestamp}', so a lookup needs no database query
+AVAILABILITY_SLOT_MINUTES = 15
+SCOUT_AVAILABILITY_SLOT_KEY = 'SCOUT_AVAILABILITY:{}'  # formatted with slot number
+SCOUT_AVAILABILITY_WINDOWS_KEY = 'SCOUT_AVAILABILITY:WINDOWS'  # hash of the indexed window of each availability id
+SCOUT_AVAILABILITY_INDEX_BUILT_KEY = 'SCOUT_AVAILABILITY:BUILT'  # present only after a full rebuild of the index
+SCOUT_AVAILABILITY_SLOT_EXPIRY = 24 * 60 * 60  # seconds for which a slot is kept after it has passed
+
+# unanswered assignment requests are auto rejected by a periodic sweeper, their deadlines are kept in a redis
+# sorted set (scored by the deadline timestamp) instead of scheduling one celery eta task per request
+SCOUT_ASSIGNMENT_REQUEST_EXPIRY_KEY = 'SCOUT_ASSIGNMENT_REQUEST_EXPIRY'
+SCOUT_ASSIGNMENT_REQUEST_SWEEP_INTERVAL = 5  # seconds
+DEFAULT_ASSIGNMENT_REQUEST_TIMEOUT = 20  # seconds
+
+# number of nearest scouts whose haversine distance is refined with the exact geodesic distance
+SCOUT_GEODESIC_REFINEMENT_COUNT = 5
+
+# nearest scouts are first looked for within this radius (in km), which is doubled until enough are found
+NEARBY_SCOUTS_INITIAL_SEARCH_RADIUS = 2
+NEARBY_SCOUTS_SEARCH_RADIUS_GROWTH = 2
+
+
+_push_service = None
+_push_service_lock = threading.Lock()
+
+
+def get_push_service():
+    """
+    :return: FCMNotification of the process, created on first use so that importing this module neither pays for
+             pyfcm nor needs FCM_SERVER_KEY. Every push reuses its keep-alive http session.
+    """
+    global _push_service
+    if _push_service is None:
+        with _push_service_lock:
+            if _push_service is None:
+                from pyfcm import FCMNotification
+                push_service = FCMNotification(api_key=config('FCM_SERVER_KEY'))
+                push_service.FCM_END_POINT = settings.FCM_END_POINT
+                _push_service = push_service
+    return _push_service
+
+
+def notify_scout(**kwargs):
+    return get_push_service().notify_single_device(**kwargs)
+
 
 def get_picture_upload_path(instance, filename):
     return "scouts/{}/pictures/{}-{}".format(instance.scout.id, generate_random_code(n=5),
@@ -72,6 +148,18 @@ def get_scout_document_thumbnail_upload_path(instance, filename):
                                                               generate_random_code(n=5), filename.split('/')[-1])
 
 
+# kinds of media the app can upload straight to the storage
+DIRECT_UPLOAD_PICTURE = 'picture'
+DIRECT_UPLOAD_DOCUMENT = 'document'
+DIRECT_UPLOAD_ONBOARDING_PHOTO = 'onboarding_photo'
+DIRECT_UPLOAD_KINDS = (DIRECT_UPLOAD_PICTURE, DIRECT_UPLOAD_DOCUMENT, DIRECT_UPLOAD_ONBOARDING_PHOTO)
+
+
+def get_direct_upload_prefix(scout_id, kind):
+    # originals stay here until processing stores them under the upload path of their model
+    return "scouts/{}/uploads/{}".format(scout_id, kind)
+
+
 def get_scout_task_category_image_upload_path(instance, filename):
     return "scout-task-categories/{}/{}-{}".format(instance.id, generate_random_code(n=5), filename.split('/')[-1])
 
@@ -81,17 +169,38 @@ default_profile_pic_thumbnail_url = "https://{}/static/img/nopic_small.jpg".form
 
 
 def get_nearby_scouts(latitude, longitude, distance_range=50, queryset=None):
+    """
+    :return: queryset of the scouts whose work address lies in a bounding box of the circle of distance_range (in km)
+             around the point, looked up through the geohash cells covering the box
+    """
     from scouts.models import Scout
     if queryset is None:
         queryset = Scout.objects.all()
     rough_distance = units.degrees(arcminutes=units.nautical(kilometers=distance_range)) * 2
     latitude, longitude = float(latitude), float(longitude)
-    queryset = queryset.filter(work_address__latitude__range=(latitude - rough_distance, latitude + rough_distance),
-                               work_address__longitude__range=(longitude - rough_distance, longitude + rough_distance))
+    min_latitude, max_latitude = latitude - rough_distance, latitude + rough_distance
+    min_longitude, max_longitude = longitude - rough_distance, longitude + rough_distance
+
+    # narrow down the candidates using the geohash index before applying the exact bounding box, geohashes are
+    # stored in lower case and a case sensitive prefix match can use the index
+    geohash_prefixes = get_geohash_prefixes_for_bounding_box(min_latitude, min_longitude, max_latitude, max_longitude)
+    if geohash_prefixes:
+        queryset = queryset.filter(reduce(or_, (Q(work_address__geohash__startswith=prefix)
+                                                for prefix in sorted(geohash_prefixes))))
+
+    queryset = queryset.filter(work_address__latitude__range=(min_latitude, max_latitude),
+                               work_address__longitude__range=(min_longitude, max_longitude))
     return queryset
 
 
-def get_sorted_scouts_nearby(house_latitude, house_longitude, distance_range=50, queryset=None):
+def get_sorted_scouts_nearby(house_latitude, house_longitude, distance_range=50, queryset=None, limit=None):
+    """
+    With a limit the search starts from the few geohash cells around the house and its radius is doubled until the
+    nearest `limit` scouts are known to lie within it, so a nearest scout lookup reads only the scouts close by.
+
+    :param limit: if provided only the nearest `limit` scouts are returned
+    :return: list of (scout, distance in km) tuples sorted by distance
+    """
     if queryset is None:
         from scouts.models import Scout
         queryset = Scout.objects.all()
@@ -108,51 +217,71 @@ def get_sorted_scouts_nearby(house_latitude, house_longitude, distance_range=50,
     #             result.append((scout, 0))  # just random distance (0) in result
     #         return result
 
-    queryset = get_nearby_scouts(house_latitude, house_longitude, distance_range, queryset)
-
-    result = []
-    for scout in queryset:
-        exact_distance = distance.distance((house_latitude, house_longitude), (scout.work_address.latitude,
-                                                                               scout.work_address.longitude)).km
-        if exact_distance <= distance_range:
-            result.append((scout, exact_distance))
-
-    result.sort(key=lambda x: x[1])
+    if limit == 0:
+        return []
+
+    search_radius = distance_range if limit is None else min(NEARBY_SCOUTS_INITIAL_SEARCH_RADIUS, distance_range)
+    while True:
+        candidates = get_nearby_scouts(house_latitude, house_longitude, search_radius, queryset).values_list(
+            'id', 'work_address__latitude', 'work_address__longitude').distinct()
+        ranked_scouts = rank_by_distance(house_latitude, house_longitude, candidates, distance_range=distance_range,
+                                         limit=limit, geodesic_refinement=SCOUT_GEODESIC_REFINEMENT_COUNT)
+        # every scout outside of the searched box is farther than the search radius, so the ranking is final once
+        # the farthest scout kept is within it (by a margin for the distances refined after the haversine ones)
+        if search_radius >= distance_range or (len(ranked_scouts) == limit and ranked_scouts[-1][1] * (
+                1 + HAVERSINE_RELATIVE_ERROR) <= search_radius):
+            break
+        search_radius = min(search_radius * NEARBY_SCOUTS_SEARCH_RADIUS_GROWTH, distance_range)
+
+    scouts = queryset.model.objects.select_related('work_address').in_bulk([scout_id for scout_id, _ in ranked_scouts])
+    result = [(scouts[scout_id], exact_distance) for scout_id, exact_distance in ranked_scouts if scout_id in scouts]
     # sentry_debug_logger.debug("sorted scouts are " + str(result))
     return result
 
 
-def get_appropriate_scout_for_the_task(task, scouts=None):
-    from scouts.models import ScoutTaskAssignmentRequest
-    from scouts.models import Scout
+def get_house_location(house_id):
+    address = getattr(house_cache.get(house_id), 'address', None)
+    return (address.latitude, address.longitude) if address else (None, None)
 
-    house = House.objects.using(settings.HOMES_DB).filter(id=task.house_id).first()
 
-    scheduled_task_time = None
+def get_task_location_and_scheduled_time(task):
+    """
+    Fetches the location and scheduled time of a task with at most two queries, one of which is saved whenever the
+    house or the visit of the task is cached.
 
+    :return: (latitude, longitude, scheduled time) of the place where the task has to be performed
+    """
     if task.category.name == HOUSE_VISIT:
-        house_visit = HouseVisit.objects.using(settings.HOMES_DB).filter(id=task.visit_id).first()
-        scheduled_task_time = house_visit.scheduled_visit_time
-        house_latitude = house.address.latitude
-        house_longitude = house.address.longitude
+        house_visit = house_visit_cache.get(task.visit_id)
+        latitude, longitude = get_house_location(task.house_id)
+        return latitude, longitude, house_visit.scheduled_visit_time
 
     elif task.category.name == MOVE_OUT:
-        scheduled_task_time = TenantMoveOutRequest.objects.using(settings.HOMES_DB).filter(id=task.move_out_request_id) \
-            .first().timing
-        house_latitude = house.address.latitude
-        house_longitude = house.address.longitude
+        scheduled_task_time = TenantMoveOutRequest.objects.using(settings.HOMES_DB).filter(
+            id=task.move_out_request_id).values_list('timing', flat=True).get()
+        latitude, longitude = get_house_location(task.house_id)
+        return latitude, longitude, scheduled_task_time
 
     elif task.category.name == PROPERTY_ONBOARDING:
         from scouts.sub_tasks.models import PropertyOnBoardingDetail
-        property_on_boarding_detail = PropertyOnBoardingDetail.objects.filter(id=task.onboarding_property_details_id) \
-            .first()
-        scheduled_task_time = property_on_boarding_detail.scheduled_at
-        house_latitude = property_on_boarding_detail.latitude
-        house_longitude = property_on_boarding_detail.longitude
+        return PropertyOnBoardingDetail.objects.filter(id=task.onboarding_property_details_id).values_list(
+            'latitude', 'longitude', 'scheduled_at').get()
 
     else:
         raise Exception({'detail': 'Task category is not in the choices available'})
 
+
+def get_appropriate_scout_for_the_task(task, scouts=None):
+    """
+    Finds the nearest available scout for a task who has not rejected it yet. Needs at most two queries to locate
+    the task, one per radius searched around it plus one to rank the scouts (the rejected scouts are excluded via a
+    subquery) and one more only when a single scout is left, however many scouts there are.
+    """
+    from scouts.models import ScoutTaskAssignmentRequest
+    from scouts.models import Scout
+
+    house_latitude, house_longitude, scheduled_task_time = get_task_location_and_scheduled_time(task)
+
     if scouts is None:
         scouts = Scout.objects.all()
 
@@ -162,16 +291,19 @@ def get_appropriate_scout_for_the_task(task, scouts=None):
     scouts = scouts.exclude(id__in=rejected_scouts_id)
 
     if scheduled_task_time:
-        # filter the scouts whose scheduled availabilities  lie between visit scheduled visit time
-        scouts = scouts.filter(Q(scheduled_availabilities__start_time__lte=scheduled_task_time) &
-                               Q(scheduled_availabilities__end_time__gte=scheduled_task_time) &
-                               Q(scheduled_availabilities__cancelled=False))
-
-    sentry_debug_logger.debug("queryset is " + str(scouts))
-
+        try:
+            scouts = scouts.filter(id__in=list(get_scout_ids_available_at(scheduled_task_time)))
+        except Exception as E:
+            sentry_debug_logger.error('scout availability index unavailable: ' + str(E), exc_info=True)
+            # filter the scouts whose scheduled availabilities  lie between visit scheduled visit time
+            scouts = scouts.filter(Q(scheduled_availabilities__start_time__lte=scheduled_task_time) &
+                                   Q(scheduled_availabilities__end_time__gte=scheduled_task_time) &
+                                   Q(scheduled_availabilities__cancelled=False))
+
+    # only the nearest scout is needed, the second one tells whether they are the last scout left
     sorted_scouts = get_sorted_scouts_nearby(house_latitude=house_latitude,
                                              house_longitude=house_longitude,
-                                             distance_range=50, queryset=scouts)
+                                             distance_range=50, queryset=scouts, limit=2)
 
     try:
         selected_scout = sorted_scouts[0][0]
@@ -189,6 +321,348 @@ def get_appropriate_scout_for_the_task(task, scouts=None):
     return selected_scout
 
 
+def is_batch_scout_assignment_enabled():
+    from scouts.models import Flag
+    return Flag.objects.filter(name=BATCH_SCOUT_ASSIGNMENT_FLAG, enabled=True).exists()
+
+
+def get_batch_scout_assignments(tasks, scouts=None, distance_range=50):
+    """
+    Assigns a batch of pending tasks at once by solving a min cost matching between tasks and scouts. The cost of
+    a (task, scout) pair is their distance plus a penalty for every task the scout is already handling, so that a
+    burst of tasks is spread across nearby scouts instead of all going to the nearest one. A scout is never matched
+    to a task they are too far from, unavailable for or have already rejected. Tasks without a location are skipped.
+
+    :return: list of (task, scout) tuples
+    """
+    from scouts.models import Scout, ScoutTaskAssignmentRequest
+
+    if scouts is None:
+        scouts = Scout.objects.filter(active=True)
+
+    tasks_details = []
+    for task in tasks:
+        try:
+            latitude, longitude, scheduled_time = get_task_location_and_scheduled_time(task)
+        except Exception as E:
+            sentry_debug_logger.error('error while locating task {}: {}'.format(task.id, str(E)), exc_info=True)
+            continue
+        if latitude is None or longitude is None:
+            sentry_debug_logger.error('task {} has no location, skipped from batch assignment'.format(task.id))
+            continue
+        tasks_details.append((task, latitude, longitude, scheduled_time))
+
+    scouts = list(scouts.select_related('work_address').annotate(
+        assigned_tasks_count=Count('tasks', filter=Q(tasks__status=ASSIGNED), distinct=True),
+        awaited_requests_count=Count('task_assignment_requests',
+                                     filter=Q(task_assignment_requests__status=REQUEST_AWAITED), distinct=True)))
+
+    if not tasks_details or not scouts:
+        return []
+
+    scout_index = {scout.id: index for index, scout in enumerate(scouts)}
+    scout_latitudes = [scout.work_address.latitude for scout in scouts]
+    scout_longitudes = [scout.work_address.longitude for scout in scouts]
+    scout_loads = np.array([scout.assigned_tasks_count + scout.awaited_requests_count for scout in scouts])
+
+    rejected_pairs = set(ScoutTaskAssignmentRequest.objects.filter(
+        task__in=[task for task, _, _, _ in tasks_details], status=REQUEST_REJECTED).values_list('task', 'scout'))
+
+    scheduled_times = [scheduled_time for _, _, _, scheduled_time in tasks_details if scheduled_time]
+    available_scout_ids = {}
+    if scheduled_times:
+        try:
+            available_scout_ids = get_available_scout_ids(scheduled_times)
+        except Exception as E:
+            sentry_debug_logger.error('scout availability index unavailable: ' + str(E), exc_info=True)
+            available_scout_ids = get_available_scout_ids_from_database(scheduled_times, list(scout_index))
+
+    cost_matrix = np.full((len(tasks_details), len(scouts)), BATCH_ASSIGNMENT_INFEASIBLE_COST, dtype=float)
+    for row, (task, latitude, longitude, scheduled_time) in enumerate(tasks_details):
+        distances = haversine_distances(latitude, longitude, scout_latitudes, scout_longitudes)
+        feasible = ~np.isnan(distances)
+        feasible[feasible] = distances[feasible] <= distance_range
+
+        if scheduled_time:
+            available = np.zeros(len(scouts), dtype=bool)
+            for scout_id in available_scout_ids[scheduled_time]:
+                if scout_id in scout_index:
+                    available[scout_index[scout_id]] = True
+            feasible &= available
+
+        for task_id, scout_id in rejected_pairs:
+            if task_id == task.id and scout_id in scout_index:
+                feasible[scout_index[scout_id]] = False
+
+        cost_matrix[row, feasible] = distances[feasible] + scout_loads[feasible] * BATCH_ASSIGNMENT_LOAD_PENALTY
+
+    return [(tasks_details[row][0], scouts[column]) for row, column in solve_min_cost_assignment(cost_matrix)
+            if cost_matrix[row, column] < BATCH_ASSIGNMENT_INFEASIBLE_COST]
+
+
+class AvailabilityIndexNotBuilt(Exception):
+    pass
+
+
+def get_availability_slot(time):
+    """
+    :return: number of the AVAILABILITY_SLOT_MINUTES long slot (counted from the epoch) in which time lies
+    """
+    return int(time.timestamp()) // (AVAILABILITY_SLOT_MINUTES * 60)
+
+
+def get_availability_slots(start_time, end_time):
+    """
+    :return: range of slots overlapping [start_time, end_time]
+    """
+    slot_seconds = AVAILABILITY_SLOT_MINUTES * 60
+    return range(int(start_time.timestamp()) // slot_seconds, int(end_time.timestamp()) // slot_seconds + 1)
+
+
+def get_availability_index_start(now):
+    """ slots before the current one are never looked up, so they are not indexed """
+    return now - timedelta(minutes=AVAILABILITY_SLOT_MINUTES)
+
+
+def get_availability_window(availability_id, scout_id, start_time, end_time):
+    return '{}:{}:{!r}:{!r}'.format(availability_id, scout_id, start_time.timestamp(), end_time.timestamp())
+
+
+def parse_availability_window(window):
+    """
+    :return: (availability id, scout id, start time, end time) of a window of the index
+    """
+    availability_id, scout_id, start_timestamp, end_timestamp = window.split(':')
+    return (int(availability_id), int(scout_id), datetime.fromtimestamp(float(start_timestamp), tz=utc),
+            datetime.fromtimestamp(float(end_timestamp), tz=utc))
+
+
+def _add_availability_window(pipe, window, now):
+    slot_seconds = AVAILABILITY_SLOT_MINUTES * 60
+    availability_id, _, start_time, end_time = parse_availability_window(window)
+    for slot in get_availability_slots(max(start_time, get_availability_index_start(now)), end_time):
+        key = SCOUT_AVAILABILITY_SLOT_KEY.format(slot)
+        pipe.sadd(key, window)
+        pipe.expireat(key, (slot + 1) * slot_seconds + SCOUT_AVAILABILITY_SLOT_EXPIRY)
+    pipe.hset(SCOUT_AVAILABILITY_WINDOWS_KEY, availability_id, window)
+
+
+def _remove_availability_window(pipe, window, now):
+    availability_id, _, start_time, end_time = parse_availability_window(window)
+    if end_time >= get_availability_index_start(now):
+        for slot in get_availability_slots(max(start_time, get_availability_index_start(now)), end_time):
+            pipe.srem(SCOUT_AVAILABILITY_SLOT_KEY.format(slot), window)
+    pipe.hdel(SCOUT_AVAILABILITY_WINDOWS_KEY, availability_id)
+
+
+def get_active_scheduled_availabilities(now, **filters):
+    from scouts.models import ScheduledAvailability
+    return ScheduledAvailability.objects.filter(
+        cancelled=False, start_time__isnull=False, end_time__gte=now, **filters).values_list(
+        'id', 'scout', 'start_time', 'end_time')
+
+
+def update_availability_index(availability_id, scout_id=None, start_time=None, end_time=None):
+    """
+    Re-indexes a single scheduled availability after it was saved or deleted, without reading the database: the
+    window it was indexed for is kept in the windows hash. Leave the window out to remove it from the index.
+    """
+    now = timezone.now()
+    window = None
+    if scout_id and start_time and end_time and end_time >= now:
+        window = get_availability_window(availability_id, scout_id, start_time, end_time)
+
+    def update(pipe):
+        old_window = pipe.hget(SCOUT_AVAILABILITY_WINDOWS_KEY, availability_id)
+        pipe.multi()
+        if old_window:
+            _remove_availability_window(pipe, old_window.decode(), now)
+        if window:
+            _add_availability_window(pipe, window, now)
+
+    get_redis_connection().transaction(update, SCOUT_AVAILABILITY_WINDOWS_KEY)
+
+
+def rebuild_scout_availability_index():
+    """
+    Rebuilds the whole index from the database atomically. Every update of the index changes the windows hash, so
+    the rebuild is retried from the database if an availability is re-indexed meanwhile.
+    """
+    def rebuild(pipe):
+        now = timezone.now()
+        keys = [key for key in pipe.scan_iter(match=SCOUT_AVAILABILITY_SLOT_KEY.format('*'))
+                if key.decode().rsplit(':', 1)[-1].isdigit()]
+        availabilities = list(get_active_scheduled_availabilities(now))
+
+        pipe.multi()
+        pipe.delete(SCOUT_AVAILABILITY_WINDOWS_KEY, *keys)
+        for availability in availabilities:
+            _add_availability_window(pipe, get_availability_window(*availability), now)
+        pipe.set(SCOUT_AVAILABILITY_INDEX_BUILT_KEY, now.isoformat())
+
+    get_redis_connection().transaction(rebuild, SCOUT_AVAILABILITY_WINDOWS_KEY)
+
+
+def get_available_scout_ids(times):
+    """
+    Looks up the windows of the slot of each time in a single round trip and checks them exactly.
+
+    :return: dict of the set of ids of scouts having a scheduled availability at each of the times
+    :raise AvailabilityIndexNotBuilt: if the index has not been built yet (e.g. redis was flushed)
+    """
+    times = list(set(times))
+    pipe = get_redis_connection().pipeline(transaction=False)
+    pipe.exists(SCOUT_AVAILABILITY_INDEX_BUILT_KEY)
+    for time in times:
+        pipe.smembers(SCOUT_AVAILABILITY_SLOT_KEY.format(get_availability_slot(time)))
+    built, *slot_windows = pipe.execute()
+    if not built:
+        raise AvailabilityIndexNotBuilt
+
+    available_scout_ids = {}
+    for time, windows in zip(times, slot_windows):
+        available_scout_ids[time] = set()
+        for window in windows:
+            _, scout_id, start_time, end_time = parse_availability_window(window.decode())
+            if start_time <= time <= end_time:
+                available_scout_ids[time].add(scout_id)
+    return available_scout_ids
+
+
+def get_available_scout_ids_from_database(times, scout_ids):
+    """ Same as get_available_scout_ids for the given scouts, used while the index is unavailable """
+    from scouts.models import ScheduledAvailability
+
+    available_scout_ids = {time: set() for time in times}
+    availabilities = ScheduledAvailability.objects.filter(
+        scout__in=scout_ids, cancelled=False, start_time__lte=max(times), end_time__gte=min(times)).values_list(
+        'scout', 'start_time', 'end_time')
+    for scout_id, start_time, end_time in availabilities:
+        for time in available_scout_ids:
+            if start_time <= time <= end_time:
+                available_scout_ids[time].add(scout_id)
+    return available_scout_ids
+
+
+def get_scout_ids_available_at(time):
+    """
+    :return: set of ids of scouts having a scheduled availability at the given time
+    :raise AvailabilityIndexNotBuilt: if the index has not been built yet (e.g. redis was flushed)
+    """
+    return get_available_scout_ids([time])[time]
+
+
+def schedule_assignment_request_expiry(assignment_request_id, deadline):
+    get_redis_connection().zadd(SCOUT_ASSIGNMENT_REQUEST_EXPIRY_KEY, {assignment_request_id: deadline.timestamp()})
+
+
+def pop_expired_assignment_requests(now=None):
+    """
+    Atomically removes and returns the ids of assignment requests whose deadline has passed, so that concurrent
+    sweepers never process the same request twice.
+    """
+    now = now or timezone.now()
+    pipe = get_redis_connection().pipeline(transaction=True)
+    pipe.zrangebyscore(SCOUT_ASSIGNMENT_REQUEST_EXPIRY_KEY, '-inf', now.timestamp())
+    pipe.zremrangebyscore(SCOUT_ASSIGNMENT_REQUEST_EXPIRY_KEY, '-inf', now.timestamp())
+    expired_request_ids, _ = pipe.execute()
+    return [int(request_id) for request_id in expired_request_ids]
+
+
+def get_scout_push_data_message(title, content, category, payload):
+    return {'data': json.dumps({'title': title, 'content': content, 'category': category, 'payload': payload})}
+
+
+def queue_scout_notifications(notifications):
+    """
+    :param notifications: list of dicts with scout_id, title, content, category and payload of each notification
+    """
+    if not notifications:
+        return
+    try:
+        get_redis_connection().rpush(SCOUT_PUSH_QUEUE_KEY, *[json.dumps(notification)
+                                                             for notification in notifications])
+    except Exception as E:
+        sentry_debug_logger.error('error while queueing scout notifications: ' + str(E), exc_info=True)
+        from scouts.tasks import send_scout_notifications
+        send_scout_notifications.delay(notifications)
+
+
+def requeue_failed_scout_notifications(notifications):
+    """ Queues the notifications whose push failed again, to be retried by the next run of the dispatcher """
+    retried_notifications = [dict(notification, attempts=notification.get('attempts', 0) + 1)
+                             for notification in notifications
+                             if notification.get('attempts', 0) + 1 < SCOUT_PUSH_MAX_ATTEMPTS]
+    if len(retried_notifications) < len(notifications):
+        sentry_debug_logger.error('dropped {} scout notifications after {} failed pushes'.format(
+            len(notifications) - len(retried_notifications), SCOUT_PUSH_MAX_ATTEMPTS))
+    queue_scout_notifications(retried_notifications)
+
+
+def get_queued_scout_notifications_count():
+    return get_redis_connection().llen(SCOUT_PUSH_QUEUE_KEY)
+
+
+def pop_queued_scout_notifications(count=SCOUT_PUSH_BATCH_SIZE):
+    pipe = get_redis_connection().pipeline(transaction=True)
+    pipe.lrange(SCOUT_PUSH_QUEUE_KEY, 0, count - 1)
+    pipe.ltrim(SCOUT_PUSH_QUEUE_KEY, count, -1)
+    notifications, _ = pipe.execute()
+    return [json.loads(notification) for notification in notifications]
+
+
+def push_scout_notifications(notifications):
+    """
+    Sends the pushes of the notifications with one multicast request per distinct message and clears the gcm ids
+    reported as invalid by fcm. The notifications of a failed request or of a temporary fcm error are queued again.
+
+    :param notifications: list of dicts with scout_id, title, content, category and payload of each notification
+    :return: (number of pushes sent, number of gcm ids cleared)
+    """
+    from scouts.models import Scout
+
+    gcm_ids = dict(Scout.objects.filter(id__in={notification['scout_id'] for notification in notifications})
+                   .exclude(gcm_id__isnull=True).exclude(gcm_id='').values_list('id', 'gcm_id'))
+
+    # notifications of every gcm id, for each distinct message
+    notifications_of_message = OrderedDict()
+    for notification in notifications:
+        gcm_id = gcm_ids.get(notification['scout_id'])
+        if not gcm_id:
+            continue
+        data = get_scout_push_data_message(notification['title'], notification['content'],
+                                           notification['category'], notification['payload'])['data']
+        notifications_of_message.setdefault(data, OrderedDict()).setdefault(gcm_id, []).append(notification)
+
+    sent_count, invalid_gcm_ids, failed_notifications = 0, [], []
+    for data, notifications_of_gcm_id in notifications_of_message.items():
+        registration_ids = list(notifications_of_gcm_id)
+        try:
+            response = get_push_service().notify_multiple_devices(registration_ids=registration_ids,
+                                                                  data_message={'data': data})
+        except Exception as E:
+            sentry_debug_logger.error('error while pushing scout notifications: ' + str(E), exc_info=True)
+            failed_notifications += [notification for gcm_id_notifications in notifications_of_gcm_id.values()
+                                     for notification in gcm_id_notifications]
+            continue
+
+        sent_count += response['success']
+        # results are in the order of the registration ids
+        for gcm_id, result in zip(registration_ids, response['results']):
+            if result.get('error') in FCM_INVALID_REGISTRATION_ERRORS:
+                invalid_gcm_ids.append(gcm_id)
+            elif result.get('error') in FCM_RETRYABLE_ERRORS:
+                failed_notifications += notifications_of_gcm_id[gcm_id]
+
+    if invalid_gcm_ids:
+        Scout.objects.filter(gcm_id__in=invalid_gcm_ids).update(gcm_id=None)
+
+    if failed_notifications:
+        requeue_failed_scout_notifications(failed_notifications)
+
+    return sent_count, len(invalid_gcm_ids)
+
+
 SCOUT_PAYMENT_MESSAGE_WALLET = 'Payment for {} on {}'  # credited to your wallet'
 SCOUT_PAYMENT_MESSAGE_BANK = 'Payment for {} on {}'  # credited to your bank account and debited from wallet'
 
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+def solve_min_cost_assignment(cost_matrix):
+    """
+    Solves the rectangular linear assignment problem with the Hungarian algorithm (O(n^2 m)).
+    Every row gets matched to a distinct column (or vice versa if there are more rows than columns) such that
+    the total cost is minimum. Costs must be finite; use a large finite cost for pairs that should never be matched
+    and drop such pairs from the result.
+
+    :param cost_matrix: 2d array like of shape (rows, columns)
+    :return: list of (row, column) pairs sorted by row
+    """
+    cost = np.asarray(cost_matrix, dtype=float)
+    if cost.ndim != 2 or not cost.size:
+        return []
+
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    # potentials and matching are 1-indexed, column 0 is a virtual column used while augmenting
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    matched_row = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+
+    for row in range(1, n + 1):
+        matched_row[0] = row
+        column = 0
+        min_values = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+
+        while True:
+            used[column] = True
+            current_row = matched_row[column]
+            free = ~used[1:]
+
+            reduced_costs = cost[current_row - 1] - u[current_row] - v[1:]
+            improved = free & (reduced_costs < min_values[1:])
+            min_values[1:][improved] = reduced_costs[improved]
+            way[1:][improved] = column
+
+            candidates = np.where(free, min_values[1:], np.inf)
+            next_column = int(np.argmin(candidates)) + 1
+            delta = candidates[next_column - 1]
+
+            used_columns = np.flatnonzero(used)
+            u[matched_row[used_columns]] += delta
+            v[used_columns] -= delta
+            min_values[1:][free] -= delta
+
+            column = next_column
+            if matched_row[column] == 0:
+                break
+
+        # augment along the alternating path
+        while column:
+            previous_column = way[column]
+            matched_row[column] = matched_row[previous_column]
+            column = previous_column
+
+    pairs = [(int(matched_row[column]) - 1, column - 1) for column in range(1, m + 1) if matched_row[column]]
+    if transposed:
+        pairs = [(row, column) for column, row in pairs]
+    return sorted(pairs)
@@ -0,0 +1,164 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from utility.logging_utils import sentry_debug_logger
+from utility.redis_utils import get_redis_connection
+
+
+class ReadThroughCache(object):
+    """
+    Read-through cache for rows that rarely change. Lookups go to an in-process LRU first, then to an optional
+    shared redis tier and only the remaining misses are loaded from the database, with a single batched call.
+    Entries expire after ttl seconds and can be invalidated explicitly. An invalidation only reaches the in-process
+    tier of the current process, so with redis enabled the in-process entries are kept for local_ttl seconds only
+    which bounds how long other processes can serve a stale entry.
+    """
+
+    def __init__(self, name, loader, ttl=300, max_size=1000, use_redis=False, local_ttl=None):
+        """
+        :param name: used in the redis keys, which are of the form 'HOMES_CACHE:<name>:<id>'
+        :param loader: callable taking a list of ids and returning a dict of id -> object for the ids that exist
+        """
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.local_ttl = min(local_ttl, ttl) if use_redis and local_ttl is not None else ttl
+        self.max_size = max_size
+        self.use_redis = use_redis
+
+        self._entries = OrderedDict()  # id -> (expires at, object), least recently used first
+        self._lock = threading.Lock()
+        self._stats = defaultdict(float)
+
+    def get_key(self, object_id):
+        return 'HOMES_CACHE:{}:{}'.format(self.name, object_id)
+
+    def get(self, object_id):
+        return self.get_many([object_id]).get(object_id)
+
+    def get_many(self, object_ids):
+        """
+        :return: dict of id -> object for the ids that exist
+        """
+        started_at = time.perf_counter()
+        object_ids = [object_id for object_id in set(object_ids) if object_id is not None]
+
+        result = self._get_local(object_ids)
+        missing_ids = [object_id for object_id in object_ids if object_id not in result]
+
+        if missing_ids and self.use_redis:
+            redis_result = self._get_redis(missing_ids)
+            self._set_local(redis_result)
+            result.update(redis_result)
+            missing_ids = [object_id for object_id in missing_ids if object_id not in redis_result]
+
+        if missing_ids:
+            loaded = self._load(missing_ids)
+            self._set_local(loaded)
+            if self.use_redis:
+                self._set_redis(loaded)
+            result.update(loaded)
+
+        with self._lock:
+            self._stats['requests'] += len(object_ids)
+            self._stats['misses'] += len(missing_ids)
+            self._stats['get_calls'] += 1
+            self._stats['get_seconds'] += time.perf_counter() - started_at
+        return result
+
+    def invalidate(self, object_ids):
+        with self._lock:
+            for object_id in object_ids:
+                self._entries.pop(object_id, None)
+            self._stats['invalidations'] += len(object_ids)
+
+        if self.use_redis and object_ids:
+            try:
+                get_redis_connection().delete(*[self.get_key(object_id) for object_id in object_ids])
+            except Exception as E:
+                sentry_debug_logger.error('error while invalidating {} cache: {}'.format(self.name, str(E)),
+                                          exc_info=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """ counted since the start of the current process, other processes keep their own stats """
+        with self._lock:
+            stats = dict(self._stats)
+            size = len(self._entries)
+
+        requests, get_calls, loads = stats.get('requests', 0), stats.get('get_calls', 0), stats.get('loads', 0)
+        return {
+            'name': self.name,
+            'pid': os.getpid(),
+            'size': size,
+            'requests': int(requests),
+            'local_hits': int(stats.get('local_hits', 0)),
+            'redis_hits': int(stats.get('redis_hits', 0)),
+            'misses': int(stats.get('misses', 0)),
+            'invalidations': int(stats.get('invalidations', 0)),
+            'hit_rate': (requests - stats.get('misses', 0)) / requests if requests else None,
+            'average_get_ms': 1000 * stats.get('get_seconds', 0) / get_calls if get_calls else None,
+            'average_load_ms': 1000 * stats.get('load_seconds', 0) / loads if loads else None,
+        }
+
+    def _get_local(self, object_ids):
+        result = {}
+        now = time.monotonic()
+        with self._lock:
+            for object_id in object_ids:
+                entry = self._entries.get(object_id)
+                if entry is None:
+                    continue
+                if entry[0] < now:
+                    del self._entries[object_id]
+                    continue
+                self._entries.move_to_end(object_id)
+                result[object_id] = entry[1]
+            self._stats['local_hits'] += len(result)
+        return result
+
+    def _set_local(self, objects):
+        expires_at = time.monotonic() + self.local_ttl
+        with self._lock:
+            for object_id, obj in objects.items():
+                self._entries[object_id] = (expires_at, obj)
+                self._entries.move_to_end(object_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _get_redis(self, object_ids):
+        try:
+            values = get_redis_connection().mget([self.get_key(object_id) for object_id in object_ids])
+        except Exception as E:
+            sentry_debug_logger.error('error while reading {} cache: {}'.format(self.name, str(E)), exc_info=True)
+            return {}
+
+        result = {object_id: pickle.loads(value) for object_id, value in zip(object_ids, values) if value}
+        with self._lock:
+            self._stats['redis_hits'] += len(result)
+        return result
+
+    def _set_redis(self, objects):
+        if not objects:
+            return
+        try:
+            pipe = get_redis_connection().pipeline(transaction=False)
+            for object_id, obj in objects.items():
+                pipe.setex(self.get_key(object_id), self.ttl, pickle.dumps(obj))
+            pipe.execute()
+        except Exception as E:
+            sentry_debug_logger.error('error while writing {} cache: {}'.format(self.name, str(E)), exc_info=True)
+
+    def _load(self, object_ids):
+        started_at = time.perf_counter()
+        loaded = self.loader(object_ids)
+        with self._lock:
+            self._stats['loads'] += 1
+            self._stats['load_seconds'] += time.perf_counter() - started_at
+        return loaded
@@ -0,0 +1,157 @@
+import numpy as np
+from geopy import distance
+
+EARTH_RADIUS_KM = 6371.0088
+HAVERSINE_RELATIVE_ERROR = 0.006  # the spherical distance differs from the ellipsoidal geodesic by less than 0.6%
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 6  # precision at which geohashes are stored (~1.2km x 0.6km cells)
+GEOHASH_MAX_COVERING_CELLS = 16  # max number of cells used to cover a bounding box in a query
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    :return: geohash string of given precision for the given coordinates
+    """
+    latitude_range, longitude_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = []
+    bits, bit_count, even = 0, 0, True
+
+    while len(geohash) < precision:
+        if even:
+            mid = (longitude_range[0] + longitude_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                longitude_range[0] = mid
+            else:
+                bits = bits << 1
+                longitude_range[1] = mid
+        else:
+            mid = (latitude_range[0] + latitude_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                latitude_range[0] = mid
+            else:
+                bits = bits << 1
+                latitude_range[1] = mid
+
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+
+    return ''.join(geohash)
+
+
+def get_geohash_cell_size(precision):
+    """
+    :return: (latitude degrees, longitude degrees) spanned by a single geohash cell of given precision
+    """
+    total_bits = 5 * precision
+    longitude_bits = (total_bits + 1) // 2
+    latitude_bits = total_bits // 2
+    return 180.0 / (2 ** latitude_bits), 360.0 / (2 ** longitude_bits)
+
+
+def get_covering_geohashes(min_latitude, min_longitude, max_latitude, max_longitude, precision):
+    """
+    :return: set of geohashes of given precision whose cells together cover the bounding box
+    """
+    latitude_step, longitude_step = get_geohash_cell_size(precision)
+    min_latitude, max_latitude = max(min_latitude, -90.0), min(max_latitude, 90.0)
+    min_longitude, max_longitude = max(min_longitude, -180.0), min(max_longitude, 180.0)
+
+    latitudes = []
+    latitude = min_latitude
+    while latitude < max_latitude:
+        latitudes.append(latitude)
+        latitude += latitude_step
+    latitudes.append(max_latitude)
+
+    longitudes = []
+    longitude = min_longitude
+    while longitude < max_longitude:
+        longitudes.append(longitude)
+        longitude += longitude_step
+    longitudes.append(max_longitude)
+
+    return {encode_geohash(latitude, longitude, precision) for latitude in latitudes for longitude in longitudes}
+
+
+def get_geohash_prefixes_for_bounding_box(min_latitude, min_longitude, max_latitude, max_longitude,
+                                          max_cells=GEOHASH_MAX_COVERING_CELLS):
+    """
+    Finds the finest set of geohash prefixes (at most max_cells of them) that covers the bounding box. Rows whose
+    stored geohash starts with any of these prefixes are candidates for lying inside the bounding box.
+    """
+    prefixes = set()
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        geohashes = get_covering_geohashes(min_latitude, min_longitude, max_latitude, max_longitude, precision)
+        if len(geohashes) > max_cells:
+            break
+        prefixes = geohashes
+    return prefixes
+
+
+def haversine_distances(latitude, longitude, latitudes, longitudes):
+    """
+    :return: numpy array of great circle distances (in km) from (latitude, longitude) to each of the given points.
+             Points with missing coordinates get a distance of nan.
+    """
+    latitude, longitude = np.radians(float(latitude)), np.radians(float(longitude))
+    latitudes = np.radians(np.asarray(latitudes, dtype=float))
+    longitudes = np.radians(np.asarray(longitudes, dtype=float))
+
+    a = np.sin((latitudes - latitude) / 2) ** 2 + \
+        np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def rank_by_distance(latitude, longitude, candidates, distance_range=None, limit=None, geodesic_refinement=0):
+    """
+    Ranks candidates by their distance from (latitude, longitude) in a single vectorized pass.
+
+    :param candidates: iterable of (id, latitude, longitude), e.g. a values_list() queryset
+    :param distance_range: candidates farther than this (in km) are dropped
+    :param limit: if provided only the nearest `limit` candidates are returned
+    :param geodesic_refinement: number of top candidates whose distance is recomputed with the exact
+                                ellipsoidal geodesic and re-sorted
+    :return: list of (id, distance in km) sorted by distance, then by id
+    """
+    candidates = list(candidates)
+    if not candidates:
+        return []
+
+    ids, latitudes, longitudes = zip(*candidates)
+    distances = haversine_distances(latitude, longitude, latitudes, longitudes)
+
+    # refined distances may differ from haversine ones, so candidates within that margin of the range and of the
+    # limit are kept until the final distances are known
+    margin = 1 + HAVERSINE_RELATIVE_ERROR if geodesic_refinement else 1
+    indices = np.flatnonzero(~np.isnan(distances))
+    if distance_range is not None:
+        indices = indices[distances[indices] <= distance_range * margin]
+
+    if limit is not None and limit < len(indices):
+        if limit > 0:
+            limit_distance = distances[indices][np.argpartition(distances[indices], limit - 1)[limit - 1]]
+            # every candidate tied with the last one kept stays, the id decides between them
+            indices = indices[distances[indices] <= limit_distance * margin]
+        else:
+            indices = indices[:0]
+
+    # ties are broken by id so that the order is the same on every run
+    indices = indices[np.lexsort((np.asarray(ids)[indices], distances[indices]))]
+    result = [(ids[index], float(distances[index])) for index in indices]
+
+    if geodesic_refinement:
+        for position, index in enumerate(indices[:geodesic_refinement]):
+            exact_distance = distance.distance((latitude, longitude), (latitudes[index], longitudes[index])).km
+            result[position] = (ids[index], exact_distance)
+        result.sort(key=lambda x: (x[1], x[0]))
+        if distance_range is not None:
+            result = [(candidate_id, exact_distance) for candidate_id, exact_distance in result
+                      if exact_distance <= distance_range]
+
+    return result[:limit] if limit is not None else result
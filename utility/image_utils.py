@@ -1,38 +1,151 @@
 from io import BytesIO
 
-from PIL import Image as Img
+from PIL import Image as Img, ImageOps, features
 
+COMPRESSED_IMAGE_HEIGHT = 400
+THUMBNAIL_HEIGHT = 100
+THUMBNAIL_QUALITY = 85
 
-def compress_image(image, quality=80, _create_thumbnail=False):
-    img = Img.open(BytesIO(image.read()))
+# file extension of each format in which renditions can be encoded
+RENDITION_FORMAT_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+
+def run_in_native_thread(func, *args, **kwargs):
+    """
+    Runs cpu bound image work in the pool of native threads of eventlet when the process is monkey patched by it, as
+    in the eventlet workers of gunicorn, so that decoding and encoding do not block the hub and every other request of
+    the worker. Runs it inline otherwise.
+    """
+    try:
+        from eventlet import patcher, tpool
+    except ImportError:
+        return func(*args, **kwargs)
+    if patcher.is_monkey_patched('thread'):
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+
+def get_scaled_size(size, height):
+    width, original_height = size
+    return int((width / original_height) * height), height
+
+
+def get_rendition_size(size, width):
+    original_width, height = size
+    return width, max(1, round(height * width / original_width))
+
+
+def open_image(image, get_largest_size):
+    """
+    Opens the image straight from its file object, without copying the whole file into memory first. JPEGs are
+    decoded in draft mode at the smallest 1/2, 1/4 or 1/8 scale that still covers the largest size needed, so a large
+    photo is never decoded at full resolution.
+
+    :param get_largest_size: called with the size of the original, returns the largest size that will be made from it
+    :return: (image, size of the original image)
+    """
+    image.seek(0)
+    img = Img.open(image)
+    original_size = img.size
+    img.draft('RGB', get_largest_size(original_size))
     if img.mode != 'RGB':
         img = img.convert('RGB')
+    return img, original_size
+
+
+def get_fitted_size(size, max_side):
+    scale = min(1, max_side / max(size))
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def get_compressed_image_size(size):
+    return get_scaled_size(size, min(COMPRESSED_IMAGE_HEIGHT, size[1]))
+
+
+def get_rendition_widths(size, widths):
+    # renditions are never wider than the original
+    return sorted({min(width, size[0]) for width in widths}, reverse=True)
+
+
+def encode_image(img, image_format, quality):
     output = BytesIO()
-    h, w = img.size
-    new_width = min(400, w)
-    img = img.resize((int((h / w) * new_width), new_width), Img.ANTIALIAS)
-    img.save(output, format='JPEG', quality=quality, optimize=True)
+    if image_format == 'JPEG':
+        img.save(output, format=image_format, quality=quality, optimize=True)
+    else:
+        img.save(output, format=image_format, quality=quality)
+    return output
+
+
+def get_supported_rendition_formats(formats):
+    return {image_format: quality for image_format, quality in formats.items()
+            if image_format != 'WEBP' or features.check('webp')}
+
+
+def compress_image(image, quality=80, _create_thumbnail=False, delete_original=True):
+    img, original_size = open_image(image, get_compressed_image_size)
+    img = img.resize(get_compressed_image_size(original_size), Img.LANCZOS)
+    output = encode_image(img, 'JPEG', quality)
     temp_name = image.name
 
     if _create_thumbnail:
-        thumbnail = BytesIO()
-        img = img.resize((int((h / w) * 100), 100), Img.ANTIALIAS)
-        img.save(thumbnail, format='JPEG', quality=100, optimize=True)
-        image.delete(save=False)
+        img = img.resize(get_scaled_size(original_size, THUMBNAIL_HEIGHT), Img.LANCZOS)
+        thumbnail = encode_image(img, 'JPEG', THUMBNAIL_QUALITY)
+        if delete_original:
+            image.delete(save=False)
         return temp_name, output, thumbnail
 
-    image.delete(save=False)
+    if delete_original:
+        image.delete(save=False)
     return temp_name, output
 
 
+def create_image_renditions(image, widths, formats, quality=80):
+    """
+    Makes the compressed image and the thumbnail of compress_image together with responsive renditions of the given
+    widths in every given format, all from a single decode of the original. Each rendition is resized from the next
+    larger one.
+
+    :param formats: dict of PIL format name -> quality, formats the PIL build cannot encode are skipped
+    :return: (compressed image, thumbnail, dict of format -> dict of width -> encoded rendition)
+    """
+    def get_largest_size(size):
+        compressed_size = get_compressed_image_size(size)
+        rendition_size = get_rendition_size(size, get_rendition_widths(size, widths)[0])
+        return max(compressed_size[0], rendition_size[0]), max(compressed_size[1], rendition_size[1])
+
+    img, original_size = open_image(image, get_largest_size)
+
+    compressed_img = img.resize(get_compressed_image_size(original_size), Img.LANCZOS)
+    compressed = encode_image(compressed_img, 'JPEG', quality)
+    thumbnail = encode_image(compressed_img.resize(get_scaled_size(original_size, THUMBNAIL_HEIGHT), Img.LANCZOS),
+                             'JPEG', THUMBNAIL_QUALITY)
+
+    formats = get_supported_rendition_formats(formats)
+    renditions = {image_format: {} for image_format in formats}
+    for width in get_rendition_widths(original_size, widths):
+        img = img.resize(get_rendition_size(original_size, width), Img.LANCZOS)
+        for image_format, format_quality in formats.items():
+            renditions[image_format][width] = encode_image(img, image_format, format_quality)
+
+    return compressed, thumbnail, renditions
+
+
+def downscale_image(image, max_side, quality=80):
+    """
+    Re-encodes the image as a JPEG whose longer side is at most max_side, turned upright as per its EXIF
+    orientation since the EXIF data is not kept.
+    """
+    img, original_size = open_image(image, lambda size: get_fitted_size(size, max_side))
+    size = get_fitted_size(original_size, max_side)
+    if img.size != size:
+        img = img.resize(size, Img.LANCZOS)
+    return encode_image(ImageOps.exif_transpose(img), 'JPEG', quality)
+
+
 def create_thumbnail(image):
-    img = Img.open(BytesIO(image.read()))
-    if img.mode != 'RGB':
-        img = img.convert('RGB')
-    h, w = img.size
+    img, original_size = open_image(image, lambda size: get_scaled_size(size, THUMBNAIL_HEIGHT))
     temp_name = image.name
 
-    thumbnail = BytesIO()
-    img = img.resize((int((h / w) * 100), 100), Img.ANTIALIAS)
-    img.save(thumbnail, format='JPEG', quality=100, optimize=True)
+    img = img.resize(get_scaled_size(original_size, THUMBNAIL_HEIGHT), Img.LANCZOS)
+    thumbnail = encode_image(img, 'JPEG', THUMBNAIL_QUALITY)
     return temp_name, thumbnail
@@ -0,0 +1,20 @@
+from unittest import mock
+
+import fakeredis
+
+# modules which import get_redis_connection by name, the others call it through utility.redis_utils
+REDIS_CONNECTION_MODULES = ('utility.redis_utils', 'utility.cache_utils', 'scouts.utils', 'chat.presence',
+                            'chat.utils')
+
+
+class FakeRedisMixin:
+    """ Points every get_redis_connection() of a test case to a fresh in-memory redis, available as self.redis """
+
+    def setUp(self):
+        super().setUp()
+        self.redis = fakeredis.FakeStrictRedis()
+        self.redis.flushall()
+        for module in REDIS_CONNECTION_MODULES:
+            patcher = mock.patch(module + '.get_redis_connection', return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
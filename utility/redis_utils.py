@@ -3,48 +3,114 @@ import json
 import pickle
 import requests
 from decouple import config
-from redis import StrictRedis
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from redis import StrictRedis, ConnectionPool
 
 from utility.logging_utils import sentry_debug_logger
 from utility.render_response_utils import STATUS, SUCCESS, ERROR
 
 
+REDIS_SOCKET_TIMEOUT = 2  # seconds
+
+_redis_connection_pools = {}
+
+
+def get_redis_connection(url=None):
+    """
+    :return: StrictRedis client for our own redis server backed by a process wide connection pool
+    """
+    url = url or settings.REDIS_URL
+    if url not in _redis_connection_pools:
+        _redis_connection_pools[url] = ConnectionPool.from_url(url, socket_timeout=REDIS_SOCKET_TIMEOUT,
+                                                               socket_connect_timeout=REDIS_SOCKET_TIMEOUT)
+    return StrictRedis(connection_pool=_redis_connection_pools[url])
+
+
+CONSUMER_APP_REDIS_HTTP = 'http'
+CONSUMER_APP_REDIS_DIRECT = 'direct'
+
+# redis commands that can be forwarded to the consumer app, computed once instead of on every attribute access
+CONSUMER_APP_REDIS_COMMANDS = frozenset(func for func in dir(StrictRedis) if
+                                        not func.startswith("__") and callable(getattr(StrictRedis, func)))
+
+# publishes ARGV[2] on channel ARGV[1] only if the presence key KEYS[1] of the receiver is set
+PUBLISH_IF_ONLINE_SCRIPT = """
+if redis.call('get', KEYS[1]) then
+    redis.call('publish', ARGV[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
 class ConsumerAppRedis:
-    """ it is a dummy Redis Class that only executes redis functions from consumer app and return results """
+    """
+    it is a dummy Redis Class that only executes redis functions from consumer app and return results.
+    All instances share one keep-alive http session.
+    """
+
+    _session = None
+
+    @classmethod
+    def get_session(cls):
+        if cls._session is None:
+            session = requests.Session()
+            session.headers.update({'Content-type': 'application/json'})
+            session.auth = (config('HOMES_ADMIN_USERNAME'), config('HOMES_ADMIN_PASSWORD'))
+            cls._session = session
+        return cls._session
 
     def __getattr__(self, attr):
-        # if attr in ['get', 'publish']:
-        if attr in [func for func in dir(StrictRedis) if
-                    callable(getattr(StrictRedis, func)) and not func.startswith("__")]:
+        if attr in CONSUMER_APP_REDIS_COMMANDS:
             def func(*args, **kwargs):
-                sentry_debug_logger.debug(str(attr) + " called with args=" + str(args) + " and kwargs=" + str(kwargs),
-                                          exc_info=True)
-
-                x = requests.post(config('HOMES_REDISAPI_EVENT_URL'),
-                                  headers={'Content-type': 'application/json'},
-                                  data=json.dumps({'attr': attr, 'args': args, 'kwargs': kwargs}),
-                                  auth=(config('HOMES_ADMIN_USERNAME'), config('HOMES_ADMIN_PASSWORD')))
-
-                response = x.json()
-                if response[STATUS] == SUCCESS:
-                    result = response['result']
-                    result_type = response['result_type']
-                    if result_type == 'bytes':
-                        result = result.encode()
-                        response['result'] = result
-
-                    return response['result']
-
-                elif response[STATUS] == ERROR:
-                    message = response['message']
-                    exception = response['exception']
-                    print("error occurs with message" + str(message))
-                    unpickled_exception = pickle.loads(codecs.decode(exception.encode(), "base64"))
-                    raise unpickled_exception
+                return self.execute(attr, *args, **kwargs)
 
             return func
 
         raise NotImplementedError
 
+    def execute(self, attr, *args, **kwargs):
+        sentry_debug_logger.debug(str(attr) + " called with args=" + str(args) + " and kwargs=" + str(kwargs))
+
+        x = self.get_session().post(config('HOMES_REDISAPI_EVENT_URL'),
+                                    data=json.dumps({'attr': attr, 'args': args, 'kwargs': kwargs}),
+                                    timeout=settings.CONSUMER_APP_REDIS_TIMEOUT)
+
+        response = x.json()
+        if response[STATUS] == SUCCESS:
+            result = response['result']
+            result_type = response['result_type']
+            if result_type == 'bytes':
+                result = result.encode()
+                response['result'] = result
+
+            return response['result']
+
+        elif response[STATUS] == ERROR:
+            message = response['message']
+            exception = response['exception']
+            sentry_debug_logger.error("error occurs with message" + str(message))
+            unpickled_exception = pickle.loads(codecs.decode(exception.encode(), "base64"))
+            raise unpickled_exception
+
+
+def get_consumer_app_redis():
+    """
+    :return: client for the redis server of the consumer app, either a direct pooled StrictRedis or a proxy which
+             forwards each command over http, as configured by CONSUMER_APP_REDIS_BACKEND
+    """
+    if settings.CONSUMER_APP_REDIS_BACKEND == CONSUMER_APP_REDIS_DIRECT:
+        # get_redis_connection falls back to our own redis without a url
+        if not settings.CONSUMER_APP_REDIS_URL:
+            raise ImproperlyConfigured('CONSUMER_APP_REDIS_URL is required by the direct consumer app redis backend')
+        return get_redis_connection(settings.CONSUMER_APP_REDIS_URL)
+    return ConsumerAppRedis()
+
 
-myinstance = ConsumerAppRedis()
+def publish_if_online(r, presence_key, channel, message):
+    """
+    Checks the presence key and publishes the message in a single round trip
+    :return: True if the receiver was online and the message was published
+    """
+    return bool(int(r.eval(PUBLISH_IF_ONLINE_SCRIPT, 1, presence_key, channel, message)))
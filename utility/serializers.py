@@ -23,3 +23,19 @@ class JSONSerializerField(serializers.Field):
 
     def to_representation(self, value):
         return value
+
+
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """ Urls of the responsive renditions of an image as {format: {width: url}}, from the storage names kept in a
+    renditions JSONField. Reads the whole instance so the urls come from the storage of the image field """
+
+    def __init__(self, image_field='image', renditions_field='renditions', **kwargs):
+        self.image_field = image_field
+        self.renditions_field = renditions_field
+        kwargs['source'] = '*'
+        super(ImageRenditionsField, self).__init__(**kwargs)
+
+    def to_representation(self, instance):
+        storage = getattr(instance, self.image_field).storage
+        return {image_format: {width: storage.url(name) for width, name in renditions.items()}
+                for image_format, renditions in (getattr(instance, self.renditions_field) or {}).items()}
@@ -0,0 +1,90 @@
+import re
+
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from django.utils.text import get_valid_filename
+
+from utility.random_utils import generate_random_code
+
+UPLOAD_POLICY_SALT = 'utility.upload_utils.upload_policy'
+UPLOAD_TOKEN_SALT = 'utility.upload_utils.upload_token'
+
+LOCAL_UPLOAD_URL_NAME = 'local_direct_upload'
+
+S3_STORAGE_CLASS = 'storages.backends.s3boto3.S3Boto3Storage'
+
+
+def get_direct_upload_name(prefix, filename):
+    return '{}/{}-{}'.format(prefix, generate_random_code(n=10),
+                              get_valid_filename(filename.split('/')[-1]))
+
+
+def is_s3_storage(storage):
+    # compared by name so that processes storing media elsewhere, e.g. development servers, never import boto3
+    return any('{}.{}'.format(cls.__module__, cls.__name__) == S3_STORAGE_CLASS for cls in storage.__class__.__mro__)
+
+
+def get_s3_post_fields(storage, content_type):
+    fields = {'Content-Type': content_type}
+    if storage.default_acl:
+        fields['acl'] = storage.default_acl
+    # object parameters are named as boto3 arguments, e.g. CacheControl is sent as the Cache-Control field
+    for parameter, value in storage.object_parameters.items():
+        fields[re.sub(r'(?<!^)(?=[A-Z])', '-', parameter)] = value
+    return fields
+
+
+def create_presigned_upload(storage, name, content_type, max_size=None, expires_in=None, policy_data=None):
+    """
+    Lets a client upload a file straight to the storage under the given name, without the file passing through a web
+    worker. S3 storages give a presigned POST. Other storages, as used in development and tests, give the local
+    upload view, which checks an equivalent signed policy.
+
+    :param policy_data: signed into the policy of the local upload view along with the key, e.g. to tell it the
+                        storage in which the file is saved
+
+    :return: dict with the 'url' to which the file is POSTed as 'file', along with the form 'fields'
+    """
+    max_size = max_size or settings.DIRECT_UPLOAD_MAX_SIZE
+    expires_in = expires_in or settings.DIRECT_UPLOAD_EXPIRY
+
+    if is_s3_storage(storage):
+        fields = get_s3_post_fields(storage, content_type)
+        conditions = [{field: value} for field, value in fields.items()]
+        conditions.append(['content-length-range', 1, max_size])
+        return storage.bucket.meta.client.generate_presigned_post(
+            storage.bucket.name, storage._normalize_name(storage._clean_name(name)), Fields=fields,
+            Conditions=conditions, ExpiresIn=expires_in)
+
+    policy = signing.dumps(dict(policy_data or {}, key=name, content_type=content_type, max_size=max_size),
+                           salt=UPLOAD_POLICY_SALT)
+    return {'url': reverse(LOCAL_UPLOAD_URL_NAME), 'fields': {'key': name, 'policy': policy}}
+
+
+def read_local_upload_policy(key, policy):
+    """
+    :return: policy of the local upload view for the key, None if the policy is invalid, expired or of another key
+    """
+    try:
+        data = signing.loads(policy, salt=UPLOAD_POLICY_SALT, max_age=settings.DIRECT_UPLOAD_EXPIRY)
+    except signing.BadSignature:
+        return None
+    if data['key'] != key:
+        return None
+    return data
+
+
+def create_upload_token(data):
+    """ signs the data needed to finalize an upload, so that clients can only finalize the uploads given to them """
+    return signing.dumps(data, salt=UPLOAD_TOKEN_SALT)
+
+
+def read_upload_token(token):
+    """
+    :return: data of the upload token, None if the token is invalid or expired
+    """
+    try:
+        return signing.loads(token, salt=UPLOAD_TOKEN_SALT, max_age=settings.DIRECT_UPLOAD_FINALIZE_EXPIRY)
+    except signing.BadSignature:
+        return None